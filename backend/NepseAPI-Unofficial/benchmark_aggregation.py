@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+"""
+Sector Aggregation Micro-benchmark
+
+Compares the shared single-pass roll-up in market_aggregation.py against
+the previous nested sector x scrip loop on a synthetic 600-scrip market.
+
+Usage: python benchmark_aggregation.py [--scrips 600] [--repeat 200]
+"""
+
+import argparse
+import random
+import timeit
+
+from market_aggregation import SECTOR_INDEX_MAP, build_market_summary
+
+
+def make_market(n_scrips: int, seed: int = 7) -> dict:
+    """Synthetic upstream payloads shaped like the AsyncNepse responses"""
+    rng = random.Random(seed)
+    sectors = list(SECTOR_INDEX_MAP)
+    symbols = [f"SYM{i:04d}" for i in range(n_scrips)]
+    companies = [{
+        "symbol": symbol,
+        "sectorName": sectors[i % len(sectors)],
+        "securityName": f"{symbol} Limited",
+        "instrumentType": "Equity",
+    } for i, symbol in enumerate(symbols)]
+
+    def pick(k):
+        return rng.sample(symbols, k)
+
+    return {
+        "CompanyList": companies,
+        "TopTenTurnoverScrips": [{"symbol": s, "turnover": rng.uniform(1e5, 1e8)} for s in pick(n_scrips // 2)],
+        "TopTenTransactionScrips": [{"symbol": s, "totalTrades": rng.randint(1, 5000)} for s in pick(n_scrips // 2)],
+        "TopTenTradeScrips": [{"symbol": s, "shareTraded": rng.randint(10, 500000)} for s in pick(n_scrips // 2)],
+        "TopGainers": [{"symbol": s, "pointChange": 5, "percentageChange": 1.2, "ltp": 500} for s in symbols[: n_scrips // 3]],
+        "TopLosers": [{"symbol": s, "pointChange": -5, "percentageChange": -1.2, "ltp": 480} for s in symbols[n_scrips // 3: 2 * n_scrips // 3]],
+        "PriceVolume": [{"symbol": s, "previousClose": 490, "lastUpdatedDateTime": "2025-08-24 14:59:59"} for s in symbols],
+        "NepseSubIndices": {name: {"index": name, "currentValue": 1000.0} for name in SECTOR_INDEX_MAP.values()},
+    }
+
+
+def legacy_summary(upstream: dict) -> dict:
+    """The roll-up as it was implemented inline in server.py / socketServer.py"""
+    companies = {company["symbol"]: company for company in upstream["CompanyList"]}
+    turnover = {obj["symbol"]: obj for obj in upstream["TopTenTurnoverScrips"]}
+    transaction = {obj["symbol"]: obj for obj in upstream["TopTenTransactionScrips"]}
+    trade = {obj["symbol"]: obj for obj in upstream["TopTenTradeScrips"]}
+    gainers = {obj["symbol"]: obj for obj in upstream["TopGainers"]}
+    losers = {obj["symbol"]: obj for obj in upstream["TopLosers"]}
+    price_vol_info = {obj["symbol"]: obj for obj in upstream["PriceVolume"]}
+    sector_sub_indices = upstream["NepseSubIndices"]
+
+    scrips_details = {}
+    for symbol, company in companies.items():
+        company_details = {
+            "symbol": symbol,
+            "sector": company["sectorName"],
+            "Turnover": turnover.get(symbol, {}).get("turnover", 0),
+            "transaction": transaction.get(symbol, {}).get("totalTrades", 0),
+            "volume": trade.get(symbol, {}).get("shareTraded", 0),
+            "previousClose": price_vol_info.get(symbol, {}).get("previousClose", 0),
+            "lastUpdatedDateTime": price_vol_info.get(symbol, {}).get("lastUpdatedDateTime", 0),
+            "name": company.get("securityName", ""),
+            "category": company.get("instrumentType"),
+        }
+        if symbol in gainers:
+            company_details.update({k: gainers[symbol][k] for k in ("pointChange", "percentageChange", "ltp")})
+        elif symbol in losers:
+            company_details.update({k: losers[symbol][k] for k in ("pointChange", "percentageChange", "ltp")})
+        else:
+            company_details.update({"pointChange": 0, "percentageChange": 0, "ltp": 0})
+        if company_details["ltp"] == 0 or company_details["previousClose"] == 0:
+            continue
+        scrips_details[symbol] = company_details
+
+    sector_details = {}
+    for sector in {company["sectorName"] for company in companies.values()}:
+        total_trades, total_trade_quantity, total_turnover = 0, 0, 0
+        for scrip_details in scrips_details.values():
+            if scrip_details["sector"] == sector:
+                total_trades += scrip_details["transaction"]
+                total_trade_quantity += scrip_details["volume"]
+                total_turnover += scrip_details["Turnover"]
+        sector_details[sector] = {
+            "transaction": total_trades,
+            "volume": total_trade_quantity,
+            "totalTurnover": total_turnover,
+            "turnover": sector_sub_indices.get(SECTOR_INDEX_MAP.get(sector, sector)),
+            "sectorName": sector,
+        }
+    return {"scripsDetails": scrips_details, "sectorsDetails": sector_details}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sector aggregation")
+    parser.add_argument("--scrips", type=int, default=600, help="Number of synthetic scrips")
+    parser.add_argument("--repeat", type=int, default=200, help="Iterations per timing run")
+    args = parser.parse_args()
+
+    upstream = make_market(args.scrips)
+
+    # Both implementations must agree before timing means anything
+    legacy, current = legacy_summary(upstream), build_market_summary(upstream)
+    assert legacy["scripsDetails"] == current["scripsDetails"], "scrip details differ"
+    assert legacy["sectorsDetails"] == current["sectorsDetails"], "sector details differ"
+
+    print(f"Sector aggregation benchmark: {args.scrips} scrips, {len(SECTOR_INDEX_MAP)} sectors")
+    print("=" * 50)
+    results = {}
+    for name, fn in (("legacy (sectors x scrips)", legacy_summary), ("single pass", build_market_summary)):
+        best = min(timeit.repeat(lambda: fn(upstream), number=args.repeat, repeat=5)) / args.repeat
+        results[name] = best
+        print(f"{name:<28} {best * 1e6:10.1f} us/call")
+
+    legacy_time, current_time = results.values()
+    print(f"\nSpeed-up: {legacy_time / current_time:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Response Compression Benchmark
+
+Measures bytes on the wire and CPU cost per request for large market
+payloads (LiveMarket, SecurityList, Floorsheet, an index graph):
+
+  - before:        json.dumps on every request, sent uncompressed
+  - per-request:   json.dumps + gzip on every request (what a generic
+                   compression middleware would do)
+  - after:         Payload variants encoded/compressed once per snapshot,
+                   each request only negotiates and picks the bytes
+
+Usage: python benchmark_compression.py [--requests 500]
+"""
+
+import argparse
+import gzip
+import json
+import random
+import time
+
+import payloads
+from payloads import Payload, negotiate_encoding
+
+
+def synthetic_payloads(seed: int = 11) -> dict:
+    rng = random.Random(seed)
+    symbols = [f"SYM{i:03d}" for i in range(320)]
+    live_market = [{
+        "securityId": str(1000 + i), "securityName": f"{s} Limited", "symbol": s, "indexId": 51,
+        "openPrice": 500.0, "highPrice": 512.3, "lowPrice": 495.1,
+        "totalTradeQuantity": rng.randint(0, 200000), "totalTradeValue": rng.uniform(0, 1e8),
+        "lastTradedPrice": round(rng.uniform(100, 2000), 1), "percentageChange": round(rng.uniform(-10, 10), 2),
+        "lastUpdatedDateTime": "2025-08-24T14:59:58.123", "lastTradedVolume": rng.randint(10, 5000),
+        "previousClose": 501.0, "averageTradedPrice": 503.4,
+    } for i, s in enumerate(symbols)]
+    security_list = [{
+        "id": 1000 + i, "symbol": s, "securityName": f"{s} Limited", "name": f"{s} Limited",
+        "activeStatus": "A",
+    } for i, s in enumerate(symbols)]
+    floorsheet = [{
+        "contractId": 100000000 + i, "stockSymbol": rng.choice(symbols),
+        "buyerMemberId": str(rng.randint(1, 90)), "sellerMemberId": str(rng.randint(1, 90)),
+        "contractQuantity": rng.randint(10, 2000), "contractRate": round(rng.uniform(100, 2000), 1),
+        "contractAmount": round(rng.uniform(1e3, 1e6), 2), "businessDate": "2025-08-24",
+        "tradeBookId": 2000000 + i, "stockId": rng.randint(100, 3000),
+        "buyerBrokerName": "Broker Securities Pvt. Ltd.", "sellerBrokerName": "Another Broker Ltd.",
+        "tradeTime": "2025-08-24T14:%02d:%02d" % (rng.randint(0, 59), rng.randint(0, 59)),
+        "securityName": "Some Company Limited",
+    } for i in range(20000)]
+    index_graph = [[1724480000 + 60 * i, round(2700 + rng.uniform(-20, 20), 2)] for i in range(240)]
+    return {
+        "LiveMarket": live_market,
+        "SecurityList": security_list,
+        "Floorsheet": floorsheet,
+        "DailyNepseIndexGraph": index_graph,
+    }
+
+
+def per_request_cost(fn, requests: int) -> float:
+    start = time.perf_counter()
+    for _ in range(requests):
+        fn()
+    return (time.perf_counter() - start) / requests
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark response compression")
+    parser.add_argument("--requests", type=int, default=500, help="Simulated requests per route")
+    args = parser.parse_args()
+
+    accept = "gzip, deflate, br" if payloads.brotli is not None else "gzip, deflate"
+    print(f"Compression benchmark ({args.requests} requests per route, Accept-Encoding: {accept})")
+    print(f"orjson: {'yes' if payloads.orjson else 'no'}, brotli: {'yes' if payloads.brotli else 'no'}")
+    print("=" * 96)
+    print(f"{'route':<22}{'before B':>11}{'after B':>11}{'ratio':>8}"
+          f"{'before us':>12}{'per-req gz us':>15}{'after us':>10}{'1st build ms':>14}")
+
+    # Floorsheet is heavy; fewer iterations keep the run short
+    for route, data in synthetic_payloads().items():
+        requests = max(5, args.requests // 50) if route == "Floorsheet" else args.requests
+
+        before_bytes = len(json.dumps(data).encode("utf-8"))
+        before_cost = per_request_cost(lambda: json.dumps(data).encode("utf-8"), requests)
+        per_request_gzip = per_request_cost(lambda: gzip.compress(json.dumps(data).encode("utf-8"), 6), max(3, requests // 10))
+
+        payload = Payload(data)
+        build_start = time.perf_counter()
+        encoding = negotiate_encoding(accept, len(payload.body))
+        payload.encoded(encoding)
+        payload.etag
+        build_cost = time.perf_counter() - build_start
+
+        def serve():
+            chosen = negotiate_encoding(accept, len(payload.body))
+            return payload.etag_for(chosen), payload.encoded(chosen)
+
+        after_cost = per_request_cost(serve, requests)
+        after_bytes = len(payload.encoded(encoding))
+
+        print(f"{route:<22}{before_bytes:>11,}{after_bytes:>11,}{before_bytes / after_bytes:>7.1f}x"
+              f"{before_cost * 1e6:>12.1f}{per_request_gzip * 1e6:>15.1f}{after_cost * 1e6:>10.2f}{build_cost * 1e3:>14.2f}")
+
+    print("\n'1st build' is paid once per cached snapshot, not per request.")
+
+
+if __name__ == "__main__":
+    main()
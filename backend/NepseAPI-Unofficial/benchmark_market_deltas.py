@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""
+LiveMarket Delta Benchmark
+
+Measures what the LiveMarketDelta topic saves over pushing the full
+LiveMarket snapshot on every poll.
+
+  record   poll getLiveMarket during a trading session and save every
+           snapshot to a gzipped JSON-lines file
+  measure  replay a recording through DeltaEncoder: bytes per frame for
+           full snapshots vs deltas, raw and deflated with one shared
+           context (as permessage-deflate does), and a check that
+           applying the deltas rebuilds every snapshot exactly
+
+Usage:
+  python benchmark_market_deltas.py record session.jsonl.gz [--interval 5] [--duration 18000]
+  python benchmark_market_deltas.py measure session.jsonl.gz
+  python benchmark_market_deltas.py measure --synthetic 500     # no recording at hand
+"""
+
+import argparse
+import asyncio
+import gzip
+import json
+import random
+import time
+import zlib
+
+from market_deltas import DeltaEncoder, apply_delta, index_rows
+from payloads import encode_json
+
+
+async def record(path, interval, duration):
+    from nepse import AsyncNepse
+    from market_hours import is_open_status
+
+    nepse = AsyncNepse()
+    nepse.setTLSVerification(False)
+    deadline = time.time() + duration
+    count = 0
+    with gzip.open(path, "wt", encoding="utf-8") as f:
+        while time.time() < deadline:
+            started = time.time()
+            try:
+                if not is_open_status(await nepse.isNepseOpen()):
+                    print("Market closed, stopping")
+                    break
+                data = await nepse.getLiveMarket()
+                f.write(json.dumps({"t": started, "data": data}) + "\n")
+                count += 1
+                print(f"\r{count} snapshots", end="", flush=True)
+            except Exception as e:
+                print(f"\nPoll failed: {e}")
+            await asyncio.sleep(max(0.0, interval - (time.time() - started)))
+    print(f"\nSaved {count} snapshots to {path}")
+
+
+def load_recording(path):
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        return [json.loads(line)["data"] for line in f if line.strip()]
+
+
+def synthetic_session(polls, securities=300, seed=11):
+    """Random-walk session shaped like getLiveMarket: a few rows trade between polls"""
+    rng = random.Random(seed)
+    rows = [{
+        "securityId": 100 + i, "securityName": f"Security {i} Limited", "symbol": f"SYM{i}", "indexId": 51 + i % 13,
+        "openPrice": 500.0, "highPrice": 500.0, "lowPrice": 500.0, "totalTradeQuantity": 0,
+        "totalTradeValue": 0.0, "lastTradedPrice": 500.0, "percentageChange": 0.0,
+        "lastUpdatedDateTime": "2025-08-24T11:00:00", "lastTradedVolume": 0, "previousClose": 500.0,
+        "averageTradedPrice": 500.0,
+    } for i in range(securities)]
+    session = []
+    for poll in range(polls):
+        rows = [dict(row) for row in rows]
+        for row in rng.sample(rows, k=max(1, int(securities * rng.uniform(0.02, 0.15)))):
+            volume = rng.randint(10, 2000)
+            price = round(row["lastTradedPrice"] * (1 + rng.gauss(0, 0.003)), 1)
+            row["lastTradedPrice"] = price
+            row["highPrice"] = max(row["highPrice"], price)
+            row["lowPrice"] = min(row["lowPrice"], price)
+            row["lastTradedVolume"] = volume
+            row["totalTradeQuantity"] += volume
+            row["totalTradeValue"] = round(row["totalTradeValue"] + volume * price, 2)
+            row["averageTradedPrice"] = round(row["totalTradeValue"] / row["totalTradeQuantity"], 2)
+            row["percentageChange"] = round((price / row["previousClose"] - 1) * 100, 2)
+            row["lastUpdatedDateTime"] = f"2025-08-24T11:{poll // 12 % 60:02d}:{poll * 5 % 60:02d}"
+        session.append(rows)
+    return session
+
+
+def measure(session):
+    encoder = DeltaEncoder("LiveMarketDelta")
+    full_deflate = zlib.compressobj(wbits=-15)
+    delta_deflate = zlib.compressobj(wbits=-15)
+    full_bytes = delta_bytes = full_wire = delta_wire = 0
+    client_rows = {}
+    mismatches = 0
+
+    for i, data in enumerate(session):
+        full = encode_json({"topic": "LiveMarket", "version": i + 1, "data": data})
+        message = encoder.advance(data)
+        # The first frame a subscriber gets is the full snapshot either way
+        delta = encoder.full_frame().encoded().encode("utf-8") if i == 0 else encode_json(message)
+
+        full_bytes += len(full)
+        delta_bytes += len(delta)
+        full_wire += len(full_deflate.compress(full) + full_deflate.flush(zlib.Z_SYNC_FLUSH))
+        delta_wire += len(delta_deflate.compress(delta) + delta_deflate.flush(zlib.Z_SYNC_FLUSH))
+
+        client_rows = apply_delta(client_rows, json.loads(delta))
+        mismatches += client_rows != index_rows(data)
+
+    n = len(session)
+    print(f"LiveMarket delta benchmark: {n} snapshots, {len(encoder.rows)} securities, "
+          f"{encoder.rows_changed / max(1, n - 1):.1f} changed rows per poll")
+    print("=" * 64)
+    print(f"{'':<20}{'bytes/frame':>14}{'deflated/frame':>16}{'total MB':>12}")
+    print(f"{'full snapshots':<20}{full_bytes / n:>14,.0f}{full_wire / n:>16,.0f}{full_bytes / 2**20:>12.2f}")
+    print(f"{'deltas':<20}{delta_bytes / n:>14,.0f}{delta_wire / n:>16,.0f}{delta_bytes / 2**20:>12.2f}")
+    print(f"Saved {100 * (1 - delta_bytes / full_bytes):.1f}% raw, {100 * (1 - delta_wire / full_wire):.1f}% deflated; "
+          f"rebuild mismatches: {mismatches}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure LiveMarket delta encoding savings")
+    sub = parser.add_subparsers(dest="mode", required=True)
+    rec = sub.add_parser("record", help="Record live market snapshots")
+    rec.add_argument("path")
+    rec.add_argument("--interval", type=float, default=5, help="Seconds between polls")
+    rec.add_argument("--duration", type=float, default=5 * 3600, help="Stop after this many seconds")
+    mea = sub.add_parser("measure", help="Replay a recording (or a synthetic session)")
+    mea.add_argument("path", nargs="?")
+    mea.add_argument("--synthetic", type=int, default=0, help="Generate this many polls instead of reading a file")
+    args = parser.parse_args()
+
+    if args.mode == "record":
+        asyncio.run(record(args.path, args.interval, args.duration))
+    elif args.synthetic or not args.path:
+        measure(synthetic_session(args.synthetic or 500))
+    else:
+        measure(load_recording(args.path))
+
+
+if __name__ == "__main__":
+    main()
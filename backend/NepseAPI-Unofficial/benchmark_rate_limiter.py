@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+"""
+Rate Limiter Benchmark
+
+Compares the GCRA limiter in rate_limiter.py with the previous
+deque-per-IP/endpoint sliding window at a large number of tracked
+clients: memory held by the limiter state (tracemalloc), ns per
+is_allowed() call and the cost of get_stats(), plus the per-message
+cost of a WebSocket TokenLease.
+
+Usage: python benchmark_rate_limiter.py [--clients 100000] [--endpoints 3] [--requests 20]
+"""
+
+import argparse
+import asyncio
+import random
+import time
+import tracemalloc
+from collections import defaultdict, deque
+
+from rate_limiter import SimpleRateLimiter, TokenLease
+
+ENDPOINTS = ["/LiveMarket", "/PriceVolume", "/CompanyDetails", "/TopGainers", "/validate/stock/NABIL"]
+
+
+class LegacyRateLimiter(SimpleRateLimiter):
+    """The sliding-window limiter as it was: one float per request per IP x endpoint"""
+
+    def __init__(self):
+        super().__init__()
+        self.requests = defaultdict(lambda: defaultdict(deque))
+        self.last_seen = {}
+
+    def is_allowed(self, ip, endpoint):
+        current_time = time.time()
+        category = self._get_endpoint_category(endpoint)
+        limit = self.limits[category]
+        request_times = self.requests[ip][endpoint]
+        cutoff_time = current_time - self.window_size
+        while request_times and request_times[0] < cutoff_time:
+            request_times.popleft()
+        self.last_seen[ip] = current_time
+        # (the periodic full scan of every IP is left out; it would dominate the timing)
+        info = {"limit": limit, "remaining": max(0, limit - len(request_times)),
+                "reset_time": int(current_time + self.window_size), "category": category}
+        if len(request_times) >= limit:
+            return False, info
+        request_times.append(current_time)
+        info["remaining"] = max(0, limit - len(request_times))
+        return True, info
+
+    def get_stats(self):
+        current_time = time.time()
+        active = 0
+        for ip_requests in self.requests.values():
+            for request_times in ip_requests.values():
+                active += sum(1 for t in request_times if current_time - t < self.window_size)
+        return {"total_tracked_ips": len(self.requests), "active_requests_in_window": active}
+
+
+def populate(limiter, clients, endpoints, requests_per_client):
+    """Each client makes `requests_per_client` calls spread over `endpoints` endpoints"""
+    for i in range(clients):
+        ip = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+        for r in range(requests_per_client):
+            limiter.is_allowed(ip, ENDPOINTS[r % endpoints])
+
+
+def measure(cls, args):
+    limiter = cls()
+    limiter.backend.eviction_batch = 0  # keep every client tracked
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    populate(limiter, args.clients, args.endpoints, args.requests)
+    memory = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+
+    rng = random.Random(3)
+    calls = [(f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}", ENDPOINTS[rng.randrange(args.endpoints)])
+             for i in (rng.randrange(args.clients) for _ in range(args.ops))]
+    start = time.perf_counter_ns()
+    for ip, endpoint in calls:
+        limiter.is_allowed(ip, endpoint)
+    per_op = (time.perf_counter_ns() - start) / len(calls)
+
+    start = time.perf_counter()
+    limiter.get_stats()
+    stats_ms = (time.perf_counter() - start) * 1e3
+    return memory, per_op, stats_ms
+
+
+def measure_lease(args):
+    """ns per WebSocket message through a TokenLease, refills included"""
+    limiter = SimpleRateLimiter()
+    limiter.limits["websocket_message"] = 10 ** 9  # never deny, so every message is timed
+    lease = TokenLease(limiter, "10.0.0.1", "websocket_message", batch=args.lease_batch)
+
+    async def run():
+        start = time.perf_counter_ns()
+        for _ in range(args.ops):
+            lease.try_acquire() or await lease.refill()
+        return (time.perf_counter_ns() - start) / args.ops
+
+    per_op = asyncio.run(run())
+    return per_op, lease.leases
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rate limiter")
+    parser.add_argument("--clients", type=int, default=100_000, help="Tracked client IPs")
+    parser.add_argument("--endpoints", type=int, default=3, help="Endpoints used per client")
+    parser.add_argument("--requests", type=int, default=20, help="Requests per client inside the window")
+    parser.add_argument("--ops", type=int, default=200_000, help="Timed is_allowed() calls")
+    parser.add_argument("--lease-batch", type=int, default=100, help="Tokens per TokenLease refill")
+    args = parser.parse_args()
+
+    print(f"Rate limiter benchmark: {args.clients:,} clients x {args.endpoints} endpoints, "
+          f"{args.requests} requests each")
+    print("=" * 72)
+    print(f"{'limiter':<26}{'memory MB':>12}{'bytes/client':>14}{'ns/op':>10}{'stats ms':>10}")
+    for name, cls in (("legacy (deque window)", LegacyRateLimiter), ("gcra (one TAT per key)", SimpleRateLimiter)):
+        memory, per_op, stats_ms = measure(cls, args)
+        print(f"{name:<26}{memory / 2**20:>12.1f}{memory / args.clients:>14.0f}{per_op:>10.0f}{stats_ms:>10.1f}")
+
+    per_op, leases = measure_lease(args)
+    print(f"\nWebSocket lease (batch {args.lease_batch}): {per_op:.0f} ns/message, "
+          f"{leases:,} backend calls for {args.ops:,} messages")
+
+
+if __name__ == "__main__":
+    main()
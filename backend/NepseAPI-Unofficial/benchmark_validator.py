@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Validator Suggestion Benchmark
+
+Typo-heavy workload against the real stockmap.json: each listed symbol is
+mangled with one or two random edits (substitution, insertion, deletion,
+adjacent swap) or truncated to a prefix, then passed to the suggestion
+lookup. Compares the old "first five symbols sharing two letters" scan with
+the prebuilt StockIndex on latency and on how often the intended symbol is
+suggested (top-1 and top-5). Also times company name search (the lookup
+behind the MCP get_company_symbol and get_price_volume tools) against the
+old normalize-every-name scan.
+
+Usage: python benchmark_validator.py [--queries 5000] [--seed 7]
+"""
+
+import argparse
+import random
+import string
+import time
+
+from stock_index import StockIndex, normalize_company_name
+from validator import validator
+
+ALPHABET = string.ascii_uppercase
+
+
+def legacy_suggest(symbols, symbol, max_suggestions=5):
+    """The suggestion scan as it was"""
+    similar = []
+    for valid_symbol in symbols:
+        if valid_symbol.startswith(symbol[:2]):
+            similar.append(valid_symbol)
+        if len(similar) >= max_suggestions:
+            break
+    return similar[:max_suggestions]
+
+
+def legacy_name_search(stock_data, company_name):
+    """The company name scan as it was: normalize every name on every call"""
+    query = normalize_company_name(company_name)
+    exact, partial = [], []
+    for symbol, info in stock_data.items():
+        if not info or "name" not in info:
+            continue
+        key = normalize_company_name(info["name"])
+        if query == key:
+            exact.append(symbol)
+        elif key.startswith(query) or query.startswith(key):
+            partial.append(symbol)
+    return exact + partial
+
+
+def mangle(rng, symbol):
+    """One typo'd or partial version of a symbol"""
+    kind = rng.choice(["substitute", "insert", "delete", "swap", "prefix", "double"])
+    if kind == "prefix" and len(symbol) > 3:
+        return symbol[:rng.randrange(2, len(symbol))]
+    edits = 2 if kind == "double" else 1
+    for _ in range(edits):
+        i = rng.randrange(len(symbol))
+        if kind == "swap" and len(symbol) > 1:
+            i = min(i, len(symbol) - 2)
+            symbol = symbol[:i] + symbol[i + 1] + symbol[i] + symbol[i + 2:]
+        elif kind == "insert":
+            symbol = symbol[:i] + rng.choice(ALPHABET) + symbol[i:]
+        elif kind == "delete" and len(symbol) > 2:
+            symbol = symbol[:i] + symbol[i + 1:]
+        else:
+            symbol = symbol[:i] + rng.choice(ALPHABET) + symbol[i + 1:]
+    return symbol
+
+
+def run(name, suggest, workload):
+    latencies = []
+    top1 = top5 = 0
+    for query, intended in workload:
+        start = time.perf_counter_ns()
+        suggestions = suggest(query)
+        latencies.append(time.perf_counter_ns() - start)
+        top1 += bool(suggestions) and suggestions[0] == intended
+        top5 += intended in suggestions
+    latencies.sort()
+    n = len(latencies)
+    print(f"{name:<22}{latencies[n // 2] / 1e3:>10.1f}{latencies[int(n * 0.99)] / 1e3:>10.1f}"
+          f"{100 * top1 / n:>9.1f}%{100 * top5 / n:>9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark symbol suggestions on typo'd queries")
+    parser.add_argument("--queries", type=int, default=5000, help="Typo'd queries to run")
+    parser.add_argument("--seed", type=int, default=7, help="Random seed for the workload")
+    args = parser.parse_args()
+
+    stock_data = validator._load_stock_data()
+    symbols = set(stock_data)
+    listed = sorted(symbols)
+
+    start = time.perf_counter()
+    index = StockIndex(stock_data)
+    build_ms = (time.perf_counter() - start) * 1e3
+
+    rng = random.Random(args.seed)
+    workload = []
+    while len(workload) < args.queries:
+        intended = rng.choice(listed)
+        query = mangle(rng, intended)
+        if query not in symbols:
+            workload.append((query, intended))
+
+    print(f"Suggestion benchmark: {len(listed)} symbols, {len(workload):,} typo'd queries "
+          f"(index built in {build_ms:.1f} ms)")
+    print("=" * 62)
+    print(f"{'lookup':<22}{'p50 us':>10}{'p99 us':>10}{'top-1':>10}{'top-5':>10}")
+    run("legacy prefix scan", lambda q: legacy_suggest(symbols, q), workload)
+    run("stock index", index.suggest, workload)
+
+    # Company names as users type them: leading words of listed names
+    names = [info["name"] for info in stock_data.values() if info and "name" in info]
+    queries = [" ".join(name.split()[:rng.randrange(1, 3)]) for name in rng.choices(names, k=min(args.queries, 1000))]
+    print(f"\nCompany name search: {len(queries):,} queries")
+    print(f"{'lookup':<22}{'mean us':>10}")
+    for name, search in (("legacy scan", lambda q: legacy_name_search(stock_data, q)),
+                         ("name index", index.names.search)):
+        start = time.perf_counter_ns()
+        for query in queries:
+            search(query)
+        print(f"{name:<22}{(time.perf_counter_ns() - start) / len(queries) / 1e3:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+"""
+WebSocket Wire Format Benchmark
+
+Encodes LiveMarket snapshots in every wire format the server offers and
+reports bytes per frame, raw and deflated with one shared context (as
+permessage-deflate does), plus the encoding time per frame. Formats that
+need a missing package (msgpack) are skipped.
+
+Usage:
+  python benchmark_wire_formats.py                          # synthetic session
+  python benchmark_wire_formats.py --recording session.jsonl.gz
+"""
+
+import argparse
+import time
+import zlib
+
+from benchmark_market_deltas import load_recording, synthetic_session
+from wire_formats import FORMATS, Frame, available_formats
+
+
+def measure(session):
+    formats = available_formats()
+    raw = dict.fromkeys(formats, 0)
+    wire = dict.fromkeys(formats, 0)
+    seconds = dict.fromkeys(formats, 0.0)
+    deflaters = {fmt: zlib.compressobj(wbits=-15) for fmt in formats}
+
+    for i, data in enumerate(session):
+        message = {"topic": "LiveMarket", "version": i + 1, "data": data}
+        for fmt in formats:
+            # A fresh frame each time, so the columnar conversion is timed too
+            started = time.perf_counter()
+            frame = Frame(message).encoded(fmt)
+            seconds[fmt] += time.perf_counter() - started
+            if isinstance(frame, str):
+                frame = frame.encode("utf-8")
+            raw[fmt] += len(frame)
+            wire[fmt] += len(deflaters[fmt].compress(frame) + deflaters[fmt].flush(zlib.Z_SYNC_FLUSH))
+
+    n = len(session)
+    print(f"Wire format benchmark: {n} LiveMarket snapshots, {len(session[0])} rows each")
+    print("=" * 64)
+    print(f"{'format':<20}{'bytes/frame':>14}{'deflated/frame':>16}{'encode us':>12}")
+    for fmt in formats:
+        print(f"{fmt:<20}{raw[fmt] / n:>14,.0f}{wire[fmt] / n:>16,.0f}{seconds[fmt] / n * 1e6:>12,.0f}")
+    skipped = [fmt for fmt in FORMATS if fmt not in formats]
+    if skipped:
+        print(f"Skipped (install msgpack): {', '.join(skipped)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare WebSocket wire formats on LiveMarket snapshots")
+    parser.add_argument("--recording", help="Session recorded with benchmark_market_deltas.py record")
+    parser.add_argument("--synthetic", type=int, default=200, help="Polls to generate when there is no recording")
+    args = parser.parse_args()
+
+    measure(load_recording(args.recording) if args.recording else synthetic_session(args.synthetic))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,204 @@
+"""
+Broker Flow Analytics for NEPSE API
+
+Vectorised group-bys over floorsheet columns (archived days or today's
+cached floorsheet): per-broker and per-symbol buy/sell quantity, net
+position and VWAP, the trade-size distribution and the top accumulating
+and distributing brokers. Every aggregate is a NumPy bincount over the
+dictionary codes from floorsheet_archive; there are no per-trade Python loops.
+"""
+
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from floorsheet_archive import ArchivedDay
+
+# Upper bounds (inclusive) of the trade-size buckets, in shares
+TRADE_SIZE_BUCKETS = [10, 50, 100, 500, 1000, 5000, 10000, 50000]
+
+
+@dataclass
+class TradeColumns:
+    """Floorsheet columns from one or more days, re-coded into one symbol/broker space"""
+    dates: List[str]
+    symbols: List[str]
+    brokers: List[str]
+    broker_names: Dict[str, str]
+    symbol: np.ndarray
+    buyer: np.ndarray
+    seller: np.ndarray
+    quantity: np.ndarray
+    amount: np.ndarray
+
+    def __len__(self):
+        return len(self.quantity)
+
+
+def merge_days(days: List[ArchivedDay], symbol: Optional[str] = None) -> TradeColumns:
+    """
+    Concatenate days, translating each day's local codes to shared codes with a lookup array.
+    With `symbol`, only that symbol's contiguous slice of each day is read.
+    """
+    symbols: Dict[str, int] = {}
+    brokers: Dict[str, int] = {}
+    broker_names: Dict[str, str] = {}
+    parts = {name: [] for name in ("symbol", "buyer", "seller", "quantity", "amount")}
+
+    for day in days:
+        positions = day.select(symbol) if symbol else slice(None)
+        symbol_map = np.array([symbols.setdefault(s, len(symbols)) for s in day.symbols], dtype=np.int64)
+        broker_map = np.array([brokers.setdefault(b, len(brokers)) for b in day.brokers], dtype=np.int64)
+        for member_id, name in day.broker_names.items():
+            broker_names.setdefault(member_id, name)
+
+        columns = day.columns
+        if len(symbol_map):
+            parts["symbol"].append(symbol_map[columns["symbol"][positions]])
+        if len(broker_map):
+            parts["buyer"].append(broker_map[columns["buyer"][positions]])
+            parts["seller"].append(broker_map[columns["seller"][positions]])
+        parts["quantity"].append(np.asarray(columns["quantity"][positions], dtype=np.int64))
+        parts["amount"].append(np.asarray(columns["amount"][positions], dtype=np.float64))
+
+    def concat(name, dtype):
+        return np.concatenate(parts[name]) if parts[name] else np.empty(0, dtype)
+
+    return TradeColumns(
+        dates=[day.business_date for day in days],
+        symbols=list(symbols),
+        brokers=list(brokers),
+        broker_names=broker_names,
+        symbol=concat("symbol", np.int64),
+        buyer=concat("buyer", np.int64),
+        seller=concat("seller", np.int64),
+        quantity=concat("quantity", np.int64),
+        amount=concat("amount", np.float64),
+    )
+
+
+def _vwap(amount: np.ndarray, quantity: np.ndarray) -> np.ndarray:
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.where(quantity > 0, amount / np.maximum(quantity, 1), 0.0)
+
+
+def broker_table(trades: TradeColumns) -> Dict[str, np.ndarray]:
+    """Per-broker buy/sell totals, indexed by shared broker code"""
+    n = len(trades.brokers)
+    bought = np.bincount(trades.buyer, weights=trades.quantity, minlength=n)
+    sold = np.bincount(trades.seller, weights=trades.quantity, minlength=n)
+    bought_amount = np.bincount(trades.buyer, weights=trades.amount, minlength=n)
+    sold_amount = np.bincount(trades.seller, weights=trades.amount, minlength=n)
+    return {
+        "bought": bought,
+        "sold": sold,
+        "net": bought - sold,
+        "buy_vwap": _vwap(bought_amount, bought),
+        "sell_vwap": _vwap(sold_amount, sold),
+        "buy_trades": np.bincount(trades.buyer, minlength=n),
+        "sell_trades": np.bincount(trades.seller, minlength=n),
+    }
+
+
+def symbol_table(trades: TradeColumns) -> Dict[str, np.ndarray]:
+    """Per-symbol totals, indexed by shared symbol code"""
+    n = len(trades.symbols)
+    quantity = np.bincount(trades.symbol, weights=trades.quantity, minlength=n)
+    amount = np.bincount(trades.symbol, weights=trades.amount, minlength=n)
+    return {
+        "quantity": quantity,
+        "amount": amount,
+        "vwap": _vwap(amount, quantity),
+        "trades": np.bincount(trades.symbol, minlength=n),
+    }
+
+
+def trade_size_distribution(quantity: np.ndarray) -> List[Dict]:
+    """Trade counts and volume per size bucket"""
+    edges = np.array(TRADE_SIZE_BUCKETS)
+    buckets = np.searchsorted(edges, quantity, side="left")
+    counts = np.bincount(buckets, minlength=len(edges) + 1)
+    volume = np.bincount(buckets, weights=quantity, minlength=len(edges) + 1)
+    labels = [f"<={edges[0]}"] + [f"{lo + 1}-{hi}" for lo, hi in zip(edges[:-1], edges[1:])] + [f">{edges[-1]}"]
+    return [{"bucket": label, "trades": int(c), "quantity": int(v)} for label, c, v in zip(labels, counts, volume)]
+
+
+def _broker_rows(trades: TradeColumns, table: Dict[str, np.ndarray], codes: np.ndarray) -> List[Dict]:
+    return [{
+        "broker": trades.brokers[code],
+        "brokerName": trades.broker_names.get(trades.brokers[code], ""),
+        "bought": int(table["bought"][code]),
+        "sold": int(table["sold"][code]),
+        "net": int(table["net"][code]),
+        "buyVwap": round(float(table["buy_vwap"][code]), 2),
+        "sellVwap": round(float(table["sell_vwap"][code]), 2),
+        "buyTrades": int(table["buy_trades"][code]),
+        "sellTrades": int(table["sell_trades"][code]),
+    } for code in codes]
+
+
+def broker_positions(trades: TradeColumns, broker_code: int, top: int) -> List[Dict]:
+    """What one broker bought and sold, per symbol, largest net positions first"""
+    n = len(trades.symbols)
+    is_buy = trades.buyer == broker_code
+    is_sell = trades.seller == broker_code
+    bought = np.bincount(trades.symbol[is_buy], weights=trades.quantity[is_buy], minlength=n)
+    sold = np.bincount(trades.symbol[is_sell], weights=trades.quantity[is_sell], minlength=n)
+    bought_amount = np.bincount(trades.symbol[is_buy], weights=trades.amount[is_buy], minlength=n)
+    sold_amount = np.bincount(trades.symbol[is_sell], weights=trades.amount[is_sell], minlength=n)
+    net = bought - sold
+    buy_vwap, sell_vwap = _vwap(bought_amount, bought), _vwap(sold_amount, sold)
+
+    active = np.flatnonzero((bought > 0) | (sold > 0))
+    ranked = active[np.argsort(-np.abs(net[active]), kind="stable")][:top]
+    return [{
+        "symbol": trades.symbols[code],
+        "bought": int(bought[code]),
+        "sold": int(sold[code]),
+        "net": int(net[code]),
+        "buyVwap": round(float(buy_vwap[code]), 2),
+        "sellVwap": round(float(sell_vwap[code]), 2),
+    } for code in ranked]
+
+
+def analyze(trades: TradeColumns, symbol: Optional[str] = None, broker: Optional[str] = None,
+            top: int = 10) -> Dict:
+    """Broker flow report for already-merged (and symbol-filtered) trade columns"""
+    report = {
+        "dates": trades.dates,
+        "symbol": symbol,
+        "trades": len(trades),
+        "quantity": int(trades.quantity.sum()),
+        "amount": round(float(trades.amount.sum()), 2),
+        "vwap": round(float(_vwap(trades.amount.sum(), trades.quantity.sum())), 2),
+        "tradeSizeDistribution": trade_size_distribution(trades.quantity),
+    }
+
+    table = broker_table(trades)
+    net = table["net"]
+    active = np.flatnonzero((table["bought"] > 0) | (table["sold"] > 0))
+    by_net = active[np.argsort(-net[active], kind="stable")]
+    report["topAccumulating"] = _broker_rows(trades, table, [c for c in by_net[:top] if net[c] > 0])
+    report["topDistributing"] = _broker_rows(trades, table, [c for c in by_net[::-1][:top] if net[c] < 0])
+
+    if not symbol:
+        symbols = symbol_table(trades)
+        ranked = np.argsort(-symbols["amount"], kind="stable")[:top]
+        report["topSymbols"] = [{
+            "symbol": trades.symbols[code],
+            "quantity": int(symbols["quantity"][code]),
+            "amount": round(float(symbols["amount"][code]), 2),
+            "vwap": round(float(symbols["vwap"][code]), 2),
+            "trades": int(symbols["trades"][code]),
+        } for code in ranked if symbols["trades"][code] > 0]
+
+    if broker:
+        broker = str(broker).strip()
+        code = trades.brokers.index(broker) if broker in trades.brokers else None
+        report["broker"] = None if code is None else {
+            **_broker_rows(trades, table, [code])[0],
+            "positions": broker_positions(trades, code, top),
+        }
+
+    return report
@@ -0,0 +1,67 @@
+"""
+Concurrent Upstream Fan-out for NEPSE API
+
+Runs several independent upstream calls at once, each with its own
+timeout, so an aggregate endpoint costs roughly its slowest call instead
+of the sum of all of them. Failed or timed-out calls fall back to a
+default value and are reported back to the caller.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CALL_TIMEOUT = 15.0  # seconds per upstream call
+
+
+class UpstreamUnavailable(Exception):
+    """Raised when a call the aggregate cannot do without has failed"""
+
+    def __init__(self, failures: Dict[str, str]):
+        self.failures = failures
+        details = ", ".join(f"{name}: {error}" for name, error in failures.items())
+        super().__init__(f"Required upstream data unavailable ({details})")
+
+
+async def _run_with_timeout(fn: Callable[[], Awaitable[Any]], timeout: float) -> Any:
+    return await asyncio.wait_for(fn(), timeout=timeout)
+
+
+async def gather_upstream(calls: Dict[str, Callable[[], Awaitable[Any]]],
+                          timeout: float = DEFAULT_CALL_TIMEOUT,
+                          defaults: Optional[Dict[str, Any]] = None,
+                          required: Iterable[str] = ()) -> Tuple[Dict[str, Any], Dict[str, str]]:
+    """
+    Run every call concurrently.
+    Returns: (results_by_name, errors_by_name)
+
+    A failed call's result is replaced by its entry in `defaults` (or None).
+    If any call named in `required` fails, UpstreamUnavailable is raised.
+    """
+    defaults = defaults or {}
+    names = list(calls)
+    outcomes = await asyncio.gather(
+        *(_run_with_timeout(calls[name], timeout) for name in names),
+        return_exceptions=True,
+    )
+
+    results: Dict[str, Any] = {}
+    errors: Dict[str, str] = {}
+    for name, outcome in zip(names, outcomes):
+        if isinstance(outcome, BaseException):
+            if isinstance(outcome, asyncio.CancelledError):
+                raise outcome
+            error = "timed out" if isinstance(outcome, asyncio.TimeoutError) else str(outcome) or type(outcome).__name__
+            logger.warning(f"Upstream call {name} failed: {error}")
+            errors[name] = error
+            results[name] = defaults.get(name)
+        else:
+            results[name] = outcome
+
+    missing = {name: errors[name] for name in required if name in errors}
+    if missing:
+        raise UpstreamUnavailable(missing)
+
+    return results, errors
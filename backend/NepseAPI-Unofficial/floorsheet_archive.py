@@ -0,0 +1,514 @@
+"""
+End-of-day Floorsheet Archive for NEPSE API
+
+After the market closes, a background job pulls the day's full floorsheet
+and stores it as one directory per business date, one NumPy column file
+per field. Symbols and brokers are dictionary-encoded into small integer
+codes and rows are sorted by symbol, so historical symbol and broker
+queries become memory-mapped slices and masks instead of upstream calls.
+
+Layout (FLOORSHEET_ARCHIVE_DIR, default ./floorsheet_archive):
+
+    2025-08-24/
+        meta.json          symbols, brokers, broker names, row count
+        contract_id.npy    int64
+        symbol.npy         uint16 code into meta["symbols"]
+        buyer.npy          uint16 code into meta["brokers"]
+        seller.npy         uint16 code into meta["brokers"]
+        quantity.npy       int64
+        rate.npy           float64
+        amount.npy         float64
+        trade_time.npy     int32 seconds since midnight (NPT)
+"""
+
+import asyncio
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from datetime import date, timedelta
+from pathlib import Path
+from itertools import chain, repeat
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from floorsheet_stream import iter_floorsheet_pages
+from market_hours import SESSION_CLOSE, TRADING_DAYS, next_session_close, now_npt
+
+logger = logging.getLogger(__name__)
+
+# Column name -> (array typecode used while ingesting, stored dtype)
+COLUMNS = {
+    "contract_id": ("q", np.int64),
+    "symbol": ("H", np.uint16),
+    "buyer": ("H", np.uint16),
+    "seller": ("H", np.uint16),
+    "quantity": ("q", np.int64),
+    "rate": ("d", np.float64),
+    "amount": ("d", np.float64),
+    "trade_time": ("i", np.int32),
+}
+
+_DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}$")
+
+
+def parse_business_date(value: str) -> str:
+    """Normalise a YYYY-MM-DD date; raises ValueError otherwise (also guards the archive path)"""
+    value = str(value or "").strip()[:10]
+    if not _DATE_PATTERN.match(value):
+        raise ValueError(f"Invalid business date '{value}', expected YYYY-MM-DD")
+    return date.fromisoformat(value).isoformat()
+
+
+def _seconds_of_day(trade_time: str) -> int:
+    """'2025-08-24T14:59:58.123' or '14:59:58' -> seconds since midnight"""
+    clock = str(trade_time or "").replace("T", " ").split(" ")[-1]
+    try:
+        hours, minutes, seconds = clock.split(":")[:3]
+        return int(hours) * 3600 + int(minutes) * 60 + int(float(seconds))
+    except ValueError:
+        return -1
+
+
+def _format_time(business_date: str, seconds: int) -> str:
+    if seconds < 0:
+        return ""
+    return f"{business_date}T{seconds // 3600:02d}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+
+def _clean_symbol(symbol) -> str:
+    return str(symbol or "").strip().upper()
+
+
+def _clean_member_id(member_id) -> str:
+    return str(member_id or "").strip()
+
+
+def _values(rows: List[Dict], key: str) -> List:
+    return list(map(dict.get, rows, repeat(key)))
+
+
+def _numeric_column(values: List, dtype) -> np.ndarray:
+    """Numbers (or numeric strings) as a column; missing, null and empty values become 0"""
+    try:
+        column = np.fromiter(values, dtype=dtype, count=len(values))
+    except (TypeError, ValueError):
+        column = np.array(values, dtype=object)
+        column[~column.astype(bool)] = 0
+        return column.astype(dtype)
+    if column.dtype.kind == "f":
+        # fromiter reads None as NaN
+        column[np.isnan(column)] = 0
+    return column
+
+
+def _dictionary_encode(values: List, normalize: Callable[[Any], Any]) -> Tuple[List, np.ndarray]:
+    """
+    Distinct normalised values in first-seen order, and each value's code into them.
+    Only the distinct raw values are normalised; each row costs two dict lookups.
+    """
+    distinct = list(dict.fromkeys(values))
+    normalized = list(map(normalize, distinct))
+    dictionary = list(dict.fromkeys(normalized))
+    code_of = dict(zip(dictionary, range(len(dictionary))))
+    codes = dict(zip(distinct, map(code_of.__getitem__, normalized)))
+    return dictionary, np.fromiter(map(codes.__getitem__, values), dtype=np.int64, count=len(values))
+
+
+def _sort_by_symbol(arrays: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+    """Group rows by symbol (contract id inside each group) so a symbol is one contiguous slice"""
+    order = np.lexsort((arrays["contract_id"], arrays["symbol"]))
+    return {name: column[order] for name, column in arrays.items()}
+
+
+def _day_meta(business_date: str, rows: int, symbols: List[str], brokers: List[str],
+              broker_names: Dict[str, str]) -> Dict:
+    return {
+        "business_date": business_date,
+        "rows": rows,
+        "symbols": symbols,
+        "brokers": brokers,
+        "broker_names": broker_names,
+        "written_at": time.time(),
+    }
+
+
+class _DayBuilder:
+    """Accumulates floorsheet pages into compact columns"""
+
+    def __init__(self):
+        self.columns = {name: array(typecode) for name, (typecode, _) in COLUMNS.items()}
+        self.symbol_codes: Dict[str, int] = {}
+        self.broker_codes: Dict[str, int] = {}
+        self.broker_names: Dict[str, str] = {}
+        self.business_date: Optional[str] = None
+
+    def _broker(self, member_id, name) -> int:
+        member_id = str(member_id or "").strip()
+        code = self.broker_codes.get(member_id)
+        if code is None:
+            code = self.broker_codes[member_id] = len(self.broker_codes)
+        if name and member_id not in self.broker_names:
+            self.broker_names[member_id] = name
+        return code
+
+    def add(self, rows: List[Dict]):
+        columns = self.columns
+        for row in rows:
+            if self.business_date is None and row.get("businessDate"):
+                self.business_date = parse_business_date(row["businessDate"])
+            symbol = str(row.get("stockSymbol") or "").strip().upper()
+            code = self.symbol_codes.get(symbol)
+            if code is None:
+                code = self.symbol_codes[symbol] = len(self.symbol_codes)
+
+            columns["contract_id"].append(int(row.get("contractId") or 0))
+            columns["symbol"].append(code)
+            columns["buyer"].append(self._broker(row.get("buyerMemberId"), row.get("buyerBrokerName")))
+            columns["seller"].append(self._broker(row.get("sellerMemberId"), row.get("sellerBrokerName")))
+            columns["quantity"].append(int(row.get("contractQuantity") or 0))
+            columns["rate"].append(float(row.get("contractRate") or 0))
+            columns["amount"].append(float(row.get("contractAmount") or 0))
+            columns["trade_time"].append(_seconds_of_day(row.get("tradeTime")))
+
+    def __len__(self):
+        return len(self.columns["contract_id"])
+
+    def finish(self, business_date: str):
+        """Sorted NumPy columns plus the metadata that decodes them"""
+        arrays = {name: np.frombuffer(self.columns[name], dtype=dtype) if len(self) else np.empty(0, dtype)
+                  for name, (_, dtype) in COLUMNS.items()}
+        meta = _day_meta(business_date, len(self), list(self.symbol_codes), list(self.broker_codes),
+                         self.broker_names)
+        return _sort_by_symbol(arrays), meta
+
+
+class ArchivedDay:
+    """
+    One business date of floorsheet columns; memory-mapped read-only when loaded from disk
+    """
+
+    def __init__(self, meta: Dict, columns: Dict[str, np.ndarray], path: Optional[Path] = None):
+        self.path = path
+        self.meta = meta
+        self.business_date: str = meta["business_date"]
+        self.symbols: List[str] = meta["symbols"]
+        self.brokers: List[str] = meta["brokers"]
+        self.broker_names: Dict[str, str] = meta.get("broker_names", {})
+        self._symbol_codes = {symbol: code for code, symbol in enumerate(self.symbols)}
+        self._broker_codes = {broker: code for code, broker in enumerate(self.brokers)}
+        self.columns = columns
+
+    @classmethod
+    def load(cls, path: Path) -> "ArchivedDay":
+        with open(path / "meta.json", "r", encoding="utf-8") as f:
+            meta = json.load(f)
+        columns = {
+            name: np.load(path / f"{name}.npy", mmap_mode="r") if meta["rows"] else np.empty(0, dtype)
+            for name, (_, dtype) in COLUMNS.items()
+        }
+        return cls(meta, columns, path)
+
+    @classmethod
+    def from_rows(cls, rows: List[Dict], business_date: Optional[str] = None) -> "ArchivedDay":
+        """
+        Columns for a floorsheet that is still in memory (e.g. today's cached one),
+        built a column at a time rather than row by row
+        """
+        if not business_date:
+            first_date = next(filter(None, _values(rows, "businessDate")), None)
+            business_date = parse_business_date(first_date) if first_date else now_npt().date().isoformat()
+
+        symbols, symbol_codes = _dictionary_encode(_values(rows, "stockSymbol"), _clean_symbol)
+        # Buyers and sellers share one broker dictionary; interleaved so codes follow row order
+        member_ids = list(chain.from_iterable(zip(_values(rows, "buyerMemberId"), _values(rows, "sellerMemberId"))))
+        brokers, broker_codes = _dictionary_encode(member_ids, _clean_member_id)
+        # Trade times repeat a lot, and only the distinct strings are parsed
+        times, time_codes = _dictionary_encode(_values(rows, "tradeTime"), _seconds_of_day)
+
+        # A broker's name is the first non-empty one it traded under
+        names = np.array(list(chain.from_iterable(
+            zip(_values(rows, "buyerBrokerName"), _values(rows, "sellerBrokerName")))), dtype=object)
+        named = np.flatnonzero(names.astype(bool))
+        named_codes, first = np.unique(broker_codes[named], return_index=True)
+        broker_names = dict(zip(map(brokers.__getitem__, named_codes.tolist()), names[named[first]].tolist()))
+
+        arrays = {
+            "contract_id": _numeric_column(_values(rows, "contractId"), np.int64),
+            "symbol": symbol_codes.astype(np.uint16),
+            "buyer": broker_codes[0::2].astype(np.uint16),
+            "seller": broker_codes[1::2].astype(np.uint16),
+            "quantity": _numeric_column(_values(rows, "contractQuantity"), np.int64),
+            "rate": _numeric_column(_values(rows, "contractRate"), np.float64),
+            "amount": _numeric_column(_values(rows, "contractAmount"), np.float64),
+            "trade_time": np.array(times, dtype=np.int32)[time_codes],
+        }
+        meta = _day_meta(business_date, len(rows), symbols, brokers, broker_names)
+        return cls(meta, _sort_by_symbol(arrays))
+
+    def __len__(self):
+        return self.meta["rows"]
+
+    def symbol_code(self, symbol: str) -> Optional[int]:
+        return self._symbol_codes.get(symbol.strip().upper())
+
+    def broker_code(self, member_id) -> Optional[int]:
+        return self._broker_codes.get(str(member_id).strip())
+
+    def select(self, symbol: Optional[str] = None, buyer: Optional[str] = None,
+               seller: Optional[str] = None) -> np.ndarray:
+        """Row positions matching the filters"""
+        start, stop = 0, len(self)
+        if symbol:
+            code = self.symbol_code(symbol)
+            if code is None:
+                return np.empty(0, dtype=np.int64)
+            symbols = self.columns["symbol"]
+            start = int(np.searchsorted(symbols, code, side="left"))
+            stop = int(np.searchsorted(symbols, code, side="right"))
+
+        positions = np.arange(start, stop)
+        for member_id, column in ((buyer, "buyer"), (seller, "seller")):
+            if member_id:
+                code = self.broker_code(member_id)
+                if code is None:
+                    return np.empty(0, dtype=np.int64)
+                positions = positions[self.columns[column][start:stop][positions - start] == code]
+        return positions
+
+    def rows(self, positions: np.ndarray) -> List[Dict]:
+        """Decode rows back into the upstream floorsheet field names"""
+        c = {name: column[positions].tolist() for name, column in self.columns.items()}
+        result = []
+        for i in range(len(positions)):
+            buyer, seller = self.brokers[c["buyer"][i]], self.brokers[c["seller"][i]]
+            result.append({
+                "contractId": c["contract_id"][i],
+                "stockSymbol": self.symbols[c["symbol"][i]],
+                "buyerMemberId": buyer,
+                "sellerMemberId": seller,
+                "buyerBrokerName": self.broker_names.get(buyer, ""),
+                "sellerBrokerName": self.broker_names.get(seller, ""),
+                "contractQuantity": c["quantity"][i],
+                "contractRate": c["rate"][i],
+                "contractAmount": c["amount"][i],
+                "businessDate": self.business_date,
+                "tradeTime": _format_time(self.business_date, c["trade_time"][i]),
+            })
+        return result
+
+
+class FloorsheetArchive:
+    """
+    Date-partitioned columnar floorsheet store
+    """
+
+    def __init__(self, root: Optional[str] = None, max_open_days: int = 32):
+        default_root = Path(__file__).parent / "floorsheet_archive"
+        self.root = Path(root or os.environ.get("FLOORSHEET_ARCHIVE_DIR") or default_root)
+        self.max_open_days = max_open_days
+        self._open_days: "OrderedDict[str, ArchivedDay]" = OrderedDict()
+        # Requests open days from worker threads; guards _open_days and _writes
+        self._lock = threading.Lock()
+        # Bumped by write_day, so a load that raced a rewrite isn't cached
+        self._writes = 0
+
+    def dates(self) -> List[str]:
+        """Archived business dates, oldest first"""
+        if not self.root.is_dir():
+            return []
+        return sorted(entry.name for entry in self.root.iterdir()
+                      if _DATE_PATTERN.match(entry.name) and (entry / "meta.json").is_file())
+
+    def has(self, business_date: str) -> bool:
+        return (self.root / parse_business_date(business_date) / "meta.json").is_file()
+
+    def day(self, business_date: str) -> Optional[ArchivedDay]:
+        """Open (or reuse) the memory-mapped columns for a date"""
+        business_date = parse_business_date(business_date)
+        with self._lock:
+            archived = self._open_days.get(business_date)
+            if archived is not None:
+                self._open_days.move_to_end(business_date)
+                return archived
+            writes = self._writes
+        if not self.has(business_date):
+            return None
+        # Opening the files is the slow part; it runs unlocked (two threads may both load a day)
+        archived = ArchivedDay.load(self.root / business_date)
+        with self._lock:
+            if writes != self._writes:
+                # Rewritten while loading: serve what was loaded, but don't cache it
+                return archived
+            archived = self._open_days.setdefault(business_date, archived)
+            self._open_days.move_to_end(business_date)
+            while len(self._open_days) > self.max_open_days:
+                self._open_days.popitem(last=False)
+        return archived
+
+    def days(self, start: Optional[str] = None, end: Optional[str] = None) -> List[ArchivedDay]:
+        """Archived days within [start, end], either bound optional"""
+        start = parse_business_date(start) if start else None
+        end = parse_business_date(end) if end else None
+        return [self.day(d) for d in self.dates() if (not start or d >= start) and (not end or d <= end)]
+
+    def write_day(self, business_date: str, columns: Dict[str, np.ndarray], meta: Dict):
+        """Write a partition to a temporary directory, then rename it into place"""
+        business_date = parse_business_date(business_date)
+        self.root.mkdir(parents=True, exist_ok=True)
+        final = self.root / business_date
+        staging = self.root / f".{business_date}.tmp-{os.getpid()}"
+        shutil.rmtree(staging, ignore_errors=True)
+        staging.mkdir()
+        for name, column in columns.items():
+            np.save(staging / f"{name}.npy", column)
+        with open(staging / "meta.json", "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+
+        if final.exists():
+            retired = self.root / f".{business_date}.old-{os.getpid()}"
+            os.replace(final, retired)
+            os.replace(staging, final)
+            shutil.rmtree(retired, ignore_errors=True)
+        else:
+            os.replace(staging, final)
+        with self._lock:
+            self._writes += 1
+            self._open_days.pop(business_date, None)
+
+    async def archive_from(self, nepse, overwrite: bool = False) -> Optional[str]:
+        """
+        Pull the full floorsheet page by page and archive it.
+        Returns the business date written, or None if there was nothing new.
+        """
+        builder = _DayBuilder()
+        pages = iter_floorsheet_pages(nepse)
+        try:
+            async for page in pages:
+                builder.add(page)
+                # Holidays and restarts serve a date we already have; stop after the first page
+                if builder.business_date and not overwrite and self.has(builder.business_date):
+                    logger.info(f"Floorsheet for {builder.business_date} is already archived")
+                    return None
+        finally:
+            await pages.aclose()
+        if not len(builder):
+            return None
+
+        business_date = builder.business_date or now_npt().date().isoformat()
+        columns, meta = builder.finish(business_date)
+        await asyncio.to_thread(self.write_day, business_date, columns, meta)
+        logger.info(f"Archived {len(builder)} floorsheet rows for {business_date}")
+        return business_date
+
+    def get_stats(self) -> Dict:
+        dates = self.dates()
+        return {
+            "root": str(self.root),
+            "archived_days": len(dates),
+            "first_date": dates[0] if dates else None,
+            "last_date": dates[-1] if dates else None,
+            "open_days": len(self._open_days),
+        }
+
+
+class ArchiveJob:
+    """
+    Archives each session's floorsheet a little after the close
+    """
+
+    def __init__(self, archive: FloorsheetArchive, nepse, delay: Optional[float] = None,
+                 retry_interval: float = 300, max_attempts: int = 6):
+        self.archive = archive
+        self.nepse = nepse
+        # Upstream needs a while after 15:00 to publish the final floorsheet
+        self.delay = delay if delay is not None else float(os.environ.get("FLOORSHEET_ARCHIVE_DELAY", 1200))
+        self.retry_interval = retry_interval
+        self.max_attempts = max_attempts
+        self._task: Optional[asyncio.Task] = None
+
+        self.runs = 0
+        self.last_run: Optional[float] = None
+        self.last_archived: Optional[str] = None
+        self.last_error: Optional[str] = None
+
+    def _seconds_until_due(self) -> float:
+        now = now_npt()
+        due = next_session_close(now - timedelta(seconds=self.delay)) + timedelta(seconds=self.delay)
+        return max(0.0, (due - now).total_seconds())
+
+    def _missed_today(self) -> bool:
+        """Started after today's close + delay without an archive for today"""
+        now = now_npt()
+        close = now.replace(hour=SESSION_CLOSE.hour, minute=SESSION_CLOSE.minute, second=0, microsecond=0)
+        return (now.weekday() in TRADING_DAYS and now >= close + timedelta(seconds=self.delay)
+                and not self.archive.has(now.date().isoformat()))
+
+    async def run_once(self) -> Optional[str]:
+        """Archive now, retrying transient upstream failures"""
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                self.runs += 1
+                self.last_run = time.time()
+                archived = await self.archive.archive_from(self.nepse)
+                self.last_error = None
+                if archived:
+                    self.last_archived = archived
+                return archived
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                self.last_error = str(e)
+                logger.error(f"Floorsheet archive attempt {attempt}/{self.max_attempts} failed: {e}")
+                if attempt < self.max_attempts:
+                    await asyncio.sleep(self.retry_interval)
+        return None
+
+    async def run(self):
+        if self._missed_today():
+            await self.run_once()
+        while True:
+            await asyncio.sleep(self._seconds_until_due())
+            await self.run_once()
+            # Step past the due time before computing the next one
+            await asyncio.sleep(60)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+            logger.info(f"Floorsheet archive job started, writing to {self.archive.root}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.archive.get_stats(),
+            "job_running": self.running,
+            "runs": self.runs,
+            "last_run": self.last_run,
+            "last_archived": self.last_archived,
+            "last_error": self.last_error,
+            "next_run_in_seconds": round(self._seconds_until_due()) if self.running else None,
+        }
+
+
+def archive_enabled() -> bool:
+    """The archive job can be switched off with FLOORSHEET_ARCHIVE=0"""
+    return os.environ.get("FLOORSHEET_ARCHIVE", "1").lower() not in ("0", "false", "no")
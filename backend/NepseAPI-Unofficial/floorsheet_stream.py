@@ -0,0 +1,102 @@
+"""
+Streaming Floorsheet for NEPSE API
+
+Reads the floorsheet upstream page by page and yields NDJSON lines as
+pages arrive, filtering by symbol/buyer/seller on the fly. Only a small
+window of pages is held at a time, so memory stays flat however many
+trades the day had.
+"""
+
+import asyncio
+import logging
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional
+
+from payloads import encode_json
+
+logger = logging.getLogger(__name__)
+
+# Pages fetched ahead of the one being streamed
+PREFETCH_PAGES = 2
+
+
+def _supports_paging(nepse) -> bool:
+    """The paged internals of AsyncNepse that getFloorSheet() itself is built on"""
+    return all(hasattr(nepse, name) for name in (
+        "requestPOSTAPI", "_getFloorSheetPageNumber", "getPOSTPayloadIDForFloorSheet",
+        "api_end_points", "floor_sheet_size",
+    ))
+
+
+async def iter_floorsheet_pages(nepse, prefetch: int = PREFETCH_PAGES) -> AsyncIterator[List[Dict]]:
+    """Yield the floorsheet one upstream page at a time"""
+    if not _supports_paging(nepse):
+        # Older/newer library without the paged internals: one buffered call
+        yield await nepse.getFloorSheet()
+        return
+
+    url = f"{nepse.api_end_points['floor_sheet']}?&size={nepse.floor_sheet_size}&sort=contractId,desc"
+    first = await nepse.requestPOSTAPI(url=url, payload_generator=nepse.getPOSTPayloadIDForFloorSheet)
+    sheet = (first or {}).get("floorsheets") or {}
+    yield sheet.get("content") or []
+
+    pages = iter(range(1, sheet.get("totalPages") or 0))
+    window = deque()
+
+    def fill():
+        while len(window) < prefetch + 1:
+            page = next(pages, None)
+            if page is None:
+                return
+            window.append(asyncio.ensure_future(nepse._getFloorSheetPageNumber(url, page)))
+
+    try:
+        fill()
+        while window:
+            content = await window.popleft()
+            fill()
+            yield content or []
+    finally:
+        # Client went away or a page failed: don't leave fetches running
+        for task in window:
+            task.cancel()
+
+
+def make_row_filter(symbol: Optional[str] = None, buyer: Optional[str] = None, seller: Optional[str] = None):
+    """Predicate over floorsheet rows; None when nothing is filtered"""
+    symbol = symbol.strip().upper() if symbol else None
+    buyer = str(buyer).strip() if buyer else None
+    seller = str(seller).strip() if seller else None
+    if not (symbol or buyer or seller):
+        return None
+
+    def matches(row: Dict) -> bool:
+        if symbol and str(row.get("stockSymbol", "")).upper() != symbol:
+            return False
+        if buyer and str(row.get("buyerMemberId", "")) != buyer:
+            return False
+        if seller and str(row.get("sellerMemberId", "")) != seller:
+            return False
+        return True
+
+    return matches
+
+
+async def stream_floorsheet_ndjson(nepse, symbol: Optional[str] = None, buyer: Optional[str] = None,
+                                   seller: Optional[str] = None) -> AsyncIterator[bytes]:
+    """
+    NDJSON body for a StreamingResponse: one trade per line, one chunk per page.
+    An upstream failure mid-stream ends the body with an {"error": ...} line,
+    since the status code has already been sent.
+    """
+    matches = make_row_filter(symbol, buyer, seller)
+    try:
+        async for page in iter_floorsheet_pages(nepse):
+            rows = page if matches is None else [row for row in page if matches(row)]
+            if rows:
+                yield b"".join(encode_json(row) + b"\n" for row in rows)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        logger.error(f"Floorsheet stream failed: {e}")
+        yield encode_json({"error": "Upstream floorsheet unavailable", "detail": str(e)}) + b"\n"
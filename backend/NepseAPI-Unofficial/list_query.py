@@ -0,0 +1,172 @@
+"""
+Server-side List Queries for NEPSE API
+
+Pagination (limit/cursor), filtering (symbols, sector), sorting and field
+projection for the large list endpoints. Each cached payload gets a
+ListIndex built once (symbol and sector postings, lazily sorted orders),
+so a query only touches the rows it returns.
+"""
+
+import base64
+import binascii
+from dataclasses import dataclass
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+MAX_LIMIT = 5000
+
+
+@dataclass
+class ListQuery:
+    """Parsed query parameters"""
+    limit: Optional[int] = None
+    offset: int = 0
+    symbols: Optional[List[str]] = None
+    sector: Optional[str] = None
+    sort_field: Optional[str] = None
+    descending: bool = False
+    fields: Optional[List[str]] = None
+
+    @property
+    def is_empty(self) -> bool:
+        return (self.limit is None and self.offset == 0 and self.symbols is None
+                and self.sector is None and self.sort_field is None and self.fields is None)
+
+
+def _split(value: Optional[str]) -> Optional[List[str]]:
+    if value is None:
+        return None
+    items = [item.strip() for item in value.split(",") if item.strip()]
+    return items or None
+
+
+def encode_cursor(offset: int) -> str:
+    return base64.urlsafe_b64encode(f"o:{offset}".encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> int:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)).decode()
+        prefix, _, offset = raw.partition(":")
+        if prefix != "o" or int(offset) < 0:
+            raise ValueError
+        return int(offset)
+    except (ValueError, binascii.Error, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def parse_list_query(limit: Optional[int] = None, cursor: Optional[str] = None, symbols: Optional[str] = None,
+                     sector: Optional[str] = None, sort: Optional[str] = None,
+                     fields: Optional[str] = None) -> ListQuery:
+    """Build a ListQuery from raw query-string values; raises ValueError on bad input"""
+    if limit is not None and not 1 <= limit <= MAX_LIMIT:
+        raise ValueError(f"limit must be between 1 and {MAX_LIMIT}")
+
+    sort_field, descending = None, False
+    if sort:
+        sort = sort.strip()
+        descending = sort.startswith("-")
+        sort_field = sort.lstrip("+-") or None
+
+    symbol_list = _split(symbols)
+    return ListQuery(
+        limit=limit,
+        offset=decode_cursor(cursor) if cursor else 0,
+        symbols=[s.upper() for s in symbol_list] if symbol_list else None,
+        sector=sector.strip() if sector and sector.strip() else None,
+        sort_field=sort_field,
+        descending=descending,
+        fields=_split(fields),
+    )
+
+
+class ListIndex:
+    """
+    Symbol/sector postings over one immutable list of rows
+    """
+
+    def __init__(self, rows: Sequence[Dict], symbol_key: str, sector_of: Callable[[str], Optional[str]]):
+        self.rows = rows
+        self.by_symbol: Dict[str, List[int]] = {}
+        self.by_sector: Dict[str, List[int]] = {}
+        self._orders: Dict[Tuple[str, bool], List[int]] = {}
+
+        for position, row in enumerate(rows):
+            symbol = str(row.get(symbol_key) or "").strip().upper()
+            if not symbol:
+                continue
+            self.by_symbol.setdefault(symbol, []).append(position)
+            sector = sector_of(symbol)
+            if sector:
+                self.by_sector.setdefault(sector.lower(), []).append(position)
+
+    def sorted_positions(self, field: str, descending: bool) -> List[int]:
+        """Row positions ordered by `field`; computed once per field/direction"""
+        key = (field, descending)
+        order = self._orders.get(key)
+        if order is None:
+            present, missing = [], []
+            known = False
+            for position, row in enumerate(self.rows):
+                value = row.get(field)
+                if value is None:
+                    known = known or field in row
+                    missing.append(position)
+                elif isinstance(value, (str, int, float)):
+                    known = True
+                    present.append(position)
+                else:
+                    # Objects and lists have no order
+                    raise ValueError(f"Cannot sort by '{field}': it is not a number or string")
+            if not known:
+                raise ValueError(f"Cannot sort by unknown field '{field}'")
+
+            def sort_key(position):
+                value = self.rows[position][field]
+                # Numbers and strings never compare with each other
+                return (isinstance(value, str), value)
+
+            # Rows without the field go last in either direction
+            order = sorted(present, key=sort_key, reverse=descending) + missing
+            self._orders[key] = order
+        return order
+
+
+def run_list_query(index: ListIndex, query: ListQuery) -> Tuple[List[Any], int, Optional[str]]:
+    """
+    Evaluate a query against an index.
+    Returns: (rows, total_matching, next_cursor)
+    """
+    positions: Optional[List[int]] = None
+
+    if query.symbols is not None:
+        positions = sorted({p for symbol in query.symbols for p in index.by_symbol.get(symbol, ())})
+    if query.sector is not None:
+        in_sector = index.by_sector.get(query.sector.lower(), [])
+        if positions is None:
+            positions = in_sector
+        else:
+            sector_set = set(in_sector)
+            positions = [p for p in positions if p in sector_set]
+
+    if query.sort_field is not None:
+        order = index.sorted_positions(query.sort_field, query.descending)
+        if positions is not None:
+            wanted = set(positions)
+            positions = [p for p in order if p in wanted]
+        else:
+            positions = order
+
+    total = len(index.rows) if positions is None else len(positions)
+    start = query.offset
+    end = total if query.limit is None else min(total, start + query.limit)
+    page = range(start, end) if positions is None else positions[start:end]
+
+    rows = index.rows
+    if query.fields is None:
+        result = [rows[p] for p in page]
+    else:
+        fields = query.fields
+        result = [{f: rows[p][f] for f in fields if f in rows[p]} for p in page]
+
+    next_cursor = encode_cursor(end) if end < total else None
+    return result, total, next_cursor
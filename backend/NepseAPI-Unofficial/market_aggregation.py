@@ -0,0 +1,136 @@
+"""
+Market Aggregation for NEPSE API
+
+Builds the per-scrip and per-sector summary served by
+TradeTurnoverTransactionSubindices. Shared by the REST server, the
+WebSocket server and the MCP server so the roll-up lives in one place.
+Everything here is a single linear pass over the company list.
+"""
+
+from typing import Any, Dict, Iterable, List, Optional
+
+# Upstream inputs needed by build_market_summary, by route name
+SUMMARY_INPUTS = (
+    "CompanyList",
+    "TopTenTurnoverScrips",
+    "TopTenTransactionScrips",
+    "TopTenTradeScrips",
+    "TopGainers",
+    "TopLosers",
+    "PriceVolume",
+    "NepseSubIndices",
+)
+
+# NEPSE sub-index names differ from the sector names in the company list
+SECTOR_INDEX_MAP = {
+    "Commercial Banks": "Banking SubIndex",
+    "Development Banks": "Development Bank Index",
+    "Finance": "Finance Index",
+    "Hotels And Tourism": "Hotels And Tourism Index",
+    "Hydro Power": "HydroPower Index",
+    "Investment": "Investment Index",
+    "Life Insurance": "Life Insurance",
+    "Manufacturing And Processing": "Manufacturing And Processing",
+    "Microfinance": "Microfinance Index",
+    "Mutual Fund": "Mutual Fund",
+    "Non Life Insurance": "Non Life Insurance",
+    "Others": "Others Index",
+    "Tradings": "Trading Index",
+}
+
+_NO_CHANGE = {"pointChange": 0, "percentageChange": 0, "ltp": 0}
+
+
+def _by_symbol(rows: Optional[Iterable[Dict]]) -> Dict[str, Dict]:
+    return {row["symbol"]: row for row in rows or []}
+
+
+def build_scrips_details(companies: Iterable[Dict], turnover: Iterable[Dict], transaction: Iterable[Dict],
+                         trade: Iterable[Dict], gainers: Iterable[Dict], losers: Iterable[Dict],
+                         price_volume: Iterable[Dict]) -> Dict[str, Dict]:
+    """Join the upstream lists into one record per traded scrip"""
+    turnover = _by_symbol(turnover)
+    transaction = _by_symbol(transaction)
+    trade = _by_symbol(trade)
+    gainers = _by_symbol(gainers)
+    losers = _by_symbol(losers)
+    price_volume = _by_symbol(price_volume)
+
+    scrips_details = {}
+    for company in companies:
+        symbol = company["symbol"]
+        price_info = price_volume.get(symbol, {})
+        mover = gainers.get(symbol) or losers.get(symbol) or _NO_CHANGE
+
+        # A scrip with no ltp or previous close is not trading today
+        if mover["ltp"] == 0 or price_info.get("previousClose", 0) == 0:
+            continue
+
+        scrips_details[symbol] = {
+            "symbol": symbol,
+            "sector": company["sectorName"],
+            "Turnover": turnover.get(symbol, {}).get("turnover", 0),
+            "transaction": transaction.get(symbol, {}).get("totalTrades", 0),
+            "volume": trade.get(symbol, {}).get("shareTraded", 0),
+            "previousClose": price_info.get("previousClose", 0),
+            "lastUpdatedDateTime": price_info.get("lastUpdatedDateTime", 0),
+            "name": company.get("securityName", ""),
+            "category": company.get("instrumentType"),
+            "pointChange": mover["pointChange"],
+            "percentageChange": mover["percentageChange"],
+            "ltp": mover["ltp"],
+        }
+    return scrips_details
+
+
+def aggregate_sectors(scrips_details: Dict[str, Dict], sectors: Iterable[str],
+                      sector_sub_indices: Dict[str, Any]) -> Dict[str, Dict]:
+    """Roll scrip totals up into their sectors in a single pass"""
+    totals = {sector: [0, 0, 0] for sector in sectors}
+    for details in scrips_details.values():
+        sector_totals = totals.get(details["sector"])
+        if sector_totals is None:
+            continue
+        sector_totals[0] += details["transaction"]
+        sector_totals[1] += details["volume"]
+        sector_totals[2] += details["Turnover"]
+
+    return {
+        sector: {
+            "transaction": trades,
+            "volume": volume,
+            "totalTurnover": total_turnover,
+            "turnover": sector_sub_indices.get(SECTOR_INDEX_MAP.get(sector, sector)),
+            "sectorName": sector,
+        }
+        for sector, (trades, volume, total_turnover) in totals.items()
+    }
+
+
+def build_market_summary(upstream: Dict[str, Any]) -> Dict[str, Dict]:
+    """
+    Build {"scripsDetails", "sectorsDetails"} from upstream results keyed
+    by the names in SUMMARY_INPUTS (NepseSubIndices keyed by index name)
+    """
+    companies = upstream["CompanyList"] or []
+    scrips_details = build_scrips_details(
+        companies,
+        upstream.get("TopTenTurnoverScrips"),
+        upstream.get("TopTenTransactionScrips"),
+        upstream.get("TopTenTradeScrips"),
+        upstream.get("TopGainers"),
+        upstream.get("TopLosers"),
+        upstream.get("PriceVolume"),
+    )
+    # dict.fromkeys keeps sectors in first-seen order
+    sectors = dict.fromkeys(company["sectorName"] for company in companies)
+    sectors_details = aggregate_sectors(scrips_details, sectors, upstream.get("NepseSubIndices") or {})
+    return {"scripsDetails": scrips_details, "sectorsDetails": sectors_details}
+
+
+def group_by_sector(scrips_details: Dict[str, Dict]) -> Dict[str, List[Dict]]:
+    """Group scrip records by sector name"""
+    groups: Dict[str, List[Dict]] = {}
+    for details in scrips_details.values():
+        groups.setdefault(details["sector"], []).append(details)
+    return groups
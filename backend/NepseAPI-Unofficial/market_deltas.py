@@ -0,0 +1,130 @@
+"""
+Delta-Encoded Market Snapshots for NEPSE API
+
+Most live market rows do not change between two polls. A DeltaEncoder
+keeps the previous snapshot keyed by securityId and turns each new one
+into a delta frame carrying only the changed fields, the new rows and
+the removed keys, tagged with a sequence number:
+
+    {"topic": "LiveMarketDelta", "seq": 8, "changed": [{"securityId": 131, "lastTradedPrice": 512.3}],
+     "removed": []}
+
+A client applies deltas in sequence order. A full frame ("full": true,
+"data": [...]) resets its state; it is sent on subscribe and on a
+"resync" request, which a client makes when it sees a gap in `seq`.
+"""
+
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+from wire_formats import Frame
+
+# Row identity; the symbol is the fallback for rows without a security id
+KEY_FIELDS = ("securityId", "symbol")
+
+
+def row_key(row: Dict) -> Optional[Hashable]:
+    for field in KEY_FIELDS:
+        key = row.get(field)
+        if key is not None:
+            return key
+    return None
+
+
+def index_rows(data: Any) -> Dict[Hashable, Dict]:
+    """Rows of a list snapshot keyed by row_key; rows without a key are skipped"""
+    if not isinstance(data, list):
+        return {}
+    rows = {}
+    for row in data:
+        if isinstance(row, dict):
+            key = row_key(row)
+            if key is not None:
+                rows[key] = row
+    return rows
+
+
+# Sentinel so a field that is newly present with value None still counts as changed
+_MISSING = object()
+
+
+def diff_rows(previous: Dict[Hashable, Dict], current: Dict[Hashable, Dict]) -> Tuple[List[Dict], List[Hashable]]:
+    """
+    (changed, removed) between two keyed snapshots. A changed entry holds the
+    row's key field plus the fields that differ (all of them for a new row);
+    fields that disappeared are sent as null.
+    """
+    changed = []
+    for key, row in current.items():
+        old = previous.get(key)
+        if old is None:
+            changed.append(row)
+            continue
+        if old == row:
+            continue
+        delta = {field: value for field, value in row.items() if old.get(field, _MISSING) != value}
+        for field in old.keys() - row.keys():
+            delta[field] = None
+        key_field = next(field for field in KEY_FIELDS if row.get(field) is not None)
+        delta[key_field] = key
+        changed.append(delta)
+    removed = [key for key in previous if key not in current]
+    return changed, removed
+
+
+def apply_delta(rows: Dict[Hashable, Dict], frame: Dict) -> Dict[Hashable, Dict]:
+    """Client side: the keyed state after a full or delta frame (returns a new dict)"""
+    if frame.get("full"):
+        return index_rows(frame["data"])
+    rows = dict(rows)
+    for key in frame.get("removed", ()):
+        rows.pop(key, None)
+    for delta in frame.get("changed", ()):
+        key = row_key(delta)
+        rows[key] = {**rows.get(key, {}), **delta}
+    return rows
+
+
+class DeltaEncoder:
+    """
+    Sequence of delta frames for one topic, advanced once per snapshot
+    """
+
+    def __init__(self, topic: str, on_encode: Optional[Callable[[str, int], None]] = None):
+        self.topic = topic
+        self.seq = 0
+        self.rows: Dict[Hashable, Dict] = {}
+        self._data: Any = []
+        self._full_frame: Optional[Frame] = None
+        # Passed on to the full frames, for encoding stats
+        self.on_encode = on_encode
+
+        # Counters
+        self.deltas = 0
+        self.rows_changed = 0
+
+    def advance(self, data: Any) -> Dict:
+        """Take the next snapshot; returns its delta message (not yet encoded)"""
+        current = index_rows(data)
+        changed, removed = diff_rows(self.rows, current)
+        self.seq += 1
+        self.rows = current
+        self._data = data
+        self._full_frame = None
+        self.deltas += 1
+        self.rows_changed += len(changed)
+        return {"topic": self.topic, "seq": self.seq, "changed": changed, "removed": removed}
+
+    def full_frame(self) -> Frame:
+        """The current state as a full frame, built once per sequence number"""
+        if self._full_frame is None:
+            self._full_frame = Frame({"topic": self.topic, "seq": self.seq, "full": True, "data": self._data},
+                                     on_encode=self.on_encode)
+        return self._full_frame
+
+    def get_stats(self) -> Dict:
+        return {
+            "seq": self.seq,
+            "rows": len(self.rows),
+            "deltas": self.deltas,
+            "rows_changed": self.rows_changed,
+        }
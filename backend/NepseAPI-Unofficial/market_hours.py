@@ -0,0 +1,65 @@
+"""
+NEPSE Trading Calendar Helpers
+
+Small helpers describing the NEPSE trading session (Sunday to Thursday,
+11:00 - 15:00 Nepal time) so caches and pollers can decide how long data
+stays valid once the market has closed.
+"""
+
+from datetime import datetime, time, timedelta, timezone
+from typing import Any, Optional
+
+# Nepal Standard Time is UTC+05:45
+NPT = timezone(timedelta(hours=5, minutes=45))
+
+SESSION_OPEN = time(11, 0)
+SESSION_CLOSE = time(15, 0)
+
+# datetime.weekday(): Monday = 0 ... Sunday = 6
+TRADING_DAYS = {6, 0, 1, 2, 3}  # Sunday - Thursday
+
+
+def now_npt() -> datetime:
+    """Current time in Nepal"""
+    return datetime.now(NPT)
+
+
+def next_session_open(now: Optional[datetime] = None) -> datetime:
+    """Start of the next trading session strictly after `now`"""
+    now = (now or now_npt()).astimezone(NPT)
+    candidate = now.replace(hour=SESSION_OPEN.hour, minute=SESSION_OPEN.minute, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    while candidate.weekday() not in TRADING_DAYS:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def next_session_close(now: Optional[datetime] = None) -> datetime:
+    """End of the current session, or of the next one if none is running"""
+    now = (now or now_npt()).astimezone(NPT)
+    candidate = now.replace(hour=SESSION_CLOSE.hour, minute=SESSION_CLOSE.minute, second=0, microsecond=0)
+    if candidate <= now:
+        candidate += timedelta(days=1)
+    while candidate.weekday() not in TRADING_DAYS:
+        candidate += timedelta(days=1)
+    return candidate
+
+
+def in_session(now: Optional[datetime] = None) -> bool:
+    """Whether `now` falls inside a scheduled trading session (holidays are not known here)"""
+    now = (now or now_npt()).astimezone(NPT)
+    return now.weekday() in TRADING_DAYS and SESSION_OPEN <= now.time() < SESSION_CLOSE
+
+
+def seconds_until_next_session(now: Optional[datetime] = None) -> float:
+    """Seconds from `now` until the next session opens"""
+    now = (now or now_npt()).astimezone(NPT)
+    return (next_session_open(now) - now).total_seconds()
+
+
+def is_open_status(status: Any) -> bool:
+    """Interpret an `isNepseOpen` payload ({"isOpen": "OPEN", ...})"""
+    if isinstance(status, dict):
+        return str(status.get("isOpen", "")).upper() == "OPEN"
+    return False
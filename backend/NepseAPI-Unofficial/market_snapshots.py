@@ -0,0 +1,201 @@
+"""
+Background Market Snapshots for NEPSE API
+
+A background asyncio task polls the hot upstream endpoints (live market,
+price/volume, summary, indices, supply/demand) on a schedule and stores
+each result as an immutable snapshot. Readers get the latest snapshot in
+O(1) without touching upstream. Polling backs off once NEPSE closes.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, List, Optional
+
+from fan_out import gather_upstream
+from market_hours import in_session, is_open_status, seconds_until_next_session
+from payloads import Payload
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Snapshot:
+    """One upstream response; replaced as a whole, never modified in place"""
+    route: str
+    payload: Payload
+    fetched_at: float
+    version: int
+
+    @property
+    def data(self) -> Any:
+        return self.payload.data
+
+
+class SnapshotStore:
+    """
+    Latest snapshot per route
+    """
+
+    def __init__(self):
+        self._snapshots: Dict[str, Snapshot] = {}
+        self.version = 0
+        # Called with each new snapshot (e.g. to push it to WebSocket subscribers)
+        self.listeners: List[Callable[[Snapshot], None]] = []
+
+    def add_listener(self, listener: Callable[[Snapshot], None]):
+        self.listeners.append(listener)
+
+    def put(self, route: str, data: Any) -> Snapshot:
+        """Publish a new snapshot for a route"""
+        self.version += 1
+        snapshot = Snapshot(route=route, payload=Payload(data), fetched_at=time.time(), version=self.version)
+        # Single dict assignment, so readers never see a half-built snapshot
+        self._snapshots[route] = snapshot
+        for listener in self.listeners:
+            try:
+                listener(snapshot)
+            except Exception as e:
+                logger.error(f"Snapshot listener failed for {route}: {e}")
+        return snapshot
+
+    def get(self, route: str) -> Optional[Snapshot]:
+        return self._snapshots.get(route)
+
+    def routes(self):
+        return list(self._snapshots)
+
+
+class MarketPoller:
+    """
+    Polls a fixed set of upstream fetchers and publishes them to a SnapshotStore
+    """
+
+    def __init__(self, fetchers: Dict[str, Callable[[], Awaitable[Any]]],
+                 market_status_fetcher: Callable[[], Awaitable[Any]],
+                 store: Optional[SnapshotStore] = None,
+                 open_interval: Optional[float] = None,
+                 max_interval: Optional[float] = None,
+                 call_timeout: float = 10.0):
+        self.fetchers = fetchers
+        self.market_status_fetcher = market_status_fetcher
+        self.store = store or SnapshotStore()
+
+        # Poll interval while open, and the ceiling it backs off to when closed
+        self.open_interval = open_interval or float(os.environ.get("SNAPSHOT_POLL_INTERVAL", 5))
+        self.max_interval = max_interval or float(os.environ.get("SNAPSHOT_MAX_INTERVAL", 1800))
+        self.call_timeout = call_timeout
+        self.interval = self.open_interval
+
+        self.market_open: Optional[bool] = None
+        self._task: Optional[asyncio.Task] = None
+
+        # Counters
+        self.polls = 0
+        self.failures = 0
+        self.last_poll: Optional[float] = None
+
+    async def _check_market_open(self) -> bool:
+        try:
+            return is_open_status(await self.market_status_fetcher())
+        except Exception as e:
+            logger.warning(f"Snapshot poller could not read market status: {e}")
+            # Keep the previous state; assume open on the very first poll
+            return True if self.market_open is None else self.market_open
+
+    def _next_interval(self, market_open: bool) -> float:
+        """Fixed cadence while open, exponential back-off while closed"""
+        # Inside the session window the upstream status can lag the opening bell,
+        # so trust the clock and poll at the open cadence
+        if market_open or in_session():
+            return self.open_interval
+        backed_off = min(self.interval * 2, self.max_interval)
+        # Never sleep through the opening bell
+        return max(self.open_interval, min(backed_off, seconds_until_next_session()))
+
+    async def poll_once(self) -> bool:
+        """Fetch every hot endpoint concurrently and publish the results"""
+        market_open = await self._check_market_open()
+        results, errors = await gather_upstream(self.fetchers, timeout=self.call_timeout)
+        for route, data in results.items():
+            if route not in errors:
+                self.store.put(route, data)
+
+        self.polls += 1
+        self.failures += len(errors)
+        self.last_poll = time.time()
+        self.market_open = market_open
+        return market_open
+
+    async def run(self):
+        """Poll until cancelled"""
+        while True:
+            try:
+                market_open = await self.poll_once()
+                self.interval = self._next_interval(market_open)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Snapshot poll failed: {e}")
+            await asyncio.sleep(self.interval)
+
+    def start(self):
+        """Start the background task on the running loop"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self.run())
+            logger.info(f"Snapshot poller started for: {', '.join(self.fetchers)}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def latest(self, route: str) -> Optional[Snapshot]:
+        """
+        Latest snapshot for a route, or None if the poller isn't serving it
+        (not running, or the snapshot is older than two poll intervals)
+        """
+        snapshot = self.store.get(route)
+        if snapshot is None or not self.running:
+            return None
+        # A backed-off interval must not let pre-open data pass as fresh once the session starts
+        interval = self.open_interval if in_session() else self.interval
+        if time.time() - snapshot.fetched_at > 2 * interval + self.call_timeout:
+            return None
+        return snapshot
+
+    def get_stats(self) -> Dict:
+        """Get poller statistics"""
+        now = time.time()
+        return {
+            "running": self.running,
+            "market_open": self.market_open,
+            "interval_seconds": self.interval,
+            "polls": self.polls,
+            "failed_calls": self.failures,
+            "last_poll": self.last_poll,
+            "store_version": self.store.version,
+            "snapshots": {
+                route: {
+                    "version": snapshot.version,
+                    "age_seconds": round(now - snapshot.fetched_at, 3),
+                }
+                for route in self.store.routes()
+                for snapshot in [self.store.get(route)]
+            },
+        }
+
+
+def poller_enabled() -> bool:
+    """The poller can be switched off with SNAPSHOT_POLLER=0"""
+    return os.environ.get("SNAPSHOT_POLLER", "1").lower() not in ("0", "false", "no")
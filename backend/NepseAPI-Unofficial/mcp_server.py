@@ -2,6 +2,7 @@ import logging
 import os
 import time
 import threading
+from urllib.parse import urlencode
 from typing import Any, Dict, List, Optional
 from pydantic import BaseModel, Field, ValidationError
 from starlette.middleware.authentication import AuthenticationMiddleware
@@ -19,11 +20,20 @@ from fastmcp.server.middleware.error_handling import (
     ErrorHandlingMiddleware,
     RetryMiddleware
 )
+from fastmcp.server.middleware import Middleware, MiddlewareContext
+from fastmcp.server.dependencies import get_http_request
+from fastmcp.exceptions import ToolError
 
 load_dotenv()
 
 # Import validation utilities
-from validator import validate_stock_symbol, find_symbol_by_company_name, find_company_name_by_symbol
+from validator import validate_stock_symbol, find_symbol_by_company_name, find_company_name_by_symbol, validator
+
+# Shared rate limiter (same backend as the REST and WebSocket servers when RATE_LIMIT_BACKEND=sqlite)
+from rate_limiter import check_rate_limit_async
+
+# Shared sector roll-up helpers (same module the REST and WebSocket servers use)
+from market_aggregation import group_by_sector
 
 BASE_URL = os.environ.get("BASE_URL", "http://localhost:8000")
 
@@ -51,6 +61,28 @@ mcp.add_middleware(RateLimitingMiddleware(
     burst_capacity=6
 ))
 
+class SharedRateLimitMiddleware(Middleware):
+    """Per-client limit on tool calls, enforced by the shared rate limiter"""
+
+    async def on_call_tool(self, context: MiddlewareContext, call_next):
+        try:
+            request = get_http_request()
+            forwarded_for = request.headers.get("X-Forwarded-For")
+            client_ip = forwarded_for.split(",")[0].strip() if forwarded_for else (request.client.host if request.client else "unknown")
+        except RuntimeError:
+            # No HTTP request behind this call (stdio transport)
+            client_ip = "stdio"
+
+        allowed, info = await check_rate_limit_async(client_ip, "mcp_tool")
+        if not allowed:
+            raise ToolError(
+                f"Rate limit exceeded for MCP tool '{context.message.name}'. "
+                f"Limit: {info['limit']} requests per minute. Try again in {info['retry_after']} seconds."
+            )
+        return await call_next(context)
+
+mcp.add_middleware(SharedRateLimitMiddleware())
+
 mcp.add_middleware(ErrorHandlingMiddleware(
     include_traceback=True,
     transform_errors=True,
@@ -486,6 +518,16 @@ class TimeSeriesData(BaseModel):
 _endpoint_cache = {}
 _endpoint_cache_lock = threading.Lock()
 _ENDPOINT_CACHE_TTL = 600  # 10 minutes
+# The REST server serves these from background snapshots, so re-reading is cheap
+_HOT_ENDPOINT_TTLS = {
+    "/LiveMarket": 5,
+    "/PriceVolume": 10,
+    "/Summary": 10,
+    "/NepseIndex": 10,
+    "/NepseSubIndices": 10,
+    "/SupplyDemand": 10,
+    "/IsNepseOpen": 30,
+}
 
 def fetch_nepse_api(endpoint: str) -> Dict[str, Any]:
     """Fetch data from the NEPSE API and return parsed JSON, with endpoint-level caching."""
@@ -504,7 +546,7 @@ def fetch_nepse_api(endpoint: str) -> Dict[str, Any]:
     response.raise_for_status()
     data = response.json()
     with _endpoint_cache_lock:
-        _endpoint_cache[cache_key] = (data, now + _ENDPOINT_CACHE_TTL)
+        _endpoint_cache[cache_key] = (data, now + _HOT_ENDPOINT_TTLS.get(endpoint.split("?")[0], _ENDPOINT_CACHE_TTL))
     return data
 
 def validate_and_return(data: Any, model_class: BaseModel, is_list: bool = False):
@@ -879,11 +921,8 @@ def get_price_volume(company: str = "", limit: Optional[int] = None, page: Optio
         if company in ('None', 'null', '', 'undefined', None):
             company = None
 
-        response = fetch_nepse_api("/PriceVolume")
-        validated_data = validate_and_return(response, PriceVolumeItem, is_list=True)
-        items = [item.model_dump() if hasattr(item, 'model_dump') else item for item in validated_data]
-
-        # Filter by company if provided
+        # Resolve the company filter to symbols; the server does the filtering (?symbols=)
+        symbols = None
         if company is not None and company.strip():
             company_clean = company.strip()
             logger.info(f"Filtering by company: '{company_clean}'")
@@ -891,36 +930,31 @@ def get_price_volume(company: str = "", limit: Optional[int] = None, page: Optio
             # Step 1: Check if it's a valid symbol first
             validation_result = validate_stock_symbol(company_clean)
             if validation_result.get("valid"):
-                validated_symbol = validation_result["symbol"]
-                logger.info(f"Found valid symbol: {validated_symbol}")
-
-                filtered = [item for item in items if item.get("symbol", "").strip().upper() == validated_symbol.upper()]
-                if filtered:
-                    items = filtered
-                    logger.info(f"Filtered to {len(items)} items by symbol")
-                else:
-                    return {"error": f"No price/volume data found for symbol '{validated_symbol}'."}
+                symbols = [validation_result["symbol"].upper()]
+                logger.info(f"Found valid symbol: {symbols[0]}")
+                not_found = f"No price/volume data found for symbol '{symbols[0]}'."
             else:
                 # Step 2: Try to find symbol by company name
                 logger.info(f"Not a valid symbol, trying company name lookup")
                 symbol_lookup = find_symbol_by_company_name(company_clean)
 
                 if symbol_lookup.get("found"):
-                    matching_symbols = [match["symbol"] for match in symbol_lookup.get("matches", [])]
-                    logger.info(f"Found symbols from company name lookup: {matching_symbols}")
-
-                    filtered = [item for item in items if item.get("symbol", "").strip().upper() in [s.upper() for s in matching_symbols]]
-                    if filtered:
-                        items = filtered
-                        logger.info(f"Filtered to {len(items)} items by company name")
-                    else:
-                        return {"error": f"No price/volume data found for company '{company_clean}'."}
+                    symbols = [match["symbol"].upper() for match in symbol_lookup.get("matches", [])]
+                    logger.info(f"Found symbols from company name lookup: {symbols}")
+                    not_found = f"No price/volume data found for company '{company_clean}'."
                 else:
                     # Step 3: No match found, return all companies with pagination
                     logger.info(f"No exact match found for '{company_clean}', returning all companies with pagination")
         else:
             logger.info("No company filter provided, returning paginated results")
 
+        endpoint = f"/PriceVolume?symbols={','.join(symbols)}" if symbols else "/PriceVolume"
+        response = fetch_nepse_api(endpoint)
+        validated_data = validate_and_return(response, PriceVolumeItem, is_list=True)
+        items = [item.model_dump() if hasattr(item, 'model_dump') else item for item in validated_data]
+        if symbols and not items:
+            return {"error": not_found}
+
         paged_items, total, page, limit = paginate_list(items, limit, page)
         logger.info(f"Returning {len(paged_items)} items out of {total} total")
 
@@ -1284,6 +1318,87 @@ def get_supply_demand(limit: Optional[int] = None, page: Optional[int] = 1) -> D
         logger.error(f"Error fetching supply and demand data: {e}")
         return {"error": str(e)}
 
+@mcp.tool()
+def get_sector_performance(sector: str = "", limit: Optional[int] = None, page: Optional[int] = 1) -> Dict:
+    """
+    Get today's sector roll-up (transactions, volume, turnover and sub-index) with the traded scrips in each sector.
+    Args:
+        sector: (optional) Sector name, e.g. "Commercial Banks" or "Hydro Power". Leave empty for all sectors.
+        limit: (optional) Number of scrips per page when a sector is given (default: 10).
+        page: (optional) Page number for pagination (default: 1).
+    Returns:
+        Dict with:
+            - sectors: Dict mapping sector names to transaction, volume, totalTurnover, turnover (sub-index) and sectorName
+            - results: (when a sector is given) Paginated scrips of that sector sorted by turnover
+            - total: (when a sector is given) Total number of traded scrips in the sector
+    Use this tool to analyze how a sector performed today.
+    """
+    try:
+        if sector in ('None', 'null', '', 'undefined', None):
+            sector = None
+
+        response = fetch_nepse_api("/TradeTurnoverTransactionSubindices")
+        sectors = response.get("sectorsDetails", {})
+        if sector is None:
+            return {"sectors": sectors}
+
+        matched = next((name for name in sectors if name.lower() == sector.strip().lower()), None)
+        if matched is None:
+            return {"error": f"Sector '{sector}' not found. Available sectors: {', '.join(sectors)}"}
+
+        scrips = group_by_sector(response.get("scripsDetails", {})).get(matched, [])
+        scrips = sorted(scrips, key=lambda item: item.get("Turnover", 0), reverse=True)
+        paged_items, total, page, limit = paginate_list(scrips, limit, page)
+        return {
+            "sectors": {matched: sectors[matched]},
+            "results": paged_items,
+            "total": total,
+            "page": page,
+            "limit": limit
+        }
+    except Exception as e:
+        logger.error(f"Error fetching sector performance: {e}")
+        return {"error": str(e)}
+
+@mcp.tool()
+def get_broker_flow(symbol: str = "", broker: str = "", date: str = "", start_date: str = "",
+                    end_date: str = "", top: Optional[int] = 10) -> Dict:
+    """
+    Get broker flow analytics from archived floorsheets: which brokers are accumulating or distributing.
+    Args:
+        symbol: (optional) Stock symbol to restrict the analysis to.
+        broker: (optional) Broker number; adds that broker's per-symbol positions.
+        date: (optional) Business date YYYY-MM-DD, or "live" for today's floorsheet. Defaults to the latest archived day.
+        start_date: (optional) Start of a date range YYYY-MM-DD (inclusive).
+        end_date: (optional) End of a date range YYYY-MM-DD (inclusive).
+        top: (optional) Number of brokers/symbols in each ranking (default: 10).
+    Returns:
+        Dict with:
+            - dates: Business dates covered
+            - trades, quantity, amount, vwap: Totals for the selection
+            - tradeSizeDistribution: Trades and quantity per trade-size bucket
+            - topAccumulating / topDistributing: Brokers with bought, sold, net, buyVwap, sellVwap
+            - topSymbols: (without symbol) Most traded symbols by amount
+            - broker: (with broker) That broker's totals and per-symbol positions
+    Use this tool to analyze broker accumulation/distribution for a stock or the market over a day or a date range.
+    """
+    try:
+        params = {}
+        for key, value in (("symbol", symbol), ("broker", broker), ("date", date),
+                           ("start", start_date), ("end", end_date)):
+            if value not in ('None', 'null', '', 'undefined', None):
+                params[key] = str(value).strip()
+        if "symbol" in params:
+            validation_result = validate_stock_symbol(params["symbol"])
+            if not validation_result["valid"]:
+                return {"error": validation_result["error"]}
+            params["symbol"] = validation_result["symbol"]
+        params["top"] = top or 10
+        return fetch_nepse_api(f"/BrokerFlow?{urlencode(params)}")
+    except Exception as e:
+        logger.error(f"Error fetching broker flow: {e}")
+        return {"error": str(e)}
+
 @mcp.tool()
 def validate_stock_symbol_tool(symbol: str) -> Dict:
     """
@@ -1305,12 +1420,12 @@ def validate_stock_symbol_tool(symbol: str) -> Dict:
 @mcp.tool()
 def get_company_symbol(company_name: str) -> Dict:
     """
-    Find stock symbol by company name. Use the first significant word of the company name for best results.
+    Find stock symbol by company name. The first significant word gives the best matches; several words (e.g. 'sanima hydro') narrow the results.
     Args:
         company_name: Name of the company to search for.
     Returns:
         Dict with:
-            - search_result: Dict with keys 'found', 'query', 'matches' (list of symbol/company_name/match_type), 'total_matches', or 'error'
+            - search_result: Dict with keys 'found', 'query', 'matches' (list of symbol/company_name/match_type, best first; match_type is 'exact', 'partial' or 'token'), 'total_matches', or 'error'
     Use this tool to find the NEPSE symbol for a company by its name.
     """
     try:
@@ -1347,4 +1462,5 @@ if __name__ == "__main__":
     # for local testing
     # mcp.run(transport="stdio")
     # for production / remote
+    validator.start_watching()
     mcp.run(transport="http", host="0.0.0.0", port=PORT)
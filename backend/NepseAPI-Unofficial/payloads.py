@@ -0,0 +1,137 @@
+"""
+Pre-serialized Response Payloads for NEPSE API
+
+Wraps a cached/snapshotted response so its JSON encoding, ETag and
+gzip/brotli variants are computed once and reused by every request that
+serves it. Uses orjson and brotli when they are installed.
+"""
+
+import gzip
+import hashlib
+import json
+from typing import Any, Callable, Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # optional speed-up
+    orjson = None
+
+try:
+    import brotli
+except ImportError:  # optional, gzip is always available
+    brotli = None
+
+# Bodies smaller than this are sent uncompressed
+MIN_COMPRESS_SIZE = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def encode_json(data: Any) -> bytes:
+    """Compact UTF-8 JSON encoding"""
+    if orjson is not None:
+        try:
+            return orjson.dumps(data)
+        except TypeError:
+            # e.g. integers wider than 64 bits or non-str dict keys
+            pass
+    return json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class Payload:
+    """
+    A response body that is encoded and hashed at most once
+    """
+
+    __slots__ = ("data", "_body", "_etag", "_variants", "_derived")
+
+    def __init__(self, data: Any):
+        self.data = data
+        self._body: Optional[bytes] = None
+        self._etag: Optional[str] = None
+        self._variants: Dict[str, bytes] = {}
+        self._derived: Dict[str, Any] = {}
+
+    @property
+    def body(self) -> bytes:
+        if self._body is None:
+            self._body = encode_json(self.data)
+        return self._body
+
+    @property
+    def etag(self) -> str:
+        """Strong ETag derived from the encoded body"""
+        if self._etag is None:
+            self._etag = '"' + hashlib.blake2b(self.body, digest_size=16).hexdigest() + '"'
+        return self._etag
+
+    def encoded(self, encoding: str) -> bytes:
+        """Body in the given content-coding ("identity", "gzip" or "br"), compressed once"""
+        if encoding == "identity":
+            return self.body
+        variant = self._variants.get(encoding)
+        if variant is None:
+            if encoding == "gzip":
+                variant = gzip.compress(self.body, compresslevel=GZIP_LEVEL, mtime=0)
+            elif encoding == "br" and brotli is not None:
+                variant = brotli.compress(self.body, quality=BROTLI_QUALITY)
+            else:
+                raise ValueError(f"Unsupported content-coding: {encoding}")
+            self._variants[encoding] = variant
+        return variant
+
+    def etag_for(self, encoding: str) -> str:
+        """Each content-coding is a different representation, so it gets its own strong ETag"""
+        if encoding == "identity":
+            return self.etag
+        return self.etag[:-1] + "-" + encoding + '"'
+
+    def derived(self, key: str, build: Callable[[Any], Any]) -> Any:
+        """Structure derived from the data (e.g. a query index), built once per payload"""
+        value = self._derived.get(key)
+        if value is None:
+            value = build(self.data)
+            self._derived[key] = value
+        return value
+
+
+def negotiate_encoding(accept_encoding: Optional[str], body_size: int) -> str:
+    """Pick the best content-coding the client accepts: br, then gzip, else identity"""
+    if not accept_encoding or body_size < MIN_COMPRESS_SIZE:
+        return "identity"
+
+    accepted = {}
+    for item in accept_encoding.split(","):
+        coding, _, params = item.strip().partition(";")
+        quality = 1.0
+        params = params.strip()
+        if params.startswith("q="):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding.strip().lower()] = quality
+
+    def allowed(coding: str) -> bool:
+        return accepted.get(coding, accepted.get("*", 0.0)) > 0
+
+    if brotli is not None and allowed("br"):
+        return "br"
+    if allowed("gzip"):
+        return "gzip"
+    return "identity"
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Evaluate an If-None-Match header against an ETag (weak comparison, RFC 9110)"""
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate.startswith("W/"):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
@@ -0,0 +1,187 @@
+"""
+WebSocket Publish/Subscribe for NEPSE API
+
+Clients subscribe to topics instead of polling. The market snapshot
+poller is the only producer: each new snapshot is turned into one frame,
+encoded once per wire format in use and delivered to every subscriber of
+its topic, so upstream load does not grow with the number of connected
+clients.
+
+Topics:
+  - LiveMarket, NepseIndex, NepseSubIndices, Summary, SupplyDemand, PriceVolume:
+    the full snapshot, pushed on every poll
+  - LiveMarket:<SYMBOL>: that symbol's live market row, pushed when it changes
+  - LiveMarketDelta: only the changed live market fields, with a sequence
+    number (see market_deltas)
+"""
+
+import logging
+from typing import Any, Callable, Dict, Iterable, List, Optional, Set
+
+import websockets
+
+from market_deltas import DeltaEncoder
+from market_snapshots import Snapshot
+from wire_formats import Frame
+
+logger = logging.getLogger(__name__)
+
+# Routes published as whole-snapshot topics
+SNAPSHOT_TOPICS = ["LiveMarket", "NepseIndex", "NepseSubIndices", "Summary", "SupplyDemand", "PriceVolume"]
+
+# Delta topic -> the route whose snapshots it diffs
+DELTA_TOPICS = {"LiveMarketDelta": "LiveMarket"}
+
+# Per-symbol ticks are cut from this route's rows
+SYMBOL_TOPIC_ROUTE = "LiveMarket"
+SYMBOL_TOPIC_PREFIX = SYMBOL_TOPIC_ROUTE + ":"
+
+
+def symbol_topic(symbol: str) -> str:
+    return SYMBOL_TOPIC_PREFIX + symbol
+
+
+def broadcast_frame(connections: Iterable, topic: str, frame: Frame):
+    """Default delivery: write the JSON frame straight to every connection"""
+    websockets.broadcast(connections, frame.encoded())
+
+
+def rows_by_symbol(data: Any) -> Dict[str, Dict]:
+    """Live market rows keyed by symbol"""
+    if not isinstance(data, list):
+        return {}
+    return {row["symbol"]: row for row in data if isinstance(row, dict) and row.get("symbol")}
+
+
+class TopicHub:
+    """
+    Topic -> subscribed connections, fed by snapshot publications
+    """
+
+    def __init__(self, latest: Callable[[str], Optional[Snapshot]],
+                 deliver: Callable[[Iterable, str, Frame], None] = broadcast_frame):
+        # Current snapshot of a route (MarketPoller.latest), for a new subscriber's first frame
+        self.latest = latest
+        # Called with (subscribers, topic, frame); the WebSocket server queues per connection
+        self.deliver = deliver
+        self.subscribers: Dict[str, Set] = {}
+        self.topics_of: Dict[Any, Set[str]] = {}
+        # Last row pushed per symbol topic, so unchanged rows are not re-sent
+        self._last_rows: Dict[str, Dict] = {}
+        # Advanced on every snapshot, subscribed or not, so a full frame is always at hand
+        self.delta_encoders = {topic: DeltaEncoder(topic, on_encode=self._count_encoded) for topic in DELTA_TOPICS}
+
+        # Counters
+        self.frames_published = 0
+        self.messages_sent = 0
+        self.bytes_encoded: Dict[str, int] = {}
+
+    def _count_encoded(self, fmt: str, size: int):
+        self.bytes_encoded[fmt] = self.bytes_encoded.get(fmt, 0) + size
+
+    def subscribe(self, connection, topics: List[str]) -> List[str]:
+        """Add topics for a connection; returns the topics newly subscribed"""
+        added = []
+        current = self.topics_of.setdefault(connection, set())
+        for topic in topics:
+            if topic not in current:
+                current.add(topic)
+                self.subscribers.setdefault(topic, set()).add(connection)
+                added.append(topic)
+                if topic.startswith(SYMBOL_TOPIC_PREFIX) and topic not in self._last_rows:
+                    self._seed_last_row(topic)
+        return added
+
+    def _seed_last_row(self, topic: str):
+        """
+        A new symbol topic's first frame comes from the current snapshot, so record
+        that row as pushed; otherwise the next poll re-sends it unchanged
+        """
+        snapshot = self.latest(SYMBOL_TOPIC_ROUTE)
+        if snapshot is not None:
+            row = snapshot.payload.derived("rows_by_symbol", rows_by_symbol).get(topic[len(SYMBOL_TOPIC_PREFIX):])
+            if row is not None:
+                self._last_rows[topic] = row
+
+    def unsubscribe(self, connection, topics: Optional[List[str]] = None) -> List[str]:
+        """Drop some (or, without `topics`, all) of a connection's topics"""
+        current = self.topics_of.get(connection, set())
+        removed = [topic for topic in (current.copy() if topics is None else topics) if topic in current]
+        for topic in removed:
+            current.discard(topic)
+            subscribers = self.subscribers.get(topic)
+            if subscribers is not None:
+                subscribers.discard(connection)
+                if not subscribers:
+                    del self.subscribers[topic]
+                    self._last_rows.pop(topic, None)
+        if not current:
+            self.topics_of.pop(connection, None)
+        return removed
+
+    def _frame(self, topic: str, snapshot: Snapshot) -> Optional[Frame]:
+        """The topic's frame for a snapshot, built once and cached on the snapshot's payload"""
+        if topic.startswith(SYMBOL_TOPIC_PREFIX):
+            row = snapshot.payload.derived("rows_by_symbol", rows_by_symbol).get(topic[len(SYMBOL_TOPIC_PREFIX):])
+            if row is None:
+                return None
+        else:
+            row = None
+
+        def build(data):
+            self.frames_published += 1
+            return Frame({"topic": topic, "version": snapshot.version, "fetchedAt": snapshot.fetched_at,
+                          "data": data if row is None else row}, on_encode=self._count_encoded)
+
+        return snapshot.payload.derived("frame:" + topic, build)
+
+    def current_frame(self, topic: str) -> Optional[Frame]:
+        """Frame for the topic's current snapshot, if the poller has one"""
+        encoder = self.delta_encoders.get(topic)
+        if encoder is not None:
+            # Full frame at the encoder's sequence number: the base the next delta applies to
+            return encoder.full_frame() if encoder.seq else None
+        snapshot = self.latest(topic.split(":", 1)[0])
+        return None if snapshot is None else self._frame(topic, snapshot)
+
+    def _publish(self, topic: str, frame: Frame):
+        subscribers = self.subscribers.get(topic)
+        if subscribers:
+            self.deliver(subscribers, topic, frame)
+            self.messages_sent += len(subscribers)
+
+    def on_snapshot(self, snapshot: Snapshot):
+        """SnapshotStore listener: push the new snapshot to its topics"""
+        route = snapshot.route
+        # Nothing is encoded for topics nobody is subscribed to
+        if route in SNAPSHOT_TOPICS and self.subscribers.get(route):
+            self._publish(route, self._frame(route, snapshot))
+
+        for topic, source in DELTA_TOPICS.items():
+            if source == route:
+                message = self.delta_encoders[topic].advance(snapshot.data)
+                if self.subscribers.get(topic):
+                    self.frames_published += 1
+                    self._publish(topic, Frame(message, on_encode=self._count_encoded))
+
+        if route == SYMBOL_TOPIC_ROUTE:
+            rows = None
+            for topic in [topic for topic in self.subscribers if topic.startswith(SYMBOL_TOPIC_PREFIX)]:
+                if rows is None:
+                    rows = snapshot.payload.derived("rows_by_symbol", rows_by_symbol)
+                row = rows.get(topic[len(SYMBOL_TOPIC_PREFIX):])
+                if row is None or self._last_rows.get(topic) == row:
+                    continue
+                self._last_rows[topic] = row
+                self._publish(topic, self._frame(topic, snapshot))
+
+    def get_stats(self) -> Dict:
+        return {
+            "connections": len(self.topics_of),
+            "topics": {topic: len(subscribers) for topic, subscribers in self.subscribers.items()},
+            "frames_published": self.frames_published,
+            "messages_sent": self.messages_sent,
+            "bytes_encoded": sum(self.bytes_encoded.values()),
+            "bytes_encoded_by_format": dict(self.bytes_encoded),
+            "deltas": {topic: encoder.get_stats() for topic, encoder in self.delta_encoders.items()},
+        }
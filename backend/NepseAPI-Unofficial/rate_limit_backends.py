@@ -0,0 +1,205 @@
+"""
+Rate Limit Storage Backends for NEPSE API
+
+Where the GCRA state (one theoretical arrival time per key) lives:
+
+  - MemoryBackend: per-process OrderedDict (default)
+  - SQLiteBackend: a local SQLite file in WAL mode, shared by every
+    process on the host (uvicorn workers, the WebSocket server and the
+    MCP server), updated atomically with BEGIN IMMEDIATE
+
+Select with RATE_LIMIT_BACKEND=memory|sqlite; the SQLite file is
+RATE_LIMIT_DB (default: <tmp>/nepseapi_rate_limit.db).
+"""
+
+import logging
+import os
+import sqlite3
+import tempfile
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Absorbs float drift after `limit` additions of the emission interval
+EPSILON = 1e-9
+
+
+def gcra_step(tat: Optional[float], now: float, increment: float, window: float) -> Tuple[bool, float]:
+    """
+    One GCRA decision. `increment` is cost x emission interval.
+    Returns (allowed, tat after the decision).
+    """
+    tat = now if tat is None or tat < now else tat
+    new_tat = tat + increment
+    # Allowed while the backlog of admitted requests fits in one window
+    if new_tat - now <= window + EPSILON:
+        return True, new_tat
+    return False, tat
+
+
+class MemoryBackend:
+    """
+    In-process TATs, least recently admitted first
+    """
+
+    name = "memory"
+    # Calls never block, so async callers can use it inline
+    blocking = False
+
+    def __init__(self, eviction_batch: int = 8):
+        # "ip|category" -> theoretical arrival time
+        self.tat: "OrderedDict[str, float]" = OrderedDict()
+        # Expired keys evicted per request (to prevent memory leaks without a full scan)
+        self.eviction_batch = eviction_batch
+        self.evicted = 0
+
+    def _evict_expired(self, now: float):
+        """
+        Drop up to `eviction_batch` expired keys from the least recently admitted end,
+        stopping at the first live key. An expired key carries no state (a fresh key
+        behaves the same). Keys are kept in admission order, not expiry order, so an
+        expired key can wait behind a live one; but every key expires within one window
+        of its last admission, so the front is dropped within a window and the table
+        holds at most the keys admitted in the last window or so.
+        """
+        tat = self.tat
+        for _ in range(self.eviction_batch):
+            if not tat:
+                return
+            key, key_tat = next(iter(tat.items()))
+            if key_tat > now:
+                return
+            del tat[key]
+            self.evicted += 1
+
+    def acquire(self, key: str, now: float, increment: float, window: float) -> Tuple[bool, float]:
+        # Bounded, amortized cleanup: each request adds at most one key and evicts up to a few
+        self._evict_expired(now)
+        allowed, tat = gcra_step(self.tat.get(key), now, increment, window)
+        if allowed:
+            self.tat[key] = tat
+            self.tat.move_to_end(key)
+        return allowed, tat
+
+    def refund(self, key: str, now: float, decrement: float):
+        """Give back tokens that were acquired but not used"""
+        tat = self.tat.get(key)
+        if tat is not None:
+            self.tat[key] = max(now, tat - decrement)
+
+    def get_stats(self, now: float) -> Dict:
+        return {
+            "backend": self.name,
+            "total_tracked_ips": len({key.rsplit("|", 1)[0] for key in self.tat}),
+            "total_tracked_keys": len(self.tat),
+            "active_keys": sum(1 for tat in self.tat.values() if tat > now),
+            "evicted_keys": self.evicted,
+            "eviction_batch": self.eviction_batch,
+        }
+
+
+class SQLiteBackend:
+    """
+    TATs in a SQLite table shared across processes
+    """
+
+    name = "sqlite"
+    # Calls do file I/O; async callers should run them off the event loop
+    blocking = True
+
+    def __init__(self, path: Optional[str] = None, eviction_every: int = 64, eviction_batch: int = 64,
+                 busy_timeout: float = 2.0):
+        self.path = path or os.environ.get("RATE_LIMIT_DB") or os.path.join(tempfile.gettempdir(), "nepseapi_rate_limit.db")
+        self.eviction_every = eviction_every
+        self.eviction_batch = eviction_batch
+        self.busy_timeout = busy_timeout
+        self._lock = threading.Lock()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._requests = 0
+        self.evicted = 0
+        self.errors = 0
+
+    def _connection(self) -> sqlite3.Connection:
+        # Connections must not cross a fork (uvicorn workers), so open one per process
+        if self._conn is None or self._pid != os.getpid():
+            conn = sqlite3.connect(self.path, timeout=self.busy_timeout, isolation_level=None,
+                                   check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS rate_limit (key TEXT PRIMARY KEY, tat REAL NOT NULL) WITHOUT ROWID")
+            conn.execute("CREATE INDEX IF NOT EXISTS rate_limit_tat ON rate_limit (tat)")
+            self._conn, self._pid = conn, os.getpid()
+        return self._conn
+
+    def acquire(self, key: str, now: float, increment: float, window: float) -> Tuple[bool, float]:
+        with self._lock:
+            try:
+                conn = self._connection()
+                # IMMEDIATE takes the write lock up front, so read-decide-write is atomic across processes
+                conn.execute("BEGIN IMMEDIATE")
+                try:
+                    row = conn.execute("SELECT tat FROM rate_limit WHERE key = ?", (key,)).fetchone()
+                    allowed, tat = gcra_step(row[0] if row else None, now, increment, window)
+                    if allowed:
+                        conn.execute("INSERT INTO rate_limit (key, tat) VALUES (?, ?) "
+                                     "ON CONFLICT(key) DO UPDATE SET tat = excluded.tat", (key, tat))
+                    self._requests += 1
+                    if self._requests % self.eviction_every == 0:
+                        self.evicted += conn.execute(
+                            "DELETE FROM rate_limit WHERE key IN "
+                            "(SELECT key FROM rate_limit WHERE tat <= ? LIMIT ?)", (now, self.eviction_batch)
+                        ).rowcount
+                    conn.execute("COMMIT")
+                except BaseException:
+                    conn.execute("ROLLBACK")
+                    raise
+                return allowed, tat
+            except sqlite3.Error as e:
+                # Fail open: a locked or broken limiter database must not take the API down
+                self.errors += 1
+                logger.warning(f"Rate limit backend error, allowing request: {e}")
+                return True, now
+
+    def refund(self, key: str, now: float, decrement: float):
+        """Give back tokens that were acquired but not used"""
+        with self._lock:
+            try:
+                self._connection().execute(
+                    "UPDATE rate_limit SET tat = MAX(?, tat - ?) WHERE key = ?", (now, decrement, key))
+            except sqlite3.Error as e:
+                self.errors += 1
+                logger.warning(f"Rate limit refund failed: {e}")
+
+    def get_stats(self, now: float) -> Dict:
+        with self._lock:
+            try:
+                conn = self._connection()
+                tracked, active, ips = conn.execute(
+                    "SELECT COUNT(*), COALESCE(SUM(tat > ?), 0), "
+                    "COUNT(DISTINCT substr(key, 1, instr(key, '|') - 1)) FROM rate_limit", (now,)
+                ).fetchone()
+            except sqlite3.Error as e:
+                logger.warning(f"Rate limit backend stats failed: {e}")
+                tracked = active = ips = None
+        return {
+            "backend": self.name,
+            "path": self.path,
+            "total_tracked_ips": ips,
+            "total_tracked_keys": tracked,
+            "active_keys": active,
+            "evicted_keys": self.evicted,
+            "errors": self.errors,
+        }
+
+
+def create_backend(name: Optional[str] = None):
+    """Backend named by RATE_LIMIT_BACKEND (memory or sqlite)"""
+    name = (name or os.environ.get("RATE_LIMIT_BACKEND") or "memory").lower()
+    if name == "sqlite":
+        return SQLiteBackend()
+    if name != "memory":
+        logger.warning(f"Unknown RATE_LIMIT_BACKEND '{name}', using memory")
+    return MemoryBackend()
@@ -3,27 +3,32 @@ Simple Rate Limiter for NEPSE API
 
 Provides in-memory rate limiting based on IP addresses and endpoints.
 Designed to prevent abuse while being simple and lightweight.
+
+Uses GCRA (generic cell rate algorithm): each key stores a single float,
+its theoretical arrival time (TAT). A limit of N requests per window
+allows a burst of N and then one request every window/N seconds.
+The TATs live in a pluggable backend (see rate_limit_backends.py).
 """
 
-import time
 import asyncio
-from collections import defaultdict, deque
-from typing import Dict, Optional, Tuple
-from datetime import datetime, timedelta
+import math
+import os
+import time
+from typing import Dict, Iterable, List, Tuple
 import logging
 
+from rate_limit_backends import create_backend
+
 logger = logging.getLogger(__name__)
 
 class SimpleRateLimiter:
     """
-    Simple in-memory rate limiter using sliding window approach
+    Simple rate limiter using GCRA, one timestamp per key
     """
 
-    def __init__(self):
-        # IP -> endpoint -> deque of timestamps
-        self.requests: Dict[str, Dict[str, deque]] = defaultdict(lambda: defaultdict(deque))
-        # IP -> last cleanup time
-        self.last_cleanup: Dict[str, float] = {}
+    def __init__(self, backend=None):
+        # "ip|category" -> theoretical arrival time, in memory or shared between processes
+        self.backend = backend or create_backend()
 
         # Rate limits (requests per minute)
         self.limits = {
@@ -33,15 +38,72 @@ class SimpleRateLimiter:
             "websocket": 100,       # WebSocket connections: 100 per minute
             "websocket_message": 50, # WebSocket messages: 50 per minute
             "health": 50,          # Health checks: 50 per minute (lowered for testing)
+            "batch": 20,            # /batch: 20 per minute (each call fans out to many lookups)
+            "mcp": 60,              # MCP tool calls: 60 per minute
+        }
+        self._load_env_limits()
+
+        # Exact path -> category, and (prefix, category) for routes with path parameters.
+        # Filled from the app's route table by register_routes().
+        self.route_categories: Dict[str, str] = {
+            "websocket_connection": "websocket",
+            "websocket_message": "websocket_message",
         }
+        self.prefix_categories: List[Tuple[str, str]] = []
+        self.routes_registered = False
 
         # Time window in seconds
         self.window_size = 60  # 1 minute
 
-        # Cleanup interval (to prevent memory leaks)
-        self.cleanup_interval = 300  # 5 minutes
+    def _load_env_limits(self):
+        """Override per-category limits with RATE_LIMIT_<CATEGORY> (requests per window)"""
+        for key, value in os.environ.items():
+            if not key.startswith("RATE_LIMIT_") or key in ("RATE_LIMIT_BACKEND", "RATE_LIMIT_DB"):
+                continue
+            category = key[len("RATE_LIMIT_"):].lower()
+            if category not in self.limits:
+                # A typo (e.g. RATE_LIMIT_MARKETDATA) would otherwise be silently ignored
+                logger.warning(f"Ignoring {key}: unknown category, expected one of {', '.join(self.limits)}")
+                continue
+            try:
+                limit = int(value)
+            except ValueError:
+                logger.warning(f"Ignoring {key}={value!r}: not an integer")
+                continue
+            if limit <= 0:
+                logger.warning(f"Ignoring {key}={value!r}: must be positive")
+                continue
+            self.limits[category] = limit
+
+    def register_routes(self, routes: Iterable):
+        """Precompute the category of every route path (e.g. FastAPI's app.routes)"""
+        prefixes = {}
+        for route in routes:
+            path = getattr(route, "path", None)
+            if not path:
+                continue
+            if "{" in path:
+                prefix = path.split("{", 1)[0]
+                prefixes[prefix] = self._categorize(prefix)
+            else:
+                self.route_categories[path] = self._categorize(path)
+        # Longest prefix wins
+        self.prefix_categories = sorted(prefixes.items(), key=lambda item: len(item[0]), reverse=True)
+        self.routes_registered = True
+        logger.info(f"Rate limiter registered {len(self.route_categories)} paths and {len(self.prefix_categories)} prefixes")
 
     def _get_endpoint_category(self, endpoint: str) -> str:
+        """Category of an endpoint, from the precomputed route table"""
+        category = self.route_categories.get(endpoint)
+        if category is not None:
+            return category
+        for prefix, category in self.prefix_categories:
+            if endpoint.startswith(prefix):
+                return category
+        # Unknown paths (404s, or no route table registered yet)
+        return "default" if self.routes_registered else self._categorize(endpoint)
+
+    def _categorize(self, endpoint: str) -> str:
         """Categorize endpoint to determine rate limit"""
         if endpoint in ["/health"]:
             return "health"
@@ -53,34 +115,13 @@ class SimpleRateLimiter:
             return "websocket"
         elif endpoint == "websocket_message":
             return "websocket_message"
+        elif endpoint == "/batch":
+            return "batch"
+        elif endpoint.startswith("mcp_tool"):
+            return "mcp"
         else:
             return "default"
 
-    def _cleanup_old_requests(self, ip: str, endpoint: str, current_time: float):
-        """Remove requests older than the window"""
-        cutoff_time = current_time - self.window_size
-
-        request_times = self.requests[ip][endpoint]
-        while request_times and request_times[0] < cutoff_time:
-            request_times.popleft()
-
-    def _cleanup_old_ips(self):
-        """Cleanup IPs that haven't been seen for a while"""
-        current_time = time.time()
-        cutoff_time = current_time - self.cleanup_interval
-
-        ips_to_remove = []
-        for ip, last_seen in self.last_cleanup.items():
-            if last_seen < cutoff_time:
-                ips_to_remove.append(ip)
-
-        for ip in ips_to_remove:
-            if ip in self.requests:
-                del self.requests[ip]
-            if ip in self.last_cleanup:
-                del self.last_cleanup[ip]
-            logger.debug(f"Cleaned up rate limit data for IP: {ip}")
-
     def is_allowed(self, ip: str, endpoint: str) -> Tuple[bool, Dict]:
         """
         Check if request is allowed
@@ -88,61 +129,143 @@ class SimpleRateLimiter:
         """
         current_time = time.time()
         category = self._get_endpoint_category(endpoint)
-        limit = self.limits[category]
-
-        # Cleanup old requests for this IP/endpoint
-        self._cleanup_old_requests(ip, endpoint, current_time)
+        limit = self.limits.get(category, self.limits["default"])
+        emission_interval = self.window_size / limit
 
-        # Update last seen time
-        self.last_cleanup[ip] = current_time
+        # One bucket per client and category, so /CompanyDetails?symbol=A and =B share a limit
+        key = f"{ip}|{category}"
+        allowed, tat = self.backend.acquire(key, current_time, emission_interval, self.window_size)
 
-        # Periodic cleanup
-        if len(self.last_cleanup) > 1000:  # Arbitrary threshold
-            self._cleanup_old_ips()
+        info = self._info(limit, emission_interval, tat, allowed, current_time, category)
+        if not allowed:
+            logger.warning(f"Rate limit exceeded for IP {ip} on endpoint {endpoint} ({category}): limit {limit}")
+        return allowed, info
 
-        # Check current request count
-        request_times = self.requests[ip][endpoint]
-        current_count = len(request_times)
+    async def is_allowed_async(self, ip: str, endpoint: str) -> Tuple[bool, Dict]:
+        """is_allowed that keeps blocking backends off the event loop"""
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.is_allowed, ip, endpoint)
+        return self.is_allowed(ip, endpoint)
 
-        # Rate limit info
-        info = {
+    def _info(self, limit: int, emission_interval: float, tat: float, allowed: bool,
+              current_time: float, category: str) -> Dict:
+        backlog = tat - current_time
+        return {
             "limit": limit,
-            "remaining": max(0, limit - current_count),
-            "reset_time": int(current_time + self.window_size),
+            "remaining": max(0, int((self.window_size - backlog + 1e-9) / emission_interval)),
+            # When the full burst is available again
+            "reset_time": int(math.ceil(tat)),
+            # Seconds until the next request would be admitted
+            "retry_after": 0 if allowed else max(1, int(math.ceil(tat + emission_interval - self.window_size - current_time))),
             "category": category
         }
 
-        if current_count >= limit:
-            logger.warning(f"Rate limit exceeded for IP {ip} on endpoint {endpoint}: {current_count}/{limit}")
-            return False, info
+    def acquire_many(self, ip: str, endpoint: str, count: int) -> Tuple[int, Dict]:
+        """
+        Take up to `count` requests' worth of tokens in one backend round trip
+        (two if only part of the batch is available).
+        Returns: (tokens_granted, info_dict)
+        """
+        current_time = time.time()
+        category = self._get_endpoint_category(endpoint)
+        limit = self.limits.get(category, self.limits["default"])
+        emission_interval = self.window_size / limit
+        key = f"{ip}|{category}"
+
+        allowed, tat = self.backend.acquire(key, current_time, count * emission_interval, self.window_size)
+        granted = count if allowed else 0
+        if not allowed:
+            # Take whatever part of the batch still fits in the window
+            available = int((self.window_size - (max(tat, current_time) - current_time) + 1e-9) / emission_interval)
+            if available > 0:
+                allowed, tat = self.backend.acquire(key, current_time, available * emission_interval, self.window_size)
+                granted = available if allowed else 0
 
-        # Add current request
-        request_times.append(current_time)
-        info["remaining"] = max(0, limit - len(request_times))
+        info = self._info(limit, emission_interval, tat, granted > 0, current_time, category)
+        if not granted:
+            logger.warning(f"Rate limit exceeded for IP {ip} on endpoint {endpoint} ({category}): limit {limit}")
+        return granted, info
 
-        return True, info
+    def refund(self, ip: str, endpoint: str, count: int):
+        """Return `count` unused tokens taken with acquire_many"""
+        if count <= 0:
+            return
+        category = self._get_endpoint_category(endpoint)
+        emission_interval = self.window_size / self.limits.get(category, self.limits["default"])
+        self.backend.refund(f"{ip}|{category}", time.time(), count * emission_interval)
 
-    def get_stats(self) -> Dict:
-        """Get rate limiter statistics"""
-        current_time = time.time()
-        total_ips = len(self.requests)
-        total_endpoints = sum(len(endpoints) for endpoints in self.requests.values())
+    async def acquire_many_async(self, ip: str, endpoint: str, count: int) -> Tuple[int, Dict]:
+        """acquire_many that keeps blocking backends off the event loop"""
+        if self.backend.blocking:
+            return await asyncio.to_thread(self.acquire_many, ip, endpoint, count)
+        return self.acquire_many(ip, endpoint, count)
 
-        # Count active requests (within window)
-        active_requests = 0
-        for ip_requests in self.requests.values():
-            for request_times in ip_requests.values():
-                active_requests += sum(1 for t in request_times if current_time - t < self.window_size)
+    async def refund_async(self, ip: str, endpoint: str, count: int):
+        if self.backend.blocking:
+            await asyncio.to_thread(self.refund, ip, endpoint, count)
+        else:
+            self.refund(ip, endpoint, count)
 
+    def get_stats(self) -> Dict:
+        """Get rate limiter statistics"""
         return {
-            "total_tracked_ips": total_ips,
-            "total_tracked_endpoints": total_endpoints,
-            "active_requests_in_window": active_requests,
+            **self.backend.get_stats(time.time()),
+            "algorithm": "gcra",
             "window_size_seconds": self.window_size,
             "limits": self.limits,
-            "cleanup_interval": self.cleanup_interval
         }
 
+class TokenLease:
+    """
+    Tokens leased in batches from the global limiter for one connection.
+    The per-message check is a local counter decrement; the global limiter
+    (and its backend) is only consulted once per batch.
+    """
+
+    # Share of the category limit leased per batch
+    lease_fraction = 0.1
+
+    def __init__(self, limiter: "SimpleRateLimiter", ip: str, endpoint: str, batch: int = 0):
+        self.limiter = limiter
+        self.ip = ip
+        self.endpoint = endpoint
+        category = limiter._get_endpoint_category(endpoint)
+        limit = limiter.limits.get(category, limiter.limits["default"])
+        self.batch = batch or max(1, int(limit * self.lease_fraction))
+        self.tokens = 0
+        self._info: Dict = {"limit": limit, "remaining": limit, "reset_time": int(time.time()),
+                            "retry_after": 0, "category": category}
+        self.leases = 0
+
+    def try_acquire(self) -> bool:
+        """Fast path: spend a leased token, no I/O and no await"""
+        if self.tokens > 0:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def refill(self) -> bool:
+        """Lease a new batch from the global limiter and spend one token of it"""
+        # Start with one token and double per lease, so many short-lived connections
+        # from one client don't each hoard a full batch of the shared limit
+        count = min(self.batch, 1 << min(self.leases, 16))
+        granted, self._info = await self.limiter.acquire_many_async(self.ip, self.endpoint, count)
+        self.leases += 1
+        if granted <= 0:
+            return False
+        self.tokens = granted - 1
+        return True
+
+    @property
+    def info(self) -> Dict:
+        """Latest global info; tokens still leased to this connection count as remaining"""
+        return {**self._info, "remaining": self._info["remaining"] + self.tokens}
+
+    async def release(self):
+        """Hand unused tokens back, e.g. when the connection closes"""
+        tokens, self.tokens = self.tokens, 0
+        await self.limiter.refund_async(self.ip, self.endpoint, tokens)
+
 # Global rate limiter instance
 rate_limiter = SimpleRateLimiter()
 
@@ -151,6 +274,10 @@ def check_rate_limit(ip: str, endpoint: str) -> Tuple[bool, Dict]:
     """Check rate limit for HTTP requests"""
     return rate_limiter.is_allowed(ip, endpoint)
 
+async def check_rate_limit_async(ip: str, endpoint: str) -> Tuple[bool, Dict]:
+    """Check rate limit from async code (middlewares); SQLite calls run in a worker thread"""
+    return await rate_limiter.is_allowed_async(ip, endpoint)
+
 def check_websocket_rate_limit(ip: str) -> Tuple[bool, Dict]:
     """Check rate limit for WebSocket connections"""
     return rate_limiter.is_allowed(ip, "websocket_connection")
@@ -168,5 +295,5 @@ def get_rate_limit_headers(info: Dict) -> Dict[str, str]:
 class RateLimitExceeded(Exception):
     def __init__(self, info: Dict):
         self.info = info
-        retry_after = info["reset_time"] - int(time.time())
+        retry_after = info.get("retry_after", info["reset_time"] - int(time.time()))
         super().__init__(f"Rate limit exceeded. Try again in {retry_after} seconds.")
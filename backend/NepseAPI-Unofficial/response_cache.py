@@ -0,0 +1,219 @@
+"""
+Upstream Response Cache for NEPSE API
+
+Async in-memory cache sitting between the API handlers and AsyncNepse.
+Entries are keyed by route + params and expire according to the market
+state: a few seconds while NEPSE is open, hours for static lists, and
+until the next session once the market has closed. Concurrent misses for
+the same key are coalesced into a single upstream call.
+"""
+
+import asyncio
+import time
+import logging
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from market_hours import is_open_status, seconds_until_next_session
+from single_flight import SingleFlight
+from payloads import Payload
+
+logger = logging.getLogger(__name__)
+
+MARKET_STATUS_ROUTE = "IsNepseOpen"
+
+
+class TTLPolicy:
+    """
+    Decides how long a route's response stays fresh given the market state
+    """
+
+    # Lists that only change when securities are listed/delisted
+    static_ttls = {
+        "CompanyList": 6 * 3600,
+        "SecurityList": 6 * 3600,
+        "SectorScrips": 6 * 3600,
+    }
+
+    # TTLs (seconds) while the market is open
+    open_ttls = {
+        "IsNepseOpen": 30,
+        "LiveMarket": 5,
+        "MarketDepth": 3,
+        "PriceVolume": 10,
+        "Summary": 10,
+        "SupplyDemand": 10,
+        "NepseIndex": 10,
+        "NepseSubIndices": 10,
+        "TopGainers": 15,
+        "TopLosers": 15,
+        "TopTenTradeScrips": 15,
+        "TopTenTurnoverScrips": 15,
+        "TopTenTransactionScrips": 15,
+        "TradeTurnoverTransactionSubindices": 15,
+        "Floorsheet": 60,
+        "FloorsheetOf": 30,
+        "CompanyDetails": 60,
+        "PriceVolumeHistory": 300,
+    }
+
+    default_open_ttl = 30    # Index graphs and anything not listed above
+    market_status_ttl = 30   # IsNepseOpen is always re-checked frequently
+    min_closed_ttl = 60      # Floor for "until next session" when closed
+
+    def ttl_for(self, route: str, market_open: bool) -> float:
+        """Return the TTL in seconds for a route"""
+        if route == MARKET_STATUS_ROUTE:
+            return self.market_status_ttl
+        if route in self.static_ttls:
+            return self.static_ttls[route]
+        if market_open:
+            return self.open_ttls.get(route, self.default_open_ttl)
+        return max(self.min_closed_ttl, seconds_until_next_session())
+
+
+@dataclass
+class CacheEntry:
+    payload: Payload
+    expires_at: float
+    stored_at: float
+
+
+class ResponseCache:
+    """
+    Route + params keyed async cache with market-hours-aware expiry
+    """
+
+    def __init__(self, market_status_fetcher: Callable[[], Awaitable[Any]],
+                 policy: Optional[TTLPolicy] = None, max_entries: int = 2048,
+                 single_flight: Optional[SingleFlight] = None,
+                 prepare: Optional[Dict[str, Callable[[Payload], Any]]] = None):
+        self._market_status_fetcher = market_status_fetcher
+        self.single_flight = single_flight or SingleFlight()
+        self.policy = policy or TTLPolicy()
+        self.max_entries = max_entries
+        self._entries: Dict[Tuple[str, Hashable], CacheEntry] = {}
+        # Route -> work done once on each newly fetched payload, in a worker thread
+        # (e.g. building a derived index), so requests served from the cache never do it
+        self.prepare = prepare or {}
+
+        # Counters
+        self.hits = 0
+        self.misses = 0
+        self.errors = 0
+        self.route_stats: Dict[str, Dict[str, int]] = {}
+
+    @staticmethod
+    def make_key(route: str, params: Any = None) -> Tuple[str, Hashable]:
+        """Build a hashable cache key from a route name and its params"""
+        if not params:
+            return route, ()
+        if isinstance(params, dict):
+            return route, tuple(sorted(params.items()))
+        return route, tuple(params)
+
+    def _record(self, route: str, outcome: str):
+        stats = self.route_stats.setdefault(route, {"hits": 0, "misses": 0, "errors": 0})
+        stats[outcome] += 1
+
+    def _lookup(self, key: Tuple[str, Hashable], now: float) -> Optional[CacheEntry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at <= now:
+            del self._entries[key]
+            return None
+        return entry
+
+    def _evict(self, now: float):
+        """Drop expired entries, then the oldest ones, until under max_entries"""
+        if len(self._entries) < self.max_entries:
+            return
+        for key in [k for k, e in self._entries.items() if e.expires_at <= now]:
+            del self._entries[key]
+        while len(self._entries) >= self.max_entries:
+            # dicts preserve insertion order, so the first key is the oldest
+            del self._entries[next(iter(self._entries))]
+
+    async def is_market_open(self) -> bool:
+        """Market state, itself served through the cache"""
+        try:
+            status = await self.get_or_fetch(MARKET_STATUS_ROUTE, None, self._market_status_fetcher)
+        except Exception as e:
+            # Short TTLs are the safe choice when we can't tell
+            logger.warning(f"Could not determine market status: {e}")
+            return True
+        return is_open_status(status)
+
+    async def get_or_fetch(self, route: str, params: Any, fetcher: Callable[[], Awaitable[Any]]) -> Any:
+        """Return a cached response or call `fetcher` and cache its result"""
+        payload = await self.get_or_fetch_payload(route, params, fetcher)
+        return payload.data
+
+    async def get_or_fetch_payload(self, route: str, params: Any, fetcher: Callable[[], Awaitable[Any]]) -> Payload:
+        """Like get_or_fetch, but returns the Payload so its encoded body is reused"""
+        key = self.make_key(route, params)
+        entry = self._lookup(key, time.time())
+        if entry is not None:
+            self.hits += 1
+            self._record(route, "hits")
+            return entry.payload
+
+        self.misses += 1
+        self._record(route, "misses")
+
+        async def fetch_payload() -> Payload:
+            payload = Payload(await fetcher())
+            prepare = self.prepare.get(route)
+            if prepare is not None:
+                try:
+                    await asyncio.to_thread(prepare, payload)
+                except Exception as e:
+                    # The payload is still good to serve; whoever needs the derived data retries
+                    logger.warning(f"Could not prepare {route} payload: {e}")
+            return payload
+
+        try:
+            payload = await self.single_flight.do(key, fetch_payload)
+        except Exception:
+            self.errors += 1
+            self._record(route, "errors")
+            raise
+
+        market_open = True if route == MARKET_STATUS_ROUTE else await self.is_market_open()
+        now = time.time()
+        self._evict(now)
+        # Concurrent callers may have stored this key already; reuse its payload
+        entry = self._lookup(key, now)
+        if entry is not None and entry.payload is payload:
+            return payload
+        self._entries[key] = CacheEntry(
+            payload=payload,
+            expires_at=now + self.policy.ttl_for(route, market_open),
+            stored_at=now,
+        )
+        return payload
+
+    def invalidate(self, route: Optional[str] = None):
+        """Drop every entry, or only the entries of one route"""
+        if route is None:
+            self._entries.clear()
+            return
+        for key in [k for k in self._entries if k[0] == route]:
+            del self._entries[key]
+
+    def get_stats(self) -> Dict:
+        """Get cache statistics"""
+        now = time.time()
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "live_entries": sum(1 for e in self._entries.values() if e.expires_at > now),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "errors": self.errors,
+            "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+            "routes": self.route_stats,
+            "single_flight": self.single_flight.get_stats(),
+        }
@@ -1,47 +1,85 @@
 from fastapi import FastAPI, HTTPException, Response, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from nepse import AsyncNepse
+from contextlib import asynccontextmanager
+from pydantic import BaseModel
+import asyncio
 import logging
-import time
+import math
+import os
+from typing import Dict, List, Optional, Union
 
 # Import validation utilities
 from validator import validate_stock_symbol, validate_index_name, validator
 
 # Import rate limiting
-from rate_limiter import check_rate_limit, get_rate_limit_headers, rate_limiter
-
-app = FastAPI()
-
-# Rate limiting middleware
-@app.middleware("http")
-async def rate_limit_middleware(request: Request, call_next):
-    # Get client IP
+from rate_limiter import check_rate_limit_async, get_rate_limit_headers, rate_limiter
+
+# Import upstream response cache
+from response_cache import ResponseCache
+from fan_out import gather_upstream, UpstreamUnavailable
+from market_aggregation import build_market_summary
+from payloads import Payload, etag_matches, negotiate_encoding
+from list_query import MAX_LIMIT, ListIndex, decode_cursor, encode_cursor, parse_list_query, run_list_query
+from floorsheet_stream import stream_floorsheet_ndjson
+from floorsheet_archive import ArchiveJob, ArchivedDay, FloorsheetArchive, archive_enabled
+from broker_analytics import analyze, merge_days
+
+# Import background snapshot poller
+from market_snapshots import MarketPoller, poller_enabled
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    rate_limiter.register_routes(app.routes)
+    if poller_enabled():
+        market_poller.start()
+    if archive_enabled():
+        archive_job.start()
+    validator.start_watching()
+    yield
+    await market_poller.stop()
+    await archive_job.stop()
+    validator.stop_watching()
+
+app = FastAPI(lifespan=lifespan)
+
+def client_ip_of(request: Request) -> str:
     client_ip = request.client.host
     if hasattr(request, 'headers'):
         # Check for forwarded IP (useful when behind proxy)
         forwarded_for = request.headers.get('X-Forwarded-For')
         if forwarded_for:
             client_ip = forwarded_for.split(',')[0].strip()
+    return client_ip
+
+def rate_limit_response(info: Dict) -> JSONResponse:
+    headers = get_rate_limit_headers(info)
+    retry_after = info["retry_after"]
+    headers["Retry-After"] = str(retry_after)
+
+    return JSONResponse(
+        status_code=429,
+        content={
+            "error": "Rate limit exceeded",
+            "message": f"Too many requests. Try again in {retry_after} seconds.",
+            "limit": info["limit"],
+            "reset_time": info["reset_time"]
+        },
+        headers=headers
+    )
+
+# Rate limiting middleware
+@app.middleware("http")
+async def rate_limit_middleware(request: Request, call_next):
+    # Get client IP
+    client_ip = client_ip_of(request)
 
     # Check rate limit
     endpoint = request.url.path
-    allowed, info = check_rate_limit(client_ip, endpoint)
+    allowed, info = await check_rate_limit_async(client_ip, endpoint)
 
     if not allowed:
-        headers = get_rate_limit_headers(info)
-        retry_after = info["reset_time"] - int(time.time())
-        headers["Retry-After"] = str(retry_after)
-
-        return JSONResponse(
-            status_code=429,
-            content={
-                "error": "Rate limit exceeded",
-                "message": f"Too many requests. Try again in {retry_after} seconds.",
-                "limit": info["limit"],
-                "reset_time": info["reset_time"]
-            },
-            headers=headers
-        )
+        return rate_limit_response(info)
 
     # Process request
     response = await call_next(request)
@@ -83,6 +121,104 @@ logger = logging.getLogger(__name__)
 nepseAsync = AsyncNepse()
 nepseAsync.setTLSVerification(False)
 
+def floorsheet_columns(payload: Payload) -> ArchivedDay:
+    """Today's cached floorsheet as archive columns, built once per payload"""
+    return payload.derived("floorsheet_columns", ArchivedDay.from_rows)
+
+# Shared upstream cache, TTLs follow the market state reported by isNepseOpen.
+# A fresh floorsheet is turned into columns as it is cached, for BrokerFlow?date=live
+response_cache = ResponseCache(
+    market_status_fetcher=nepseAsync.isNepseOpen,
+    prepare={"Floorsheet": floorsheet_columns},
+)
+
+async def cached_payload(route: str, fetcher, *args) -> Payload:
+    """Serve an upstream call through the response cache, keyed by route + args"""
+    return await response_cache.get_or_fetch_payload(route, args, lambda: fetcher(*args))
+
+async def cached(route: str, fetcher, *args):
+    return (await cached_payload(route, fetcher, *args)).data
+
+# Hot endpoints are polled in the background while the market is open
+market_poller = MarketPoller(
+    fetchers={
+        "LiveMarket": nepseAsync.getLiveMarket,
+        "PriceVolume": nepseAsync.getPriceVolume,
+        "Summary": lambda: _get_summary(),
+        "NepseIndex": lambda: _get_nepse_index(),
+        "NepseSubIndices": lambda: _get_nepse_subindices(),
+        "SupplyDemand": nepseAsync.getSupplyDemand,
+    },
+    market_status_fetcher=lambda: cached("IsNepseOpen", nepseAsync.isNepseOpen),
+)
+
+# Each session's floorsheet is archived to disk after the close
+floorsheet_archive = FloorsheetArchive()
+archive_job = ArchiveJob(floorsheet_archive, nepseAsync)
+
+async def hot_payload(route: str, fetcher) -> Payload:
+    """Serve a polled endpoint from its latest snapshot, falling back to the cache"""
+    snapshot = market_poller.latest(route)
+    if snapshot is not None:
+        return snapshot.payload
+    return await cached_payload(route, fetcher)
+
+async def hot(route: str, fetcher):
+    return (await hot_payload(route, fetcher)).data
+
+def payload_response(request: Request, payload: Payload) -> Response:
+    """
+    Send a pre-encoded body with a strong ETag, or 304 if the client already has it.
+    Compressed variants are negotiated from Accept-Encoding and built once per payload.
+    """
+    encoding = negotiate_encoding(request.headers.get("accept-encoding"), len(payload.body))
+    etag = payload.etag_for(encoding)
+    headers = {**HEADERS, "ETag": etag, "Vary": "Accept-Encoding"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    if encoding != "identity":
+        headers["Content-Encoding"] = encoding
+    return Response(content=payload.encoded(encoding), media_type="application/json", headers=headers)
+
+# Field holding the scrip symbol in each list endpoint's rows
+LIST_SYMBOL_KEYS = {
+    "LiveMarket": "symbol",
+    "PriceVolume": "symbol",
+    "Floorsheet": "stockSymbol",
+    "SecurityList": "symbol",
+}
+
+def sector_of(symbol: str):
+    info = validator.get_stock_info(symbol)
+    return info.get("sector") if info else None
+
+def list_response(request: Request, route: str, payload: Payload, limit=None, cursor=None,
+                  symbols=None, sector=None, sort=None, fields=None) -> Response:
+    """
+    Apply limit/cursor/symbols/sector/sort/fields to a list payload.
+    Without query parameters the pre-encoded payload is served untouched.
+    """
+    try:
+        query = parse_list_query(limit, cursor, symbols, sector, sort, fields)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if query.is_empty or not isinstance(payload.data, list):
+        return payload_response(request, payload)
+
+    # The index is built once per cached payload and shared by every query against it
+    index = payload.derived("list_index", lambda rows: ListIndex(rows, LIST_SYMBOL_KEYS[route], sector_of))
+    try:
+        rows, total, next_cursor = run_list_query(index, query)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    response = payload_response(request, Payload(rows))
+    response.headers["X-Total-Count"] = str(total)
+    response.headers["Access-Control-Expose-Headers"] = "X-Total-Count, X-Next-Cursor"
+    if next_cursor:
+        response.headers["X-Next-Cursor"] = next_cursor
+    return response
+
 routes = {
     "Health": "/health",
     "Docs": "/docs",
@@ -104,6 +240,8 @@ routes = {
     "CompanyDetails": "/CompanyDetails",
     "Floorsheet": "/Floorsheet",
     "FloorsheetOf": "/FloorsheetOf",
+    "BrokerFlow": "/BrokerFlow",
+    "FloorsheetStream": "/FloorsheetStream",
     "PriceVolumeHistory": "/PriceVolumeHistory",
     "SecurityList": "/SecurityList",
     "TradeTurnoverTransactionSubindices": "/TradeTurnoverTransactionSubindices",
@@ -142,6 +280,98 @@ async def get_rate_limit_stats():
     stats = rate_limiter.get_stats()
     return JSONResponse(content=stats, headers=HEADERS)
 
+@app.get("/cache/stats")
+async def get_cache_stats():
+    """Get upstream response cache statistics"""
+    stats = response_cache.get_stats()
+    return JSONResponse(content=stats, headers={"Access-Control-Allow-Origin": "*"})
+
+@app.get("/snapshots/stats")
+async def get_snapshot_stats():
+    """Get background snapshot poller statistics"""
+    stats = market_poller.get_stats()
+    return JSONResponse(content=stats, headers={"Access-Control-Allow-Origin": "*"})
+
+@app.get("/FloorsheetArchive")
+async def get_floorsheet_archive():
+    """Archived business dates and archive job state"""
+    content = {"dates": floorsheet_archive.dates(), **archive_job.get_stats()}
+    return JSONResponse(content=content, headers={"Access-Control-Allow-Origin": "*"})
+
+@app.get("/FloorsheetArchive/{business_date}")
+async def get_archived_floorsheet(request: Request, business_date: str, symbol: Optional[str] = None,
+                                  buyer: Optional[str] = None, seller: Optional[str] = None,
+                                  limit: int = 500, cursor: Optional[str] = None):
+    """Historical floorsheet rows for one business date, filtered and paged like the list endpoints"""
+    if not 1 <= limit <= MAX_LIMIT:
+        raise HTTPException(status_code=400, detail=f"limit must be between 1 and {MAX_LIMIT}")
+
+    def read(offset: int):
+        # Opening the memory-mapped columns and filtering them is file I/O, kept off the event loop
+        day = floorsheet_archive.day(business_date)
+        if day is None:
+            return None, 0
+        positions = day.select(symbol, buyer, seller)
+        return day.rows(positions[offset:offset + limit]), len(positions)
+
+    try:
+        offset = decode_cursor(cursor) if cursor else 0
+        rows, total = await asyncio.to_thread(read, offset)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if rows is None:
+        raise HTTPException(status_code=404, detail=f"No archived floorsheet for {business_date}")
+
+    end = min(total, offset + limit)
+    response = payload_response(request, Payload(rows))
+    response.headers["X-Total-Count"] = str(total)
+    response.headers["Access-Control-Expose-Headers"] = "X-Total-Count, X-Next-Cursor"
+    if end < total:
+        response.headers["X-Next-Cursor"] = encode_cursor(end)
+    return response
+
+@app.get(routes["BrokerFlow"])
+async def get_broker_flow(request: Request, date: Optional[str] = None, start: Optional[str] = None,
+                          end: Optional[str] = None, symbol: Optional[str] = None,
+                          broker: Optional[str] = None, top: int = 10):
+    """
+    Broker net positions, VWAPs, trade-size distribution and top accumulating brokers.
+    Reads archived days (`date`, or a `start`/`end` range; the latest day by default),
+    or today's cached floorsheet with date=live.
+    """
+    validated_symbol = validate_stock_or_raise(symbol) if symbol else None
+    if not 1 <= top <= 100:
+        raise HTTPException(status_code=400, detail="top must be between 1 and 100")
+
+    def load_archived_days():
+        # Opens and memory-maps every day in the range, so it runs in a worker thread
+        if date:
+            days = [floorsheet_archive.day(date)]
+        elif start or end:
+            days = floorsheet_archive.days(start, end)
+        else:
+            dates = floorsheet_archive.dates()
+            days = [floorsheet_archive.day(dates[-1])] if dates else []
+        return [day for day in days if day is not None]
+
+    if date == "live":
+        payload = await cached_payload("Floorsheet", nepseAsync.getFloorSheet)
+        # Already built when the payload was cached; a worker thread keeps any rebuild off the loop
+        days = [await asyncio.to_thread(floorsheet_columns, payload)]
+    else:
+        try:
+            days = await asyncio.to_thread(load_archived_days)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        if not days:
+            raise HTTPException(status_code=404, detail="No archived floorsheet for the requested dates")
+
+    def run():
+        return analyze(merge_days(days, validated_symbol), validated_symbol, broker, top)
+
+    report = await asyncio.to_thread(run)
+    return payload_response(request, Payload(report))
+
 @app.get("/validate/stock/{symbol}")
 async def validate_stock(symbol: str):
     """Validate a stock symbol and return validation result"""
@@ -174,6 +404,12 @@ async def get_validation_stats():
     stats = validator.get_stats()
     return JSONResponse(content=stats, headers=HEADERS)
 
+@app.post("/validation/reload")
+async def reload_validation(force: bool = False):
+    """Reload stockmap.json if it changed (or always, with force=true) and swap in the new index"""
+    reloaded = await asyncio.to_thread(validator.reload, force)
+    return JSONResponse(content={"reloaded": reloaded, "index": validator.get_stats()["index"]}, headers=HEADERS)
+
 @app.get("/")
 async def get_index():
     content = "<ul>" + "".join([f"<li><a href={value}>{key}</a></li>" for key, value in routes.items()]) + "</ul>"
@@ -181,9 +417,9 @@ async def get_index():
     return Response(content=html_content, media_type="text/html")
 
 @app.get(routes["Summary"])
-async def get_summary():
-    data = await _get_summary()
-    return JSONResponse(content= data, headers=HEADERS)
+async def get_summary(request: Request):
+    payload = await hot_payload("Summary", _get_summary)
+    return payload_response(request, payload)
 
 
 async def _get_summary():
@@ -193,8 +429,9 @@ async def _get_summary():
     return response
 
 @app.get(routes["NepseIndex"])
-async def get_nepse_index():
-    return JSONResponse(content= await _get_nepse_index(), headers=HEADERS)
+async def get_nepse_index(request: Request):
+    payload = await hot_payload("NepseIndex", _get_nepse_index)
+    return payload_response(request, payload)
 
 
 async def _get_nepse_index():
@@ -204,22 +441,24 @@ async def _get_nepse_index():
     return response
 
 @app.get(routes["LiveMarket"])
-async def get_live_market():
-    data = await nepseAsync.getLiveMarket()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_live_market(request: Request, limit: Optional[int] = None, cursor: Optional[str] = None,
+                          symbols: Optional[str] = None, sector: Optional[str] = None,
+                          sort: Optional[str] = None, fields: Optional[str] = None):
+    payload = await hot_payload("LiveMarket", nepseAsync.getLiveMarket)
+    return list_response(request, "LiveMarket", payload, limit, cursor, symbols, sector, sort, fields)
 
 
 #Bugged, hoping for fix from the library
 @app.get(routes["MarketDepth"])
-async def get_market_depth(symbol: str):
+async def get_market_depth(request: Request, symbol: str):
     validated_symbol = validate_stock_or_raise(symbol)
-    data = await nepseAsync.getSymbolMarketDepth(validated_symbol)
-    return JSONResponse(content=data, headers=HEADERS)
+    payload = await cached_payload("MarketDepth", nepseAsync.getSymbolMarketDepth, validated_symbol)
+    return payload_response(request, payload)
 
 @app.get(routes["NepseSubIndices"])
-async def get_nepse_subindices():
-    data = await _get_nepse_subindices()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_nepse_subindices(request: Request):
+    payload = await hot_payload("NepseSubIndices", _get_nepse_subindices)
+    return payload_response(request, payload)
 
 async def _get_nepse_subindices():
     response = dict()
@@ -228,283 +467,328 @@ async def _get_nepse_subindices():
     return response
 
 @app.get(routes["TopTenTradeScrips"])
-async def get_top_ten_trade_scrips():
-    data = await nepseAsync.getTopTenTradeScrips()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_top_ten_trade_scrips(request: Request):
+    payload = await cached_payload("TopTenTradeScrips", nepseAsync.getTopTenTradeScrips)
+    return payload_response(request, payload)
 
 
 @app.get(routes["TopTenTransactionScrips"])
-async def get_top_ten_transaction_scrips():
-    data = await nepseAsync.getTopTenTransactionScrips()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_top_ten_transaction_scrips(request: Request):
+    payload = await cached_payload("TopTenTransactionScrips", nepseAsync.getTopTenTransactionScrips)
+    return payload_response(request, payload)
 
 
 @app.get(routes["TopTenTurnoverScrips"])
-async def get_top_ten_turnover_scrips():
-    data = await nepseAsync.getTopTenTurnoverScrips()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_top_ten_turnover_scrips(request: Request):
+    payload = await cached_payload("TopTenTurnoverScrips", nepseAsync.getTopTenTurnoverScrips)
+    return payload_response(request, payload)
 
 
 @app.get(routes["SupplyDemand"])
-async def get_supply_demand():
-    data = await nepseAsync.getSupplyDemand()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_supply_demand(request: Request):
+    payload = await hot_payload("SupplyDemand", nepseAsync.getSupplyDemand)
+    return payload_response(request, payload)
 
 
 @app.get(routes["TopGainers"])
-async def get_top_gainers():
-    data = await nepseAsync.getTopGainers()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_top_gainers(request: Request):
+    payload = await cached_payload("TopGainers", nepseAsync.getTopGainers)
+    return payload_response(request, payload)
 
 
 @app.get(routes["TopLosers"])
-async def get_top_losers():
-    data = await nepseAsync.getTopLosers()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_top_losers(request: Request):
+    payload = await cached_payload("TopLosers", nepseAsync.getTopLosers)
+    return payload_response(request, payload)
 
 
 @app.get(routes["IsNepseOpen"])
-async def is_nepse_open():
+async def is_nepse_open(request: Request):
     logger.info("IsNepseOpen endpoint called")
-    data = await nepseAsync.isNepseOpen()
-    return JSONResponse(content=data, headers=HEADERS)
+    payload = await cached_payload("IsNepseOpen", nepseAsync.isNepseOpen)
+    return payload_response(request, payload)
 
 
 @app.get(routes["DailyNepseIndexGraph"])
-async def get_daily_nepse_index_graph():
-    data = await nepseAsync.getDailyNepseIndexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_nepse_index_graph(request: Request):
+    payload = await cached_payload("DailyNepseIndexGraph", nepseAsync.getDailyNepseIndexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailySensitiveIndexGraph"])
-async def get_daily_sensitive_index_graph():
-    data = await nepseAsync.getDailySensitiveIndexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_sensitive_index_graph(request: Request):
+    payload = await cached_payload("DailySensitiveIndexGraph", nepseAsync.getDailySensitiveIndexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyFloatIndexGraph"])
-async def get_daily_float_index_graph():
-    data = await nepseAsync.getDailyFloatIndexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_float_index_graph(request: Request):
+    payload = await cached_payload("DailyFloatIndexGraph", nepseAsync.getDailyFloatIndexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailySensitiveFloatIndexGraph"])
-async def get_daily_sensitive_float_index_graph():
-    data = await nepseAsync.getDailySensitiveFloatIndexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_sensitive_float_index_graph(request: Request):
+    payload = await cached_payload("DailySensitiveFloatIndexGraph", nepseAsync.getDailySensitiveFloatIndexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyBankSubindexGraph"])
-async def get_daily_bank_subindex_graph():
-    data = await nepseAsync.getDailyBankSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_bank_subindex_graph(request: Request):
+    payload = await cached_payload("DailyBankSubindexGraph", nepseAsync.getDailyBankSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyDevelopmentBankSubindexGraph"])
-async def get_daily_development_bank_subindex_graph():
-    data = await nepseAsync.getDailyDevelopmentBankSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_development_bank_subindex_graph(request: Request):
+    payload = await cached_payload("DailyDevelopmentBankSubindexGraph", nepseAsync.getDailyDevelopmentBankSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyFinanceSubindexGraph"])
-async def get_daily_finance_subindex_graph():
-    data = await nepseAsync.getDailyFinanceSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_finance_subindex_graph(request: Request):
+    payload = await cached_payload("DailyFinanceSubindexGraph", nepseAsync.getDailyFinanceSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyHotelTourismSubindexGraph"])
-async def get_daily_hotel_tourism_subindex_graph():
-    data = await nepseAsync.getDailyHotelTourismSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_hotel_tourism_subindex_graph(request: Request):
+    payload = await cached_payload("DailyHotelTourismSubindexGraph", nepseAsync.getDailyHotelTourismSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyHydroPowerSubindexGraph"])
-async def get_daily_hydro_power_subindex_graph():
-    data = await nepseAsync.getDailyHydroSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_hydro_power_subindex_graph(request: Request):
+    payload = await cached_payload("DailyHydroPowerSubindexGraph", nepseAsync.getDailyHydroSubindexGraph)
+    return payload_response(request, payload)
 
 
 @app.get(routes["DailyInvestmentSubindexGraph"])
-async def get_daily_investment_subindex_graph():
-    data = await nepseAsync.getDailyInvestmentSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_investment_subindex_graph(request: Request):
+    payload = await cached_payload("DailyInvestmentSubindexGraph", nepseAsync.getDailyInvestmentSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyLifeInsuranceSubindexGraph"])
-async def get_daily_life_insurance_subindex_graph():
-    data = await nepseAsync.getDailyLifeInsuranceSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_life_insurance_subindex_graph(request: Request):
+    payload = await cached_payload("DailyLifeInsuranceSubindexGraph", nepseAsync.getDailyLifeInsuranceSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyManufacturingProcessingSubindexGraph"])
-async def get_daily_manufacturing_processing_subindex_graph():
-    data = await nepseAsync.getDailyManufacturingSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_manufacturing_processing_subindex_graph(request: Request):
+    payload = await cached_payload("DailyManufacturingProcessingSubindexGraph", nepseAsync.getDailyManufacturingSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyMicrofinanceSubindexGraph"])
-async def get_daily_microfinance_subindex_graph():
-    data = await nepseAsync.getDailyMicrofinanceSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_microfinance_subindex_graph(request: Request):
+    payload = await cached_payload("DailyMicrofinanceSubindexGraph", nepseAsync.getDailyMicrofinanceSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyMutualFundSubindexGraph"])
-async def get_daily_mutual_fund_subindex_graph():
-    data = await nepseAsync.getDailyMutualfundSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_mutual_fund_subindex_graph(request: Request):
+    payload = await cached_payload("DailyMutualFundSubindexGraph", nepseAsync.getDailyMutualfundSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyNonLifeInsuranceSubindexGraph"])
-async def get_daily_non_life_insurance_subindex_graph():
-    data = await nepseAsync.getDailyNonLifeInsuranceSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_non_life_insurance_subindex_graph(request: Request):
+    payload = await cached_payload("DailyNonLifeInsuranceSubindexGraph", nepseAsync.getDailyNonLifeInsuranceSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyOthersSubindexGraph"])
-async def get_daily_others_subindex_graph():
-    data = await nepseAsync.getDailyOthersSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_others_subindex_graph(request: Request):
+    payload = await cached_payload("DailyOthersSubindexGraph", nepseAsync.getDailyOthersSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyTradingSubindexGraph"])
-async def get_daily_trading_subindex_graph():
-    data = await nepseAsync.getDailyTradingSubindexGraph()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_daily_trading_subindex_graph(request: Request):
+    payload = await cached_payload("DailyTradingSubindexGraph", nepseAsync.getDailyTradingSubindexGraph)
+    return payload_response(request, payload)
 
 @app.get(routes["DailyScripPriceGraph"])
-async def get_daily_scrip_price_graph(symbol: str):
+async def get_daily_scrip_price_graph(request: Request, symbol: str):
     validated_symbol = validate_stock_or_raise(symbol)
-    data = await nepseAsync.getDailyScripPriceGraph(validated_symbol)
-    return JSONResponse(content=data, headers=HEADERS)
+    payload = await cached_payload("DailyScripPriceGraph", nepseAsync.getDailyScripPriceGraph, validated_symbol)
+    return payload_response(request, payload)
 
 
 @app.get(routes["CompanyList"])
-async def get_company_list():
-    data = await nepseAsync.getCompanyList()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_company_list(request: Request):
+    payload = await cached_payload("CompanyList", nepseAsync.getCompanyList)
+    return payload_response(request, payload)
 
 
 @app.get(routes["SectorScrips"])
-async def get_sector_scrips():
-    data = await nepseAsync.getSectorScrips()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_sector_scrips(request: Request):
+    payload = await cached_payload("SectorScrips", nepseAsync.getSectorScrips)
+    return payload_response(request, payload)
 
 
 @app.get(routes["CompanyDetails"])
-async def get_company_details(symbol: str):
+async def get_company_details(request: Request, symbol: str):
     validated_symbol = validate_stock_or_raise(symbol)
-    data = await nepseAsync.getCompanyDetails(validated_symbol)
-    return JSONResponse(content=data, headers=HEADERS)
+    payload = await cached_payload("CompanyDetails", nepseAsync.getCompanyDetails, validated_symbol)
+    return payload_response(request, payload)
 
 
 @app.get(routes["PriceVolume"])
-async def get_price_volume():
-    data = await nepseAsync.getPriceVolume()
-    return JSONResponse(content=data, headers=HEADERS)
+async def get_price_volume(request: Request, limit: Optional[int] = None, cursor: Optional[str] = None,
+                           symbols: Optional[str] = None, sector: Optional[str] = None,
+                           sort: Optional[str] = None, fields: Optional[str] = None):
+    payload = await hot_payload("PriceVolume", nepseAsync.getPriceVolume)
+    return list_response(request, "PriceVolume", payload, limit, cursor, symbols, sector, sort, fields)
 
 
 @app.get(routes["PriceVolumeHistory"])
-async def get_price_volume_history(symbol: str):
+async def get_price_volume_history(request: Request, symbol: str):
     validated_symbol = validate_stock_or_raise(symbol)
-    data = await nepseAsync.getCompanyPriceVolumeHistory(validated_symbol)
-    return JSONResponse(content=data, headers=HEADERS)
+    payload = await cached_payload("PriceVolumeHistory", nepseAsync.getCompanyPriceVolumeHistory, validated_symbol)
+    return payload_response(request, payload)
 
 
 @app.get(routes["Floorsheet"])
-async def get_floorsheet():
-    floorsheet_data = await nepseAsync.getFloorSheet()
-    return JSONResponse(content=floorsheet_data, headers=HEADERS)
+async def get_floorsheet(request: Request, limit: Optional[int] = None, cursor: Optional[str] = None,
+                         symbols: Optional[str] = None, sector: Optional[str] = None,
+                         sort: Optional[str] = None, fields: Optional[str] = None):
+    payload = await cached_payload("Floorsheet", nepseAsync.getFloorSheet)
+    return list_response(request, "Floorsheet", payload, limit, cursor, symbols, sector, sort, fields)
+
+
+@app.get(routes["FloorsheetStream"])
+async def get_floorsheet_stream(symbol: Optional[str] = None, buyer: Optional[str] = None, seller: Optional[str] = None):
+    """Today's floorsheet as NDJSON, streamed page by page as upstream returns it"""
+    validated_symbol = validate_stock_or_raise(symbol) if symbol else None
+    return StreamingResponse(
+        stream_floorsheet_ndjson(nepseAsync, validated_symbol, buyer, seller),
+        media_type="application/x-ndjson",
+        headers={"Access-Control-Allow-Origin": "*"},
+    )
 
 
 @app.get(routes["FloorsheetOf"])
-async def get_floorsheet_of(symbol: str):
+async def get_floorsheet_of(request: Request, symbol: str):
     validated_symbol = validate_stock_or_raise(symbol)
-    data = await nepseAsync.getFloorSheetOf(validated_symbol)
-    return JSONResponse(content=data, headers=HEADERS)
+    payload = await cached_payload("FloorsheetOf", nepseAsync.getFloorSheetOf, validated_symbol)
+    return payload_response(request, payload)
 
 
 @app.get(routes["SecurityList"])
-async def getSecurityList():
-    data = await nepseAsync.getSecurityList()
-    return JSONResponse (content=data, headers=HEADERS)
+async def getSecurityList(request: Request, limit: Optional[int] = None, cursor: Optional[str] = None,
+                         symbols: Optional[str] = None, sector: Optional[str] = None,
+                         sort: Optional[str] = None, fields: Optional[str] = None):
+    payload = await cached_payload("SecurityList", nepseAsync.getSecurityList)
+    return list_response(request, "SecurityList", payload, limit, cursor, symbols, sector, sort, fields)
 
 @app.get(routes["TradeTurnoverTransactionSubindices"])
-async def getTradeTurnoverTransactionSubindices():
-    companies = {company["symbol"]: company for company in await nepseAsync.getCompanyList()}
-
-    turnover = {obj["symbol"]: obj for obj in await nepseAsync.getTopTenTurnoverScrips()}
-    transaction = {obj["symbol"]: obj for obj in await nepseAsync.getTopTenTransactionScrips()}
-    trade = {obj["symbol"]: obj for obj in await nepseAsync.getTopTenTradeScrips()}
-
-    gainers = {obj["symbol"]: obj for obj in await nepseAsync.getTopGainers()}
-    losers = {obj["symbol"]: obj for obj in await nepseAsync.getTopLosers()}
-
-    price_vol_info = {obj["symbol"]: obj for obj in await nepseAsync.getPriceVolume()}
-
-    sector_sub_indices = await _getNepseSubIndices()
-    # this is done since nepse sub indices and sector name are different
-    sector_mapper = {
-        "Commercial Banks": "Banking SubIndex",
-        "Development Banks": "Development Bank Index",
-        "Finance": "Finance Index",
-        "Hotels And Tourism": "Hotels And Tourism Index",
-        "Hydro Power": "HydroPower Index",
-        "Investment": "Investment Index",
-        "Life Insurance": "Life Insurance",
-        "Manufacturing And Processing": "Manufacturing And Processing",
-        "Microfinance": "Microfinance Index",
-        "Mutual Fund": "Mutual Fund",
-        "Non Life Insurance": "Non Life Insurance",
-        "Others": "Others Index",
-        "Tradings": "Trading Index",
-    }
-
-    scrips_details = {}
-    for symbol, company in companies.items():
-        company_details = {
-            "symbol": symbol,
-            "sector": company["sectorName"],
-            "Turnover": turnover.get(symbol, {}).get("turnover", 0),
-            "transaction": transaction.get(symbol, {}).get("totalTrades", 0),
-            "volume": trade.get(symbol, {}).get("shareTraded", 0),
-            "previousClose": price_vol_info.get(symbol, {}).get("previousClose", 0),
-            "lastUpdatedDateTime": price_vol_info.get(symbol, {}).get("lastUpdatedDateTime", 0),
-            "name": company.get("securityName", ""),
-            "lastUpdatedDateTime": price_vol_info.get(symbol, {}).get("lastUpdatedDateTime", 0),
-            "category": company.get("instrumentType"),
-        }
-
-        if symbol in gainers:
-            company_details.update({
-                "pointChange": gainers[symbol]["pointChange"],
-                "percentageChange": gainers[symbol]["percentageChange"],
-                "ltp": gainers[symbol]["ltp"],
-            })
-        elif symbol in losers:
-            company_details.update({
-                "pointChange": losers[symbol]["pointChange"],
-                "percentageChange": losers[symbol]["percentageChange"],
-                "ltp": losers[symbol]["ltp"],
-            })
-        else:
-            company_details.update({
-                "pointChange": 0,
-                "percentageChange": 0,
-                "ltp": 0,
-            })
-
-        #let's filter here based on ltp and previos close, if ltp = 0 or previous close = 0, then the company is not trading
-        if company_details["ltp"] == 0 or company_details["previousClose"] == 0:
+async def getTradeTurnoverTransactionSubindices(request: Request):
+    # Fetch all upstream pieces concurrently; only the company list is mandatory
+    try:
+        upstream, failures = await gather_upstream(
+            {
+                "CompanyList": lambda: cached("CompanyList", nepseAsync.getCompanyList),
+                "TopTenTurnoverScrips": lambda: cached("TopTenTurnoverScrips", nepseAsync.getTopTenTurnoverScrips),
+                "TopTenTransactionScrips": lambda: cached("TopTenTransactionScrips", nepseAsync.getTopTenTransactionScrips),
+                "TopTenTradeScrips": lambda: cached("TopTenTradeScrips", nepseAsync.getTopTenTradeScrips),
+                "TopGainers": lambda: cached("TopGainers", nepseAsync.getTopGainers),
+                "TopLosers": lambda: cached("TopLosers", nepseAsync.getTopLosers),
+                "PriceVolume": lambda: hot("PriceVolume", nepseAsync.getPriceVolume),
+                "NepseSubIndices": lambda: hot("NepseSubIndices", _get_nepse_subindices),
+            },
+            defaults={"NepseSubIndices": {}},
+            required=["CompanyList"],
+        )
+    except UpstreamUnavailable as e:
+        raise HTTPException(status_code=502, detail=str(e))
+
+    response = build_market_summary(upstream)
+    if failures:
+        # Partial result: tell the client which pieces are missing
+        response["unavailable"] = sorted(failures)
+    return payload_response(request, Payload(response))
+
+# Per-symbol routes that can be combined in one /batch call: route -> upstream fetcher
+BATCH_ROUTES = {
+    "CompanyDetails": nepseAsync.getCompanyDetails,
+    "PriceVolumeHistory": nepseAsync.getCompanyPriceVolumeHistory,
+    "DailyScripPriceGraph": nepseAsync.getDailyScripPriceGraph,
+    "FloorsheetOf": nepseAsync.getFloorSheetOf,
+    "MarketDepth": nepseAsync.getSymbolMarketDepth,
+}
+BATCH_MAX_REQUESTS = int(os.environ.get("BATCH_MAX_REQUESTS", 50))
+# Shared by all batches, so a burst of batches can't flood upstream
+batch_semaphore = asyncio.Semaphore(int(os.environ.get("BATCH_CONCURRENCY", 8)))
+
+class BatchItem(BaseModel):
+    route: str
+    # Plain JSON numbers are accepted too (e.g. {"size": 100}) and used as strings
+    params: Dict[str, Union[str, int, float]] = {}
+
+class BatchRequest(BaseModel):
+    requests: List[BatchItem]
+
+async def run_batch_item(route: str, symbol: str) -> Dict:
+    """Execute one batched lookup; errors are reported per item instead of failing the batch"""
+    async with batch_semaphore:
+        try:
+            payload = await cached_payload(route, BATCH_ROUTES[route], symbol)
+            return {"status": 200, "data": payload.data}
+        except Exception as e:
+            logger.error(f"Batch {route}({symbol}) failed: {e}")
+            return {"status": 502, "error": str(e)}
+
+async def charge_batch_items(client_ip: str, routes: List[str]) -> Optional[Dict]:
+    """
+    Charge each lookup against its own route's limit, as if it had been
+    requested directly. All or nothing: returns the rate limit info if
+    any route's limit can't cover its lookups, after refunding what was taken.
+    """
+    counts: Dict[str, int] = {}
+    for route in routes:
+        counts["/" + route] = counts.get("/" + route, 0) + 1
+
+    charged = []
+    for endpoint, count in counts.items():
+        granted, info = await rate_limiter.acquire_many_async(client_ip, endpoint, count)
+        if granted < count:
+            # Time for the missing tokens to be emitted again
+            shortfall = int(math.ceil((count - granted) * rate_limiter.window_size / info["limit"]))
+            info = {**info, "retry_after": max(info["retry_after"], shortfall, 1)}
+            await rate_limiter.refund_async(client_ip, endpoint, granted)
+            for charged_endpoint, charged_count in charged:
+                await rate_limiter.refund_async(client_ip, charged_endpoint, charged_count)
+            return info
+        charged.append((endpoint, count))
+    return None
+
+@app.post("/batch")
+async def batch(request: Request, body: BatchRequest):
+    """
+    Run several per-symbol lookups in one call.
+    Body: {"requests": [{"route": "CompanyDetails", "params": {"symbol": "NABIL"}}, ...]}
+    Results come back in request order; duplicates are executed once.
+    Each distinct lookup counts against its route's rate limit.
+    """
+    if len(body.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"A batch can hold at most {BATCH_MAX_REQUESTS} requests")
+
+    results: List[Optional[Dict]] = [None] * len(body.requests)
+    pending: Dict[tuple, List[int]] = {}
+    for position, item in enumerate(body.requests):
+        route = item.route.lstrip("/")
+        params = {key: str(value) for key, value in item.params.items()}
+        result = {"route": route, "params": params}
+        if route not in BATCH_ROUTES:
+            results[position] = {**result, "status": 404,
+                                  "error": f"Unsupported batch route. Available: {', '.join(BATCH_ROUTES)}"}
+            continue
+        try:
+            symbol = validate_stock_or_raise(params.get("symbol", ""))
+        except HTTPException as e:
+            results[position] = {**result, "status": e.status_code, "error": e.detail}
             continue
-        scrips_details[symbol] = company_details
-
-    sector_details = dict()
-    sectors = {company["sectorName"] for company in companies.values()}
-    for sector in sectors:
-        total_trades, total_trade_quantity, total_turnover = 0, 0, 0
-        for scrip_details in scrips_details.values():
-            if scrip_details["sector"] == sector:
-                total_trades += scrip_details["transaction"]
-                total_trade_quantity += scrip_details["volume"]
-                total_turnover += scrip_details["Turnover"]
-
-        sector_details[sector] = {
-            "transaction": total_trades,
-            "volume": total_trade_quantity,
-            "totalTurnover": total_turnover,
-            "turnover": sector_sub_indices[sector_mapper[sector]],
-            "sectorName": sector,
-        }
-
-    return JSONResponse({"scripsDetails": scrips_details, "sectorsDetails": sector_details}, headers=HEADERS)
-
-async def _getNepseSubIndices():
-    return {obj["index"]: obj for obj in await nepseAsync.getNepseSubIndices()}
+        results[position] = result
+        pending.setdefault((route, symbol), []).append(position)
+
+    keys = list(pending)
+    rejected = await charge_batch_items(client_ip_of(request), [route for route, _ in keys])
+    if rejected is not None:
+        return rate_limit_response(rejected)
+    outcomes = await asyncio.gather(*(run_batch_item(route, symbol) for route, symbol in keys))
+    for key, outcome in zip(keys, outcomes):
+        for position in pending[key]:
+            results[position].update(outcome)
+
+    return payload_response(request, Payload({"results": results}))
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,69 @@
+"""
+Request Coalescing (single-flight) for NEPSE API
+
+Concurrent callers asking for the same upstream resource share one
+in-flight task instead of each triggering its own AsyncNepse call.
+"""
+
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+logger = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls that share a key
+    """
+
+    def __init__(self):
+        # key -> task currently fetching that key
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+
+        # Counters
+        self.executions = 0     # Upstream calls actually made
+        self.deduplicated = 0   # Callers that joined an in-flight call
+        self.route_stats: Dict[str, Dict[str, int]] = {}
+
+    def _record(self, key: Hashable, outcome: str):
+        route = key[0] if isinstance(key, tuple) and key else str(key)
+        stats = self.route_stats.setdefault(route, {"executions": 0, "deduplicated": 0})
+        stats[outcome] += 1
+
+    def _forget(self, key: Hashable, task: asyncio.Task):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every caller went away
+        if not task.cancelled():
+            task.exception()
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `fn` unless a call with the same key is already in flight,
+        in which case wait for and share its result.
+        """
+        task = self._inflight.get(key)
+        if task is not None:
+            self.deduplicated += 1
+            self._record(key, "deduplicated")
+        else:
+            self.executions += 1
+            self._record(key, "executions")
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t, k=key: self._forget(k, t))
+
+        # Shield so one caller disconnecting doesn't cancel the shared call
+        return await asyncio.shield(task)
+
+    def get_stats(self) -> Dict:
+        """Get coalescing statistics"""
+        callers = self.executions + self.deduplicated
+        return {
+            "in_flight": len(self._inflight),
+            "executions": self.executions,
+            "deduplicated": self.deduplicated,
+            "dedup_ratio": round(self.deduplicated / callers, 4) if callers else 0.0,
+            "routes": self.route_stats,
+        }
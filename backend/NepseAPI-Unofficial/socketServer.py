@@ -3,12 +3,27 @@ import websockets
 from nepse import AsyncNepse
 import json
 import logging
+import os
 
 # Import validation utilities
-from validator import validate_stock_symbol, validate_index_name
+from validator import validate_stock_symbol, validate_index_name, validator
 
 # Import rate limiting
-from rate_limiter import check_rate_limit
+from rate_limiter import TokenLease, rate_limiter
+
+# Import request coalescing
+from single_flight import SingleFlight
+from fan_out import gather_upstream, UpstreamUnavailable
+from market_aggregation import build_market_summary
+
+# Import background snapshot poller
+from market_snapshots import MarketPoller, poller_enabled
+
+# Import push channels
+from pubsub import DELTA_TOPICS, SNAPSHOT_TOPICS, SYMBOL_TOPIC_PREFIX, TopicHub, symbol_topic
+from ws_channel import ChannelRegistry
+from wire_formats import Frame, Reply, ReplyBody, available_formats
+from payloads import Payload
 
 logger = logging.getLogger(__name__)
 
@@ -16,6 +31,9 @@ logger = logging.getLogger(__name__)
 nepseAsync = AsyncNepse()
 nepseAsync.setTLSVerification(False)
 
+# Concurrent identical requests from different clients share one upstream call
+upstream_flight = SingleFlight()
+
 # Common validation functions for WebSocket
 def validate_stock_or_return_error(symbol: str):
     """Validate stock symbol and return error dict if invalid"""
@@ -58,89 +76,137 @@ async def _get_nepse_subindices():
     return response
 
 async def _get_trade_turnover_transaction_subindices():
-    companies = {company["symbol"]: company for company in await nepseAsync.getCompanyList()}
-    turnover = {obj["symbol"]: obj for obj in await nepseAsync.getTopTenTurnoverScrips()}
-    transaction = {obj["symbol"]: obj for obj in await nepseAsync.getTopTenTransactionScrips()}
-    trade = {obj["symbol"]: obj for obj in await nepseAsync.getTopTenTradeScrips()}
-    gainers = {obj["symbol"]: obj for obj in await nepseAsync.getTopGainers()}
-    losers = {obj["symbol"]: obj for obj in await nepseAsync.getTopLosers()}
-    price_vol_info = {obj["symbol"]: obj for obj in await nepseAsync.getPriceVolume()}
-    sector_sub_indices = await _get_nepse_subindices()
-    sector_mapper = {
-        "Commercial Banks": "Banking SubIndex",
-        "Development Banks": "Development Bank Index",
-        "Finance": "Finance Index",
-        "Hotels And Tourism": "Hotels And Tourism Index",
-        "Hydro Power": "HydroPower Index",
-        "Investment": "Investment Index",
-        "Life Insurance": "Life Insurance",
-        "Manufacturing And Processing": "Manufacturing And Processing",
-        "Microfinance": "Microfinance Index",
-        "Mutual Fund": "Mutual Fund",
-        "Non Life Insurance": "Non Life Insurance",
-        "Others": "Others Index",
-        "Tradings": "Trading Index",
+    # Fetch all upstream pieces concurrently; only the company list is mandatory
+    try:
+        upstream, failures = await gather_upstream(
+            {
+                "CompanyList": nepseAsync.getCompanyList,
+                "TopTenTurnoverScrips": nepseAsync.getTopTenTurnoverScrips,
+                "TopTenTransactionScrips": nepseAsync.getTopTenTransactionScrips,
+                "TopTenTradeScrips": nepseAsync.getTopTenTradeScrips,
+                "TopGainers": nepseAsync.getTopGainers,
+                "TopLosers": nepseAsync.getTopLosers,
+                "PriceVolume": nepseAsync.getPriceVolume,
+                "NepseSubIndices": _get_nepse_subindices,
+            },
+            defaults={"NepseSubIndices": {}},
+            required=["CompanyList"],
+        )
+    except UpstreamUnavailable as e:
+        return {"error": str(e)}
+
+    response = build_market_summary(upstream)
+    if failures:
+        # Partial result: tell the client which pieces are missing
+        response["unavailable"] = sorted(failures)
+    return response
+
+# Hot endpoints are polled in the background and served from snapshots
+market_poller = MarketPoller(
+    fetchers={
+        "LiveMarket": nepseAsync.getLiveMarket,
+        "PriceVolume": nepseAsync.getPriceVolume,
+        "Summary": _get_summary,
+        "NepseIndex": _get_nepse_index,
+        "NepseSubIndices": _get_nepse_subindices,
+        "SupplyDemand": nepseAsync.getSupplyDemand,
+    },
+    market_status_fetcher=nepseAsync.isNepseOpen,
+)
+
+# Every frame to a client goes through its bounded send queue, so a slow
+# client drops or coalesces its own frames instead of buffering without limit
+ws_channels = ChannelRegistry()
+
+def deliver_to_channels(channels, topic: str, frame: Frame):
+    for channel in channels:
+        channel.push(topic, frame)
+
+# Subscribers get each new snapshot pushed; the poller is the only upstream caller
+topic_hub = TopicHub(latest=market_poller.latest, deliver=deliver_to_channels)
+market_poller.store.add_listener(topic_hub.on_snapshot)
+
+# Topics one connection may hold at once
+MAX_SUBSCRIPTIONS = int(os.environ.get("WS_MAX_SUBSCRIPTIONS", 100))
+
+async def _get_server_stats():
+    return {
+        "single_flight": upstream_flight.get_stats(),
+        "snapshots": market_poller.get_stats(),
+        "pubsub": topic_hub.get_stats(),
+        "send_queues": ws_channels.get_stats(),
     }
 
-    scrips_details = {}
-    for symbol, company in companies.items():
-        company_details = {
-            "symbol": symbol,
-            "sector": company["sectorName"],
-            "Turnover": turnover.get(symbol, {}).get("turnover", 0),
-            "transaction": transaction.get(symbol, {}).get("totalTrades", 0),
-            "volume": trade.get(symbol, {}).get("shareTraded", 0),
-            "previousClose": price_vol_info.get(symbol, {}).get("previousClose", 0),
-            "lastUpdatedDateTime": price_vol_info.get(symbol, {}).get("lastUpdatedDateTime", 0),
-            "name": company.get("securityName", ""),
-            "category": company.get("instrumentType"),
-        }
-
-        if symbol in gainers:
-            company_details.update({
-                "pointChange": gainers[symbol]["pointChange"],
-                "percentageChange": gainers[symbol]["percentageChange"],
-                "ltp": gainers[symbol]["ltp"],
-            })
-        elif symbol in losers:
-            company_details.update({
-                "pointChange": losers[symbol]["pointChange"],
-                "percentageChange": losers[symbol]["percentageChange"],
-                "ltp": losers[symbol]["ltp"],
-            })
+TOPIC_NAMES = f"{', '.join(SNAPSHOT_TOPICS + list(DELTA_TOPICS))}, {SYMBOL_TOPIC_PREFIX}<SYMBOL>"
+
+def resolve_topics(topics) -> dict:
+    """Validate requested topics; per-symbol topics are LiveMarket:<SYMBOL>"""
+    if isinstance(topics, str):
+        topics = [topics]
+    if not isinstance(topics, list) or not topics:
+        return {"error": f"topics must be a non-empty list. Available: {TOPIC_NAMES}"}
+
+    resolved = []
+    for topic in topics:
+        topic = str(topic).strip()
+        if topic in SNAPSHOT_TOPICS or topic in DELTA_TOPICS:
+            resolved.append(topic)
+        elif topic.startswith(SYMBOL_TOPIC_PREFIX):
+            validation_result = validate_stock_or_return_error(topic[len(SYMBOL_TOPIC_PREFIX):])
+            if "error" in validation_result:
+                return validation_result
+            resolved.append(symbol_topic(validation_result["symbol"]))
         else:
-            company_details.update({
-                "pointChange": 0,
-                "percentageChange": 0,
-                "ltp": 0,
-            })
-
-        if company_details["ltp"] == 0 or company_details["previousClose"] == 0:
-            continue
-        scrips_details[symbol] = company_details
-
-    sector_details = {}
-    sectors = {company["sectorName"] for company in companies.values()}
-    for sector in sectors:
-        total_trades, total_trade_quantity, total_turnover = 0, 0, 0
-        for scrip_details in scrips_details.values():
-            if scrip_details["sector"] == sector:
-                total_trades += scrip_details["transaction"]
-                total_trade_quantity += scrip_details["volume"]
-                total_turnover += scrip_details["Turnover"]
-
-        sector_details[sector] = {
-            "transaction": total_trades,
-            "volume": total_trade_quantity,
-            "totalTurnover": total_turnover,
-            "turnover": sector_sub_indices[sector_mapper.get(sector, sector)],
-            "sectorName": sector,
-        }
-
-    return {"scripsDetails": scrips_details, "sectorsDetails": sector_details}
+            return {"error": f"Unknown topic '{topic}'. Available: {TOPIC_NAMES}"}
+    return {"topics": resolved}
+
+def current_frames(topics):
+    """(topic, frame) for each topic the poller has a current snapshot of"""
+    return [(topic, frame) for topic in topics for frame in [topic_hub.current_frame(topic)] if frame is not None]
+
+def handle_subscription(channel, action: str, params: dict):
+    """
+    subscribe / unsubscribe / resync messages.
+    Returns the response data and the (topic, frame) pairs to push after it (current state of new topics).
+    """
+    held = topic_hub.topics_of.get(channel, set())
+    if action in ("unsubscribe", "resync") and not params.get("topics"):
+        if action == "resync":
+            # Full state of every held topic, e.g. after a gap in a delta topic's seq
+            return {"resynced": sorted(held)}, current_frames(sorted(held))
+        return {"unsubscribed": topic_hub.unsubscribe(channel)}, []
+
+    result = resolve_topics(params.get("topics"))
+    if "error" in result:
+        return result, []
+    if action == "unsubscribe":
+        return {"unsubscribed": topic_hub.unsubscribe(channel, result["topics"])}, []
+    if action == "resync":
+        topics = [topic for topic in result["topics"] if topic in held]
+        return {"resynced": topics}, current_frames(topics)
+
+    if len(held | set(result["topics"])) > MAX_SUBSCRIPTIONS:
+        return {"error": f"At most {MAX_SUBSCRIPTIONS} topics per connection"}, []
+    if not poller_enabled():
+        return {"error": "Push updates are disabled on this server (SNAPSHOT_POLLER=0)"}, []
+
+    added = topic_hub.subscribe(channel, result["topics"])
+    # Current state straight away; later frames arrive as the poller publishes them
+    return {"subscribed": sorted(topic_hub.topics_of.get(channel, ()))}, current_frames(added)
 
 # WebSocket handler
 async def handle_route(route: str, params: dict):
+    return (await route_payload(route, params)).data
+
+async def fetch_payload(handler) -> Payload:
+    return Payload(await handler())
+
+async def route_payload(route: str, params: dict) -> Payload:
+    """
+    A route's response as a Payload: the snapshot's own for polled routes, and one
+    shared by every caller of a coalesced upstream call otherwise, so encodings
+    cached on it are made once
+    """
     # Routes that require symbol validation
     symbol_routes = ["DailyScripPriceGraph", "CompanyDetails", "PriceVolumeHistory", "FloorsheetOf"]
 
@@ -149,7 +215,7 @@ async def handle_route(route: str, params: dict):
         symbol = params.get("symbol")
         validation_result = validate_stock_or_return_error(symbol)
         if "error" in validation_result:
-            return validation_result
+            return Payload(validation_result)
         # Update params with validated symbol
         params = {**params, "symbol": validation_result["symbol"]}
 
@@ -191,31 +257,77 @@ async def handle_route(route: str, params: dict):
         "SecurityList": lambda: nepseAsync.getSecurityList(),
         "TradeTurnoverTransactionSubindices": lambda: _get_trade_turnover_transaction_subindices(),
         "SupplyDemand": lambda: nepseAsync.getSupplyDemand(),
-        "NepseSubIndices": lambda: _get_nepse_subindices()
+        "NepseSubIndices": lambda: _get_nepse_subindices(),
+        "ServerStats": lambda: _get_server_stats(),
     }
 
     handler = route_handlers.get(route)
     if handler:
-        return await handler()
-    return {"error": "Route not found"}
+        if route == "ServerStats":
+            return Payload(await handler())
+        snapshot = market_poller.latest(route)
+        if snapshot is not None:
+            return snapshot.payload
+        key = (route, json.dumps(params, sort_keys=True, default=str))
+        return await upstream_flight.do(key, lambda: fetch_payload(handler))
+    return Payload({"error": "Route not found"})
+
+# Route requests one connection may have in flight at once
+MAX_INFLIGHT = int(os.environ.get("WS_MAX_INFLIGHT", 8))
+
+def rate_limit_block(info: dict) -> dict:
+    return {
+        "remaining": info["remaining"],
+        "limit": info["limit"],
+        "reset_time": info["reset_time"]
+    }
+
+def send_reply(channel, message: dict):
+    """Queue a reply on the connection's channel, encoded in its wire format"""
+    channel.reply(Frame(message))
+
+async def run_route_request(channel, route: str, params: dict, message_id, info: dict):
+    """Handle one route request and send its reply, correlated by messageId"""
+    try:
+        payload = await route_payload(route, params)
+    except asyncio.CancelledError:
+        send_reply(channel, {"messageId": message_id, "error": "Request cancelled", "cancelled": True})
+        raise
+    except Exception as route_error:
+        send_reply(channel, {"messageId": message_id, "error": str(route_error)})
+        return
+
+    # Structure response with messageId; the data is encoded once per payload and format
+    body = payload.derived("reply:" + route, ReplyBody)
+    channel.reply(Reply({"messageId": message_id, "rate_limit": rate_limit_block(info)}, body))
 
 # WebSocket listener
 async def ws_listener(websocket, path=None):
     # Get client IP for rate limiting
     client_ip = websocket.remote_address[0] if websocket.remote_address else "unknown"
+    # Message tokens are leased from the shared limiter in batches per connection
+    lease = TokenLease(rate_limiter, client_ip, "websocket_message")
+    # Route requests run concurrently, so a slow one doesn't hold up the rest;
+    # replies may arrive out of order and carry the request's messageId
+    inflight = {}
+    tasks = set()
+    channel = ws_channels.open(websocket, resync_frame=topic_hub.current_frame,
+                               is_delta=DELTA_TOPICS.__contains__)
 
     try:
         async for message in websocket:
+            message_id = None
             try:
                 # Check message rate limit
-                allowed, info = check_rate_limit(client_ip, "websocket_message")
+                allowed = lease.try_acquire() or await lease.refill()
+                info = lease.info
                 if not allowed:
-                    await websocket.send(json.dumps({
+                    send_reply(channel, {
                         "error": "Rate limit exceeded for messages",
                         "limit": info["limit"],
                         "remaining": info["remaining"],
                         "reset_time": info["reset_time"]
-                    }))
+                    })
                     continue
 
                 # Parse the incoming message as JSON
@@ -223,40 +335,85 @@ async def ws_listener(websocket, path=None):
                 route = request.get('route')
                 params = request.get('params', {})
                 message_id = request.get('messageId')
+                action = request.get('action')
+
+                if action == "format":
+                    # Switch this connection's wire format; frames sent from now on use it
+                    wire_format = params.get("format")
+                    if wire_format not in available_formats():
+                        send_reply(channel, {"messageId": message_id,
+                                             "error": f"Unsupported format '{wire_format}'. Available: {', '.join(available_formats())}"})
+                    else:
+                        channel.format = wire_format
+                        send_reply(channel, {"messageId": message_id, "data": {"format": wire_format}})
+                    continue
 
-                # Handle the route
-                response_data = await handle_route(route, params)
+                if action == "cancel":
+                    # Cancel an in-flight request by its messageId
+                    target = params.get("messageId")
+                    task = inflight.get(target) if target is not None else None
+                    if task is not None:
+                        task.cancel()
+                    send_reply(channel, {"messageId": message_id, "data": {"cancelled": task is not None, "target": target}})
+                    continue
 
-                # Structure response with messageId
-                response = {
-                    "messageId": message_id,
-                    "data": response_data,
-                    "rate_limit": {
-                        "remaining": info["remaining"],
-                        "limit": info["limit"],
-                        "reset_time": info["reset_time"]
-                    }
-                }
+                if action in ("subscribe", "unsubscribe", "resync"):
+                    # Subscription changes are quick and order-sensitive, so they run inline
+                    response_data, frames = handle_subscription(channel, action, params)
+                    send_reply(channel, {"messageId": message_id, "data": response_data,
+                                        "rate_limit": rate_limit_block(info)})
+                    for topic, frame in frames:
+                        channel.push(topic, frame)
+                    continue
+
+                if len(tasks) >= MAX_INFLIGHT:
+                    send_reply(channel, {"messageId": message_id,
+                                        "error": f"Too many requests in flight (limit {MAX_INFLIGHT})"})
+                    continue
+                if message_id is not None and message_id in inflight:
+                    send_reply(channel, {"messageId": message_id, "error": "messageId is already in flight"})
+                    continue
+
+                task = asyncio.create_task(run_route_request(channel, route, params, message_id, info))
+                tasks.add(task)
+                if message_id is not None:
+                    inflight[message_id] = task
 
-                # Send the response back to the client
-                await websocket.send(json.dumps(response))
+                def forget(t, message_id=message_id):
+                    tasks.discard(t)
+                    if inflight.get(message_id) is t:
+                        del inflight[message_id]
+                task.add_done_callback(forget)
 
             except json.JSONDecodeError:
                 # Handle invalid JSON
-                await websocket.send(json.dumps({"error": "Invalid JSON"}))
-            except Exception as route_error:
-                await websocket.send(json.dumps({
-                    "messageId": message_id if 'message_id' in locals() else None,
-                    "error": str(route_error)
-                }))
+                send_reply(channel, {"error": "Invalid JSON"})
+            except (TypeError, AttributeError):
+                # e.g. a JSON array, or an unhashable messageId
+                send_reply(channel, {"messageId": message_id, "error": "Invalid message"})
+            except Exception as e:
+                # One bad message must not close the connection
+                logger.error(f"Error handling WebSocket message {message_id!r}: {e}")
+                send_reply(channel, {"messageId": message_id, "error": str(e)})
 
     except Exception as e:
         logger.error(f"WebSocket Error: {e}")
     finally:
+        # Nobody is left to read the replies
+        for task in list(tasks):
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        topic_hub.unsubscribe(channel)
+        await lease.release()
+        await channel.close()
         await websocket.close()
 
 # Start WebSocket server on all interfaces
 async def start_ws_server():
+    if poller_enabled():
+        market_poller.start()
+    validator.start_watching()
     server = await websockets.serve(ws_listener, "0.0.0.0", 5555)
     print("WebSocket server started on ws://0.0.0.0:5555")
     await server.wait_closed()
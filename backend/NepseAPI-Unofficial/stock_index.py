@@ -0,0 +1,319 @@
+"""
+Prebuilt Stock Symbol Index for NEPSE API
+
+Built once from stockmap.json so that a miss in the validator does not
+scan every listed symbol:
+
+  - a sorted symbol array, searched with bisect, for prefix completion
+    ("NAB" -> NABIL, NABBC)
+  - a deletion index for typo candidates: every string reachable from a
+    symbol by deleting up to MAX_EDITS characters maps back to the symbol,
+    so a query only looks up its own deletions (16 keys for a 5-letter
+    symbol at two edits) instead of measuring its distance to every symbol
+
+Candidates are ranked by optimal string alignment distance (an adjacent
+transposition such as NBAIL counts as one edit), then by shared prefix.
+
+Company names are normalized once and indexed two ways: by their
+normalized key (the first significant word, as the validator has always
+matched) and by every word of the name in a token inverted index with
+bisect prefix search, so a lookup costs O(matches), not O(companies).
+"""
+
+import re
+import time
+from bisect import bisect_left
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+# Largest edit distance the deletion index can answer
+MAX_EDITS = 2
+
+# Common suffixes stripped from company names (in order of specificity)
+COMPANY_SUFFIXES = [
+    "microfinance laghubitta bittiya sanstha limited",
+    "laghubitta bittiya sanstha limited",
+    "bittiya sanstha limited",
+    "development bank limited",
+    "commercial bank limited",
+    "finance company limited",
+    "insurance company limited",
+    "life insurance company limited",
+    "hydropower development company limited",
+    "hydropower company limited",
+    "power company limited",
+    "manufacturing company limited",
+    "trading company limited",
+    "investment company limited",
+    "limited",
+    "ltd",
+    "company",
+    "co.",
+    "pvt.",
+    "private"
+]
+
+# Words that carry no meaning in a company name search
+NAME_STOPWORDS = {"the", "a", "an", "of", "and", "limited", "ltd", "co", "pvt", "private"}
+
+# Match quality, best first
+MATCH_TYPES = ("exact", "partial", "token")
+
+
+def normalize_company_name(name: str) -> str:
+    """Normalize company name for matching by removing common suffixes and keeping first significant word"""
+    if not name:
+        return ""
+
+    name = name.lower().strip()
+
+    for suffix in COMPANY_SUFFIXES:
+        if name.endswith(suffix):
+            name = name[:-len(suffix)].strip()
+            break
+
+    # Get the first significant word (skip common prefixes like "the", "a", "an")
+    words = name.split()
+    if words:
+        skip_words = {"the", "a", "an"}
+        for word in words:
+            if word not in skip_words and len(word) > 2:
+                return word
+        return words[0]
+
+    return name
+
+
+def name_tokens(name: str) -> List[str]:
+    """Searchable words of a company name or query, lowercased, in order"""
+    return [token for token in re.findall(r"[a-z0-9]+", name.lower()) if token not in NAME_STOPWORDS]
+
+
+def osa_distance(a: str, b: str, bound: Optional[int] = None) -> int:
+    """
+    Levenshtein plus adjacent transpositions (optimal string alignment).
+    With `bound`, returns bound + 1 as soon as the distance must exceed it.
+    """
+    if a == b:
+        return 0
+    before, previous = None, list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        left = i
+        for j, cb in enumerate(b, 1):
+            cost = previous[j - 1] if ca == cb else previous[j - 1] + 1
+            up = previous[j] + 1
+            left += 1
+            if up < left:
+                left = up
+            if cost < left:
+                left = cost
+            if before is not None and j > 1 and ca == b[j - 2] and a[i - 2] == cb and before[j - 2] + 1 < left:
+                left = before[j - 2] + 1
+            current.append(left)
+        # A transposition can reach back one row, so both rows must be over the bound
+        if bound is not None and min(current) > bound and min(previous) > bound:
+            return bound + 1
+        before, previous = previous, current
+    return previous[-1]
+
+
+def common_prefix(a: str, b: str) -> int:
+    n = 0
+    for ca, cb in zip(a, b):
+        if ca != cb:
+            break
+        n += 1
+    return n
+
+
+def deletions(word: str, edits: int) -> List[Tuple[str, int]]:
+    """(variant, characters deleted) for `word` and every deletion of up to `edits` characters"""
+    variants = {word: 0}
+    frontier = {word}
+    for depth in range(1, edits + 1):
+        frontier = {w[:i] + w[i + 1:] for w in frontier for i in range(len(w))} - variants.keys()
+        variants.update(dict.fromkeys(frontier, depth))
+    return list(variants.items())
+
+
+class DeletionIndex:
+    """
+    Symmetric-delete typo index: two words within k edits (insert, delete,
+    substitute or swap adjacent) share a string reachable by at most k
+    deletions from each, so candidates are the union of the query's deletion
+    variants' postings, verified with osa_distance.
+    """
+
+    def __init__(self, words: Iterable[str] = (), max_edits: int = MAX_EDITS):
+        self.max_edits = max_edits
+        # variant -> [(word, characters deleted from word)]
+        self.postings: Dict[str, List[Tuple[str, int]]] = {}
+        self.size = 0
+        for word in words:
+            self.size += 1
+            for variant, depth in deletions(word, max_edits):
+                self.postings.setdefault(variant, []).append((word, depth))
+
+    def search(self, word: str, tolerance: int) -> Dict[str, int]:
+        """word -> distance for every indexed word within `tolerance` edits"""
+        tolerance = min(tolerance, self.max_edits)
+        found: Dict[str, int] = {}
+        seen = set()
+        # Shallowest variants first, so the query itself (pure insertions) is seen before its deletions
+        for variant, query_depth in deletions(word, tolerance):
+            for candidate, depth in self.postings.get(variant, ()):
+                if candidate in seen:
+                    continue
+                seen.add(candidate)
+                if abs(len(candidate) - len(word)) > tolerance:
+                    continue
+                if query_depth == 0 or depth == 0:
+                    # One side is a subsequence of the other: the distance is the length difference
+                    distance = query_depth + depth
+                else:
+                    distance = osa_distance(word, candidate, tolerance)
+                if distance <= tolerance:
+                    found[candidate] = distance
+        return found
+
+
+def prefix_range(sorted_words: List[str], prefix: str) -> List[str]:
+    """Entries of a sorted list that start with `prefix`"""
+    start = bisect_left(sorted_words, prefix)
+    end = bisect_left(sorted_words, prefix + "\uffff", start)
+    return sorted_words[start:end]
+
+
+class NameIndex:
+    """Company name lookups, built once per stockmap"""
+
+    def __init__(self, stock_data: Dict):
+        # Stockmap order breaks ties, as the old linear scan did
+        self.order: Dict[str, int] = {}
+        self.names: Dict[str, str] = {}
+        self.keys: Dict[str, str] = {}
+        self.by_key: Dict[str, List[str]] = {}
+        self.by_token: Dict[str, Set[str]] = {}
+        for symbol, info in stock_data.items():
+            if not info or "name" not in info:
+                continue
+            name = info["name"]
+            self.order[symbol] = len(self.order)
+            self.names[symbol] = name
+            self.keys[symbol] = normalize_company_name(name)
+            self.by_key.setdefault(self.keys[symbol], []).append(symbol)
+            for token in name_tokens(name):
+                self.by_token.setdefault(token, set()).add(symbol)
+        self.sorted_keys = sorted(self.by_key)
+        self.sorted_tokens = sorted(self.by_token)
+
+    def _token_matches(self, token: str) -> Set[str]:
+        """Symbols with a name word starting with `token`"""
+        matches = set()
+        for word in prefix_range(self.sorted_tokens, token):
+            matches |= self.by_token[word]
+        return matches
+
+    def search(self, query: str) -> List[Tuple[str, str]]:
+        """
+        (symbol, match_type) for every company matching `query`, best first:
+          exact   - normalized keys are equal
+          partial - one normalized key is a prefix of the other
+          token   - every query word starts a word of the company name
+        """
+        key = normalize_company_name(query)
+        if not key:
+            return []
+        found: Dict[str, str] = {}
+
+        for symbol in self.by_key.get(key, ()):
+            found[symbol] = "exact"
+        # Company keys extending the query key, then query key extending a company key
+        partial_keys = prefix_range(self.sorted_keys, key)
+        partial_keys += [key[:i] for i in range(1, len(key)) if key[:i] in self.by_key]
+        for partial_key in partial_keys:
+            for symbol in self.by_key[partial_key]:
+                found.setdefault(symbol, "partial")
+
+        tokens = name_tokens(query)
+        all_tokens: Set[str] = set()
+        if tokens:
+            # Intersect from the rarest word's postings
+            postings = sorted((self._token_matches(token) for token in tokens), key=len)
+            all_tokens = set.intersection(*postings) if postings[0] else set()
+            for symbol in all_tokens:
+                found.setdefault(symbol, "token")
+
+        rank = {match_type: i for i, match_type in enumerate(MATCH_TYPES)}
+        return sorted(found.items(), key=lambda item: (
+            rank[item[1]],
+            # Within a match type, names containing every query word first
+            item[0] not in all_tokens,
+            len(self.keys[item[0]]) if item[1] == "partial" else 0,
+            self.order[item[0]],
+        ))
+
+
+class StockIndex:
+    """
+    Symbol and company name lookups over one stockmap.json snapshot.
+    Never modified after construction, so it can be shared across threads.
+    """
+
+    def __init__(self, stock_data: Dict, version: int = 1, mtime: Optional[int] = None):
+        self.version = version
+        # stockmap.json st_mtime_ns the data was read at
+        self.mtime = mtime
+        self.loaded_at = time.time()
+        self.stock_data = stock_data
+        self.symbols = frozenset(stock_data)
+        self.sorted_symbols = sorted(self.symbols)
+        self.typo_index = DeletionIndex(self.sorted_symbols)
+        self.names = NameIndex(stock_data)
+
+    @staticmethod
+    def tolerance(query: str) -> int:
+        """Edits allowed for a typo: one for very short symbols, two otherwise"""
+        return 1 if len(query) <= 3 else 2
+
+    def with_prefix(self, prefix: str, limit: Optional[int] = None) -> List[str]:
+        """Symbols starting with `prefix`, alphabetically"""
+        start = bisect_left(self.sorted_symbols, prefix)
+        matches = []
+        for symbol in self.sorted_symbols[start:]:
+            if not symbol.startswith(prefix) or (limit is not None and len(matches) >= limit):
+                break
+            matches.append(symbol)
+        return matches
+
+    def suggest(self, query: str, max_suggestions: int = 5) -> List[str]:
+        """Closest symbols to a mistyped or partial symbol, best first"""
+        query = query.upper().strip()
+        if not query:
+            return []
+
+        # symbol -> rank distance; a completion of a partial symbol counts as an exact hit
+        candidates = self.typo_index.search(query, self.tolerance(query))
+        if len(query) >= 2:
+            # More completions than we need so ranking can choose
+            for symbol in self.with_prefix(query, limit=max_suggestions * 4):
+                candidates[symbol] = 0
+        candidates.pop(query, None)
+
+        ranked = sorted(candidates, key=lambda symbol: (
+            candidates[symbol],
+            -common_prefix(query, symbol),
+            abs(len(symbol) - len(query)),
+            symbol,
+        ))
+        return ranked[:max_suggestions]
+
+    def get_stats(self) -> Dict:
+        return {
+            "version": self.version,
+            "loaded_at": int(self.loaded_at),
+            "symbols": len(self.symbols),
+            "typo_index_keys": len(self.typo_index.postings),
+            "company_names": len(self.names.names),
+            "name_tokens": len(self.names.by_token),
+        }
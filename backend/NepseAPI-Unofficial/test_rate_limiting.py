@@ -96,7 +96,7 @@ async def test_rate_limit_stats():
             if response.status_code == 200:
                 stats = response.json()
                 print(f"   📊 Total tracked IPs: {stats.get('total_tracked_ips', 0)}")
-                print(f"   📊 Active requests in window: {stats.get('active_requests_in_window', 0)}")
+                print(f"   📊 Active keys: {stats.get('active_keys', 0)}")
                 print(f"   📊 Window size: {stats.get('window_size_seconds', 0)} seconds")
                 print("   ✅ Stats endpoint working")
                 return True
@@ -153,8 +153,11 @@ class StockMapUpdater:
     def save_stock_map(self, stock_map: dict) -> bool:
         """Save the stock map to file"""
         try:
-            with open(STOCK_MAP_FILE, 'w', encoding='utf-8') as f:
+            # Write aside and rename, so running servers never read a half-written file
+            tmp_file = f"{STOCK_MAP_FILE}.tmp"
+            with open(tmp_file, 'w', encoding='utf-8') as f:
                 json.dump(stock_map, f, indent=2, ensure_ascii=False)
+            os.replace(tmp_file, STOCK_MAP_FILE)
 
             logger.info(f"Stock map saved successfully to {STOCK_MAP_FILE}")
             return True
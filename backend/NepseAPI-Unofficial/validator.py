@@ -2,36 +2,123 @@
 """
 Validation utilities for NEPSE API
 Provides validation for stock symbols and index names
+
+The stock index is immutable and replaced whole when stockmap.json
+changes (see reload() and start_watching()). Readers take a single
+reference to the current index and never lock.
 """
 
 import json
+import logging
 import os
+import threading
 from pathlib import Path
 from typing import Dict, List, Optional, Set
 
+from stock_index import StockIndex, normalize_company_name
+
+logger = logging.getLogger(__name__)
+
+# Seconds between stockmap.json mtime checks (0 disables the watcher)
+STOCKMAP_RELOAD_INTERVAL = float(os.environ.get("STOCKMAP_RELOAD_INTERVAL", 30))
+
 class NepseValidator:
     """Validator for NEPSE stock symbols and index names"""
 
     def __init__(self):
         self.base_path = Path(__file__).parent
-        self._stock_symbols: Optional[Set[str]] = None
+        self.stockmap_path = self.base_path / "stockmap.json"
         self._index_names: Optional[Set[str]] = None
-        self._stock_data: Optional[Dict] = None
+        self._stock_index: Optional[StockIndex] = None
+        # Serializes index builds only; the read path never takes it
+        self._reload_lock = threading.RLock()
+        self._watcher: Optional[threading.Thread] = None
+        self._stop_watching = threading.Event()
+        self.reloads = 0
+        self.reload_errors = 0
+        # mtime of a stockmap.json that failed to load, so the watcher does not retry it every tick
+        self._failed_mtime: Optional[int] = None
+
+    def _stockmap_mtime(self) -> Optional[int]:
+        try:
+            return self.stockmap_path.stat().st_mtime_ns
+        except OSError:
+            return None
+
+    def _build_stock_index(self, version: int) -> StockIndex:
+        """Read stockmap.json and build a new index; raises if the file is missing or invalid"""
+        # mtime first: if the file changes while we read it, the next check sees a newer mtime
+        mtime = self._stockmap_mtime()
+        with open(self.stockmap_path, 'r', encoding='utf-8') as f:
+            stock_data = json.load(f)
+        return StockIndex(stock_data, version=version, mtime=mtime)
 
     def _load_stock_data(self) -> Dict:
-        """Load stock data from stockmap.json"""
-        if self._stock_data is None:
-            stockmap_path = self.base_path / "stockmap.json"
+        """Stock data from stockmap.json (as of the current index)"""
+        return self.get_stock_index().stock_data
+
+    def get_stock_index(self) -> StockIndex:
+        """Prebuilt lookup structures for the loaded stockmap"""
+        index = self._stock_index
+        if index is None:
+            with self._reload_lock:
+                if self._stock_index is None:
+                    try:
+                        self._stock_index = self._build_stock_index(version=1)
+                    except FileNotFoundError:
+                        print(f"Warning: stockmap.json not found at {self.stockmap_path}")
+                        self._stock_index = StockIndex({}, version=1)
+                    except json.JSONDecodeError as e:
+                        print(f"Warning: Error parsing stockmap.json: {e}")
+                        self._stock_index = StockIndex({}, version=1)
+                index = self._stock_index
+        return index
+
+    def reload(self, force: bool = False) -> bool:
+        """
+        Rebuild the index if stockmap.json changed (or always, with force) and swap it in.
+        The old index keeps serving until the new one is complete; a missing or
+        half-written file leaves it in place. Returns True if a new index was swapped in.
+        """
+        with self._reload_lock:
+            current = self.get_stock_index()
+            mtime = self._stockmap_mtime()
+            if not force and (mtime is None or mtime in (current.mtime, self._failed_mtime)):
+                return False
+            try:
+                index = self._build_stock_index(version=current.version + 1)
+            except (OSError, ValueError) as e:
+                self._failed_mtime = mtime
+                self.reload_errors += 1
+                logger.warning(f"Keeping stock index v{current.version}, reload failed: {e}")
+                return False
+            # A single reference assignment: readers see the old index or the new one, never a mix
+            self._stock_index = index
+            self.reloads += 1
+            logger.info(f"Stock index v{index.version} loaded: {len(index.symbols)} symbols")
+            return True
+
+    def _watch(self, interval: float):
+        while not self._stop_watching.wait(interval):
             try:
-                with open(stockmap_path, 'r', encoding='utf-8') as f:
-                    self._stock_data = json.load(f)
-            except FileNotFoundError:
-                print(f"Warning: stockmap.json not found at {stockmap_path}")
-                self._stock_data = {}
-            except json.JSONDecodeError as e:
-                print(f"Warning: Error parsing stockmap.json: {e}")
-                self._stock_data = {}
-        return self._stock_data
+                self.reload()
+            except Exception as e:
+                logger.error(f"Stockmap watcher error: {e}")
+
+    def start_watching(self, interval: Optional[float] = None):
+        """Check stockmap.json for changes every `interval` seconds in a background thread"""
+        interval = STOCKMAP_RELOAD_INTERVAL if interval is None else interval
+        # Build the first index now rather than on the first request
+        self.get_stock_index()
+        if interval <= 0 or (self._watcher and self._watcher.is_alive()):
+            return
+        self._stop_watching.clear()
+        self._watcher = threading.Thread(target=self._watch, args=(interval,), name="stockmap-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop_watching.set()
+        self._watcher = None
 
     def _load_index_names(self) -> Set[str]:
         """Load index names from indexmap.py or define them directly"""
@@ -57,10 +144,7 @@ class NepseValidator:
 
     def get_valid_stock_symbols(self) -> Set[str]:
         """Get all valid stock symbols"""
-        if self._stock_symbols is None:
-            stock_data = self._load_stock_data()
-            self._stock_symbols = set(stock_data.keys())
-        return self._stock_symbols
+        return self.get_stock_index().symbols
 
     def get_valid_index_names(self) -> Set[str]:
         """Get all valid index names"""
@@ -80,10 +164,9 @@ class NepseValidator:
 
     def get_stock_info(self, symbol: str) -> Optional[Dict]:
         """Get stock information for a valid symbol"""
-        if not self.is_valid_stock_symbol(symbol):
+        if not symbol or not isinstance(symbol, str):
             return None
-        stock_data = self._load_stock_data()
-        return stock_data.get(symbol.upper())
+        return self.get_stock_index().stock_data.get(symbol.upper())
 
     def validate_stock_symbol(self, symbol: str) -> Dict:
         """Validate stock symbol and return result"""
@@ -136,82 +219,30 @@ class NepseValidator:
             }
 
     def _get_similar_symbols(self, symbol: str, max_suggestions: int = 5) -> List[str]:
-        """Get similar stock symbols for suggestions"""
+        """Get similar stock symbols for suggestions, closest first"""
         if not symbol:
             return []
-
-        symbol = symbol.upper()
-        valid_symbols = self.get_valid_stock_symbols()
-
-        # Find symbols that start with the same letters
-        similar = []
-        for valid_symbol in valid_symbols:
-            if valid_symbol.startswith(symbol[:2]):  # Match first 2 characters
-                similar.append(valid_symbol)
-            if len(similar) >= max_suggestions:
-                break
-
-        return similar[:max_suggestions]
+        return self.get_stock_index().suggest(symbol, max_suggestions)
 
     def get_stats(self) -> Dict:
         """Get validation statistics"""
+        index = self.get_stock_index()
         return {
-            "total_stocks": len(self.get_valid_stock_symbols()),
+            "total_stocks": len(index.symbols),
             "total_indices": len(self.get_valid_index_names()),
-            "sample_stocks": list(self.get_valid_stock_symbols())[:10],
-            "available_indices": list(self.get_valid_index_names())
+            "sample_stocks": list(index.symbols)[:10],
+            "available_indices": list(self.get_valid_index_names()),
+            "index": {
+                **index.get_stats(),
+                "reloads": self.reloads,
+                "reload_errors": self.reload_errors,
+                "watching": self._watcher is not None and self._watcher.is_alive()
+            }
         }
 
     def _normalize_company_name(self, name: str) -> str:
         """Normalize company name for matching by removing common suffixes and keeping first significant word"""
-        if not name:
-            return ""
-
-        # Convert to lowercase for comparison
-        name = name.lower().strip()
-
-        # Common suffixes to remove (in order of specificity)
-        suffixes_to_remove = [
-            "microfinance laghubitta bittiya sanstha limited",
-            "laghubitta bittiya sanstha limited",
-            "bittiya sanstha limited",
-            "development bank limited",
-            "commercial bank limited",
-            "finance company limited",
-            "insurance company limited",
-            "life insurance company limited",
-            "hydropower development company limited",
-            "hydropower company limited",
-            "power company limited",
-            "manufacturing company limited",
-            "trading company limited",
-            "investment company limited",
-            "limited",
-            "ltd",
-            "company",
-            "co.",
-            "pvt.",
-            "private"
-        ]
-
-        # Remove suffixes
-        for suffix in suffixes_to_remove:
-            if name.endswith(suffix):
-                name = name[:-len(suffix)].strip()
-                break
-
-        # Get the first significant word (skip common prefixes)
-        words = name.split()
-        if words:
-            # Skip common prefixes like "the", "a", "an"
-            skip_words = {"the", "a", "an"}
-            for word in words:
-                if word not in skip_words and len(word) > 2:
-                    return word
-            # If no significant word found, return first word
-            return words[0] if words else ""
-
-        return name
+        return normalize_company_name(name)
 
     def find_symbol_by_company_name(self, company_name: str) -> Dict:
         """Find stock symbol by company name (fuzzy matching)"""
@@ -223,37 +254,13 @@ class NepseValidator:
             }
 
         company_name = company_name.strip()
-        normalized_query = self._normalize_company_name(company_name)
-
-        stock_data = self._load_stock_data()
-        matches = []
-        exact_matches = []
-
-        for symbol, info in stock_data.items():
-            if not info or 'name' not in info:
-                continue
-
-            # Use 'name' field from stockmap.json instead of 'securityName'
-            security_name = info['name']
-            normalized_security = self._normalize_company_name(security_name)
-
-            # Exact match on normalized first word
-            if normalized_query.lower() == normalized_security.lower():
-                exact_matches.append({
-                    "symbol": symbol,
-                    "company_name": security_name,
-                    "match_type": "exact"
-                })
-            # Partial match (starts with)
-            elif normalized_security.lower().startswith(normalized_query.lower()) or normalized_query.lower().startswith(normalized_security.lower()):
-                matches.append({
-                    "symbol": symbol,
-                    "company_name": security_name,
-                    "match_type": "partial"
-                })
+        names = self.get_stock_index().names
 
-        # Return exact matches first, then partial matches
-        all_matches = exact_matches + matches
+        all_matches = [{
+            "symbol": symbol,
+            "company_name": names.names[symbol],
+            "match_type": match_type
+        } for symbol, match_type in names.search(company_name)]
 
         if all_matches:
             return {
@@ -0,0 +1,154 @@
+"""
+Compact WebSocket Wire Formats for NEPSE API
+
+A WebSocket client can switch its connection from JSON text frames to a
+more compact format:
+
+  - json: the default, one JSON text frame per message
+  - columnar: JSON, but every list of objects is sent as a schema header
+    and one array per row, so field names like "lastTradedPrice" appear
+    once per frame instead of once per row:
+        {"fields": ["symbol", "lastTradedPrice"], "rows": [["NABIL", 512.3], ...]}
+  - msgpack / msgpack-columnar: the same two layouts as MessagePack
+    binary frames (needs the msgpack package)
+
+A Frame wraps one outgoing message and encodes it at most once per
+format, so a pushed snapshot is encoded once per format in use, not once
+per subscriber. A Reply does the same for route replies: the data is a
+ReplyBody cached on the snapshot or upstream payload it came from, and
+only the small per-request envelope (messageId, rate_limit) is encoded
+around it for each client.
+"""
+
+from operator import itemgetter
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from payloads import encode_json
+
+try:
+    import msgpack
+except ImportError:  # optional, the JSON formats are always available
+    msgpack = None
+
+DEFAULT_FORMAT = "json"
+FORMATS = ("json", "columnar", "msgpack", "msgpack-columnar")
+
+
+def available_formats() -> List[str]:
+    if msgpack is None:
+        return [fmt for fmt in FORMATS if not fmt.startswith("msgpack")]
+    return list(FORMATS)
+
+
+def columnar(data: Any) -> Any:
+    """Lists of objects as {"fields", "rows"} tables; object values are converted recursively"""
+    if isinstance(data, dict):
+        return {key: columnar(value) for key, value in data.items()}
+    if not isinstance(data, list) or not data or not all(isinstance(row, dict) for row in data):
+        return data
+    # Union of the rows' fields in first-seen order; a row without a field gets null
+    fields = list(dict.fromkeys(field for row in data for field in row))
+    if len(fields) > 1 and all(len(row) == len(fields) for row in data):
+        # Every row has every field: itemgetter pulls a row's values in one call
+        get = itemgetter(*fields)
+        return {"fields": fields, "rows": [list(get(row)) for row in data]}
+    return {"fields": fields, "rows": [[row.get(field) for field in fields] for row in data]}
+
+
+def is_columnar(fmt: str) -> bool:
+    return fmt.endswith("columnar")
+
+
+def encode_value(value: Any, fmt: str) -> bytes:
+    """A value (already in the format's layout) in the format's encoding"""
+    if fmt in ("json", "columnar"):
+        return encode_json(value)
+    if fmt in ("msgpack", "msgpack-columnar") and msgpack is not None:
+        return msgpack.packb(value, use_bin_type=True)
+    raise ValueError(f"Unsupported wire format: {fmt}")
+
+
+def columnar_message(message: Dict) -> Dict:
+    """The message with its "data" in columnar layout (other keys are small and left alone)"""
+    if "data" not in message:
+        return message
+    return {**message, "data": columnar(message["data"])}
+
+
+class Frame:
+    """
+    One outgoing message, encoded lazily and at most once per format
+    """
+
+    __slots__ = ("message", "_encoded", "_columnar", "on_encode")
+
+    def __init__(self, message: Dict, on_encode: Optional[Callable[[str, int], None]] = None):
+        self.message = message
+        self._encoded: Dict[str, Union[str, bytes]] = {}
+        self._columnar: Optional[Dict] = None
+        # Called with (format, size) each time a new encoding is made, for stats
+        self.on_encode = on_encode
+
+    def _columnar_message(self) -> Dict:
+        if self._columnar is None:
+            self._columnar = columnar_message(self.message)
+        return self._columnar
+
+    def encoded(self, fmt: str = DEFAULT_FORMAT) -> Union[str, bytes]:
+        """Text (str) for the JSON formats, binary (bytes) for MessagePack"""
+        frame = self._encoded.get(fmt)
+        if frame is None:
+            frame = encode_value(self._columnar_message() if is_columnar(fmt) else self.message, fmt)
+            if not fmt.startswith("msgpack"):
+                frame = frame.decode("utf-8")
+            self._encoded[fmt] = frame
+            if self.on_encode is not None:
+                self.on_encode(fmt, len(frame))
+        return frame
+
+
+class ReplyBody:
+    """
+    The data of a route reply, encoded at most once per format.
+    Built with Payload.derived, so every request served from the same payload shares it.
+    """
+
+    __slots__ = ("data", "_encoded", "_columnar")
+
+    def __init__(self, data: Any):
+        self.data = data
+        self._encoded: Dict[str, bytes] = {}
+        self._columnar: Any = None
+
+    def encoded(self, fmt: str) -> bytes:
+        body = self._encoded.get(fmt)
+        if body is None:
+            if is_columnar(fmt) and self._columnar is None:
+                self._columnar = columnar(self.data)
+            body = encode_value(self._columnar if is_columnar(fmt) else self.data, fmt)
+            self._encoded[fmt] = body
+        return body
+
+
+class Reply(Frame):
+    """
+    A reply to one request: its envelope (messageId, rate_limit, ...) is encoded per
+    request and the shared body's encoding is spliced in as "data"
+    """
+
+    __slots__ = ("body",)
+
+    def __init__(self, envelope: Dict, body: ReplyBody):
+        super().__init__(envelope)
+        self.body = body
+
+    def encoded(self, fmt: str = DEFAULT_FORMAT) -> Union[str, bytes]:
+        body = self.body.encoded(fmt)
+        envelope = self.message
+        if fmt.startswith("msgpack"):
+            # A map header, then the envelope's keys and values, then "data" and the packed body
+            head = msgpack.Packer(use_bin_type=True).pack_map_header(len(envelope) + 1)
+            fields = b"".join(encode_value(key, fmt) + encode_value(value, fmt) for key, value in envelope.items())
+            return head + fields + encode_value("data", fmt) + body
+        head = encode_json(envelope)[:-1]
+        return (head + (b',"data":' if envelope else b'"data":') + body + b"}").decode("utf-8")
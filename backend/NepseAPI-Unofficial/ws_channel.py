@@ -0,0 +1,260 @@
+"""
+Bounded WebSocket Send Queues for NEPSE API
+
+Every frame for a connection (replies and pushed topic frames) goes
+through its Channel: a bounded queue drained by one sender task. A slow
+client can therefore hold at most `max_queue` frames of server memory:
+
+  - coalesce (default): a new frame for a topic replaces that topic's
+    frame still waiting in the queue, so the client gets the latest state
+  - drop_oldest: a full queue drops its oldest pushed frame
+
+Replies are never dropped. A dropped or coalesced delta frame would
+leave a gap in the client's sequence, so the topic's queued deltas are
+replaced by a resync marker that becomes a full frame when it is sent.
+A client that has lost frames and not caught up (emptied its queue)
+within `lag_timeout` seconds is disconnected.
+
+Frames are encoded in the connection's wire format (see wire_formats)
+only when they are sent.
+"""
+
+import asyncio
+import logging
+import os
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, Optional, Set
+
+import websockets
+
+from wire_formats import DEFAULT_FORMAT, Frame
+
+logger = logging.getLogger(__name__)
+
+POLICIES = ("coalesce", "drop_oldest")
+
+# Close code for clients that cannot keep up ("Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+
+class Channel:
+    """
+    One connection's outgoing frames
+    """
+
+    def __init__(self, websocket, max_queue: int, policy: str, lag_timeout: float,
+                 resync_frame: Callable[[str], Optional[Frame]], is_delta: Callable[[str], bool],
+                 registry: Optional["ChannelRegistry"] = None):
+        self.websocket = websocket
+        self.max_queue = max_queue
+        self.policy = policy
+        self.lag_timeout = lag_timeout
+        # Full frame for a delta topic, resolved when a resync marker is sent
+        self.resync_frame = resync_frame
+        self.is_delta = is_delta
+        self.registry = registry
+        # Wire format the client negotiated
+        self.format = DEFAULT_FORMAT
+
+        # Entries are [kind, topic, frame]; kind is "reply", "push" or "resync"
+        self.queue: deque = deque()
+        # Topic -> its queued push (or resync) entry, for coalescing
+        self.pending: Dict[str, list] = {}
+        self.replies = 0
+        self._ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._close_task: Optional[asyncio.Task] = None
+        # Set when a frame is first dropped or coalesced, cleared once the queue drains
+        self.lagging_since: Optional[float] = None
+        self.closed = False
+
+        # Counters
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.resyncs = 0
+        self.max_depth = 0
+
+    def start(self):
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        if self.registry is not None:
+            self.registry.add(self)
+
+    async def close(self):
+        self.closed = True
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.registry is not None:
+            self.registry.remove(self)
+
+    @property
+    def depth(self) -> int:
+        return len(self.queue)
+
+    def reply(self, frame: Frame):
+        """Queue a reply to a client message; replies are never dropped"""
+        if self.closed:
+            return
+        self.replies += 1
+        self._append(["reply", None, frame])
+
+    def push(self, topic: str, frame: Frame):
+        """Queue a pushed topic frame under the channel's policy"""
+        if self.closed:
+            return
+        self._check_lag()
+        pending = self.pending.get(topic)
+        if pending is not None and pending[0] == "resync":
+            # The resync will send the latest full state, which includes this frame
+            self._count("coalesced")
+            return
+        if pending is not None and self.policy == "coalesce":
+            if self.is_delta(topic):
+                # Two deltas cannot be merged in place; send the full state instead
+                self._resync(topic)
+            else:
+                pending[2] = frame
+            self._count("coalesced")
+            return
+
+        if len(self.queue) - self.replies >= self.max_queue:
+            self._drop_oldest_push()
+        entry = ["push", topic, frame]
+        self.pending[topic] = entry
+        self._append(entry)
+
+    def _append(self, entry: list):
+        self.queue.append(entry)
+        self.max_depth = max(self.max_depth, len(self.queue))
+        self._ready.set()
+
+    def _drop_oldest_push(self):
+        for entry in self.queue:
+            if entry[0] == "push":
+                self.queue.remove(entry)
+                if self.pending.get(entry[1]) is entry:
+                    del self.pending[entry[1]]
+                self._count("dropped")
+                if self.is_delta(entry[1]):
+                    self._resync(entry[1])
+                return
+
+    def _resync(self, topic: str):
+        """Replace a delta topic's queued frames with one marker, resolved to a full frame on send"""
+        for entry in [entry for entry in self.queue if entry[1] == topic]:
+            self.queue.remove(entry)
+        marker = ["resync", topic, None]
+        self.pending[topic] = marker
+        self.queue.append(marker)
+        self._count("resyncs")
+
+    def _count(self, counter: str):
+        setattr(self, counter, getattr(self, counter) + 1)
+        if self.registry is not None:
+            self.registry.count(counter)
+        if self.lagging_since is None:
+            self.lagging_since = time.monotonic()
+
+    def _check_lag(self):
+        """Disconnect a client that has been losing frames for longer than lag_timeout"""
+        if self.lagging_since is None or time.monotonic() - self.lagging_since <= self.lag_timeout:
+            return
+        self.closed = True
+        if self.registry is not None:
+            self.registry.count("disconnected")
+        logger.warning(f"Disconnecting slow WebSocket client {self.websocket.remote_address}: "
+                       f"behind for over {self.lag_timeout}s with {self.depth} frames queued")
+        self._close_task = asyncio.get_running_loop().create_task(
+            self.websocket.close(SLOW_CONSUMER_CLOSE_CODE, "Client too slow"))
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            while self.queue:
+                kind, topic, frame = entry = self.queue.popleft()
+                if kind == "reply":
+                    self.replies -= 1
+                elif self.pending.get(topic) is entry:
+                    del self.pending[topic]
+                if kind == "resync":
+                    frame = self.resync_frame(topic)
+                    if frame is None:
+                        continue
+                try:
+                    # Waits while the socket's write buffer is above its high-water mark
+                    await self.websocket.send(frame.encoded(self.format))
+                except websockets.ConnectionClosed:
+                    self.closed = True
+                    self.queue.clear()
+                    self.pending.clear()
+                    self.replies = 0
+                    return
+                self.sent += 1
+            self.lagging_since = None
+            self._ready.clear()
+
+    def get_stats(self) -> Dict:
+        return {
+            "depth": self.depth,
+            "max_depth": self.max_depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced,
+            "resyncs": self.resyncs,
+        }
+
+
+class ChannelRegistry:
+    """
+    Open channels plus server-wide counters, with the queue settings from the environment
+    """
+
+    def __init__(self, max_queue: Optional[int] = None, policy: Optional[str] = None,
+                 lag_timeout: Optional[float] = None):
+        self.max_queue = max_queue or int(os.environ.get("WS_QUEUE_SIZE", 64))
+        self.policy = policy or os.environ.get("WS_QUEUE_POLICY", "coalesce").lower()
+        if self.policy not in POLICIES:
+            logger.warning(f"Unknown WS_QUEUE_POLICY '{self.policy}', using coalesce")
+            self.policy = "coalesce"
+        self.lag_timeout = lag_timeout or float(os.environ.get("WS_LAG_TIMEOUT", 30))
+        self.channels: Set[Channel] = set()
+        self.totals = {"dropped": 0, "coalesced": 0, "resyncs": 0, "disconnected": 0}
+
+    def open(self, websocket, resync_frame: Callable[[str], Optional[Frame]],
+             is_delta: Callable[[str], bool]) -> Channel:
+        channel = Channel(websocket, self.max_queue, self.policy, self.lag_timeout,
+                          resync_frame, is_delta, registry=self)
+        channel.start()
+        return channel
+
+    def add(self, channel: Channel):
+        self.channels.add(channel)
+
+    def remove(self, channel: Channel):
+        self.channels.discard(channel)
+
+    def count(self, counter: str):
+        self.totals[counter] += 1
+
+    def get_stats(self) -> Dict:
+        depths = [channel.depth for channel in self.channels]
+        return {
+            "policy": self.policy,
+            "max_queue": self.max_queue,
+            "lag_timeout_seconds": self.lag_timeout,
+            "connections": len(depths),
+            "queued_frames": sum(depths),
+            "max_queue_depth": max(depths, default=0),
+            "lagging_connections": sum(1 for channel in self.channels if channel.lagging_since is not None),
+            "dropped_frames": self.totals["dropped"],
+            "coalesced_frames": self.totals["coalesced"],
+            "resyncs": self.totals["resyncs"],
+            "disconnected_slow_clients": self.totals["disconnected"],
+            "formats": dict(Counter(channel.format for channel in self.channels)),
+        }